@@ -0,0 +1,399 @@
+###
+# Headless counterpart to inputs.py: runs the whole analysis over many Strava exports without any prompts.
+#
+#   python batch.py "exports/*/activities.csv" --output-dir club_reports --workers 8
+#   python batch.py --config nightly.json
+#
+# The config file is JSON. It can hold "exports" (a list of paths or glob patterns), "output_dir", "workers" and any
+# of the optional inputs.py answers: current_year, num_weeks_current_year, num_weeks_typical, num_weeks_first_year,
+# start_date, end_date, degree, rounded_running_length, trend_method and route_id. Command line arguments take
+# precedence over the config.
+# Each export's graphs and weekly averages are saved in their own directory under the output directory.
+# With --incremental (or "incremental": true) each athlete directory also keeps a store of the activities and running
+# totals seen so far, and only activities that are new since the last run are cleaned and aggregated.
+# With --trace (or "trace": true) each athlete directory gets a trace.json recording the wall time, CPU time, peak
+# memory growth and rows of every stage, and --profile-stage "<stage name>" also saves cProfile stats of that stage next
+# to it.
+# With --club-report (or "club_report": true) every export is also reduced to small partial aggregates in the same pass,
+# and the merged club-wide and per-athlete weekly averages, distance counts and heart rate vs. pace fits are saved in
+# the club/ directory under the output directory.
+# Each athlete directory also gets a training_load.csv of the daily TRIMP, ATL, CTL and TSB. With --incremental the
+# training load state is kept in the store, and only the days since the last run, and the recent days late uploads
+# changed, are written over it.
+# With --chunk-size N (or "chunk_size": N) each export is read N rows at a time and only reduced to its partial
+# aggregates, so exports larger than memory can be analyzed. Repeated activities are still found across the whole
+# export. Each athlete directory then only gets weekly_averages.csv, and --club-report saves the rest of the tables.
+# With --route-id ID (or "route_id": ID) the GPS tracks of the export's runs are parsed into a stream store in the
+# athlete directory and grouped into routes, and the pace over time graph only shows the runs of route ID. Route IDs
+# are the lowest Activity ID of the route, so they belong to one export; the most run routes are printed on the way.
+# With --best-effort NAME (or "best_effort": NAME), such as 5K, the fastest stretch of every standard distance in each
+# run is found in the same stream store and saved as best_efforts.csv and personal_records.csv, and the pace over time
+# graph also draws how the NAME record progressed.
+###
+
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import activity_streams
+from src import best_efforts
+from src import chunked_pipeline
+from src import club_aggregation
+from src import data_cleaning
+from src import incremental_ingest
+from src import heart_rate_influences
+from src import pace_over_time
+from src import route_clustering
+from src import training_load
+from src.mileage_and_time_run_per_week import create_weekly_avg_df, weekly_avg_chart_job, \
+    weekly_time_spent_running_chart_job
+from utils import instrumentation
+from utils import memoization
+from utils.plotting import render_charts
+from utils.running_utils import create_running_df, add_unit_columns
+import inputs
+
+OPTION_NAMES = ['current_year', 'num_weeks_current_year', 'num_weeks_typical', 'num_weeks_first_year', 'start_date',
+                'end_date', 'degree', 'rounded_running_length', 'trend_method', 'route_id', 'best_effort']
+
+
+def expand_export_paths(patterns):
+    """
+
+    :param patterns: list of paths or glob patterns pointing at 'activities.csv' files
+    :return: sorted list of unique matching file paths
+    """
+    file_paths = set()
+
+    for pattern in patterns:
+        matches = glob.glob(os.path.expanduser(pattern), recursive=True)
+        if not matches:
+            print(f"No exports found for {pattern}")
+        file_paths.update(os.path.abspath(match) for match in matches)
+
+    return sorted(file_paths)
+
+
+def get_athlete_dirs(file_paths, output_dir):
+    """
+    Names each export's output directory after the folder the export lives in, such as strava_export_36240949,
+    adding a numeric suffix when two exports share a folder name.
+
+    :param file_paths: list of 'activities.csv' file paths
+    :param output_dir: directory under which the per-athlete directories are created
+    :return: dictionary of file path to output directory
+    """
+    athlete_names = club_aggregation.get_athlete_names(file_paths)
+
+    return {file_path: os.path.join(output_dir, athlete_names[file_path]) for file_path in file_paths}
+
+
+def run_export(file_path, athlete_dir, options, incremental=False, trace=False, profile_stage=None,
+               club_report=False, chunk_size=None):
+    """
+
+    :param file_path: path to the 'activities.csv' file
+    :param athlete_dir: directory the export's graphs and tables are saved in
+    :param options: dictionary of optional inputs, keyed by the names in OPTION_NAMES
+    :param incremental: if True, only ingest the activities that aren't yet in the store kept in athlete_dir
+    :param trace: if True, save a trace of the export's pipeline stages as trace.json in athlete_dir
+    :param profile_stage: name of a stage to save cProfile stats of when tracing
+    :param club_report: if True, also reduce the export's runs to a club_aggregation.ClubPartial
+    :param chunk_size: if given, read the export this many rows at a time and only reduce it to its ClubPartial, with
+    analyze_export_in_chunks
+    :return: tuple of athlete_dir and the export's ClubPartial, or None without club_report
+    """
+    os.makedirs(athlete_dir, exist_ok=True)
+
+    if not trace:
+        return analyze_export(file_path, athlete_dir, options, incremental, club_report, chunk_size)
+
+    instrumentation.enable(os.path.join(athlete_dir, 'trace.json'), profile_stage=profile_stage, write_at_exit=False)
+    try:
+        return analyze_export(file_path, athlete_dir, options, incremental, club_report, chunk_size)
+    finally:
+        instrumentation.write_trace()
+        instrumentation.disable()
+
+
+def analyze_export(file_path, athlete_dir, options, incremental, club_report, chunk_size=None):
+    """
+    Runs the same pipeline as inputs.main for one export, taking every optional answer from options or its default.
+    """
+    if chunk_size is not None:
+        return analyze_export_in_chunks(file_path, athlete_dir, options, club_report, chunk_size)
+
+    running_df, weekly_avg_df, chart_jobs = compute_export(file_path, athlete_dir, options, incremental)
+    weekly_avg_df.to_csv(os.path.join(athlete_dir, 'weekly_averages.csv'), index=False)
+
+    # Exports are already spread over the worker processes, so render this export's charts in this one
+    render_charts(chart_jobs, max_workers=1)
+
+    training_load_path = os.path.join(athlete_dir, 'training_load.csv')
+    try:
+        if incremental:
+            training_load_df = training_load.run(running_df, os.path.join(athlete_dir, 'store', 'training_load.json'))
+            training_load.save_training_load(training_load_df, training_load_path)
+        else:
+            training_load.compute_training_load(running_df)[0].to_csv(training_load_path)
+    except ValueError as e:
+        print(f"Skipping the training load of {file_path}: {e}")
+
+    partial = None
+    if club_report:
+        partial = club_aggregation.create_partial_from_running_df(running_df, os.path.basename(athlete_dir))
+
+    return athlete_dir, partial
+
+
+def analyze_export_in_chunks(file_path, athlete_dir, options, club_report, chunk_size):
+    """
+    Reduces one export to its ClubPartial with chunked_pipeline.run, so only chunk_size rows of it are in memory at a
+    time, and saves its weekly averages from the partial. The graphs and the training load need every run at once, so
+    they are not made.
+    """
+    partial = chunked_pipeline.run(file_path, os.path.basename(athlete_dir), chunk_size=int(chunk_size))
+
+    # Options left unset get the same defaults as analyze_export's, counted from the partial's weeks
+    current_year, num_weeks_current_year, num_weeks_first_year = (
+        int(options[option_name]) if options.get(option_name) else None
+        for option_name in ['current_year', 'num_weeks_current_year', 'num_weeks_first_year'])
+    weekly_avg_df = club_aggregation.create_weekly_avg_df(
+        partial, num_weeks_typical=int(options.get('num_weeks_typical') or 52), current_year=current_year,
+        num_weeks_current_year=num_weeks_current_year, num_weeks_first_year=num_weeks_first_year)
+    weekly_avg_df.to_csv(os.path.join(athlete_dir, 'weekly_averages.csv'), index=False)
+
+    return athlete_dir, partial if club_report else None
+
+
+def compute_export(file_path, athlete_dir, options, incremental=False, use_cache=True):
+    """
+    Computes every table, fit and chart of one export without rendering anything, so matplotlib is never imported.
+    The tables and fits are kept in athlete_dir with memoization.run_stage, so only the ones whose runs or parameters
+    changed since the last run are computed again.
+
+    :param file_path: path to the 'activities.csv' file
+    :param athlete_dir: directory the export's charts would be saved in, and its store kept in
+    :param options: dictionary of optional inputs, keyed by the names in OPTION_NAMES
+    :param incremental: if True, only ingest the activities that aren't yet in the store kept in athlete_dir
+    :param use_cache: if False, compute every table and fit without keeping them
+    :return: tuple of the running data frame, the weekly averages data frame and the list of chart jobs
+    """
+    store_dir = os.path.join(athlete_dir, 'store')
+    cache_dir = os.path.join(athlete_dir, memoization.STAGE_CACHE_DIR) if use_cache else None
+
+    if incremental:
+        _, period_totals_df = incremental_ingest.run(file_path, store_dir)
+        # The weekly averages come from the stored totals, and only the graphs need the stored runs themselves
+        cleaned_df = incremental_ingest.load_activities(store_dir, activity_type='Run')
+    else:
+        cleaned_df = data_cleaning.run(file_path)
+    running_df = create_running_df(cleaned_df)
+    running_df = add_unit_columns(dataframe=running_df, distance_m_col_name='Distance.1', m_to_mi_conversion=1 / 1610)
+
+    current_year, num_weeks_current_year, num_weeks_typical = inputs.get_yearly_data_defaults(running_df)
+    current_year = int(options.get('current_year') or current_year)
+    num_weeks_current_year = int(options.get('num_weeks_current_year') or num_weeks_current_year)
+    num_weeks_typical = int(options.get('num_weeks_typical') or num_weeks_typical)
+    num_weeks_first_year = int(options.get('num_weeks_first_year') or
+                               inputs.get_first_year_weeks_default(running_df, num_weeks_typical))
+
+    if incremental:
+        weekly_avg_df = incremental_ingest.create_weekly_avg_df(
+            store_dir, num_weeks_current_year=num_weeks_current_year, num_weeks_typical=num_weeks_typical,
+            current_year=current_year, num_weeks_first_year=num_weeks_first_year, period_totals_df=period_totals_df)
+    else:
+        weekly_avg_df = memoization.run_stage('weekly averages', create_weekly_avg_df, {
+            'running_df': running_df, 'num_weeks_current_year': num_weeks_current_year,
+            'num_weeks_typical': num_weeks_typical, 'current_year': current_year,
+            'num_weeks_first_year': num_weeks_first_year}, cache_dir)
+
+    chart_jobs = [weekly_avg_chart_job(weekly_avg_df, output_dir=athlete_dir),
+                  weekly_time_spent_running_chart_job(running_df, output_dir=athlete_dir)]
+    chart_jobs.extend(heart_rate_influences.build_charts(running_df, output_dir=athlete_dir, cache_dir=cache_dir))
+
+    route_id = options.get('route_id')
+    if route_id:
+        running_df = find_routes(file_path, athlete_dir, running_df)
+
+    best_effort = options.get('best_effort')
+    best_efforts_df = None
+    if best_effort:
+        best_efforts_df = find_best_efforts(file_path, athlete_dir, running_df)
+
+    first_year = running_df['Activity Year'].iloc[0]
+    start_date, end_date, degree, rounded_running_length, trend_method = inputs.get_pace_over_time_defaults(
+        running_df, first_year)
+    chart_jobs.extend(pace_over_time.build_charts(
+        running_df=running_df, start_date=options.get('start_date') or start_date,
+        end_date=options.get('end_date') or end_date, degree=int(options.get('degree') or degree),
+        rounded_running_length=str(options.get('rounded_running_length') or rounded_running_length),
+        output_dir=athlete_dir, trend_method=options.get('trend_method') or trend_method,
+        trend_store_dir=store_dir if incremental else None, route_id=int(route_id) if route_id else None,
+        cache_dir=cache_dir, best_efforts_df=best_efforts_df, best_effort=best_effort))
+
+    return running_df, weekly_avg_df, chart_jobs
+
+
+def find_routes(file_path, athlete_dir, running_df):
+    """
+    Parses the track files of the export's runs into a stream store in athlete_dir, only the ones not parsed before,
+    and groups the runs into routes with route_clustering.
+
+    :param file_path: path to the 'activities.csv' file, next to the export's 'activities/' directory of track files
+    :param athlete_dir: directory the stream store is kept in
+    :param running_df: data frame containing only the running activities
+    :return: running_df with the 'Route ID' and 'Route Runs' columns added by route_clustering.join_routes
+    """
+    stream_store_dir = parse_streams(file_path, athlete_dir, running_df)
+    route_clustering.run(running_df, stream_store_dir)
+
+    return route_clustering.join_routes(running_df, stream_store_dir)
+
+
+def find_best_efforts(file_path, athlete_dir, running_df):
+    """
+    Finds the best effort of every standard distance in each of the export's runs from the stream store in athlete_dir,
+    parsing the track files not parsed before, and saves them with the personal records they set in athlete_dir.
+
+    :param file_path: path to the 'activities.csv' file, next to the export's 'activities/' directory of track files
+    :param athlete_dir: directory the stream store is kept and the tables are saved in
+    :param running_df: data frame containing only the running activities
+    :return: data frame returned by best_efforts.run
+    """
+    stream_store_dir = parse_streams(file_path, athlete_dir, running_df)
+
+    with instrumentation.stage('best efforts', rows=len(running_df)):
+        best_efforts_df = best_efforts.run(running_df, stream_store_dir)
+
+    best_efforts_df.to_csv(os.path.join(athlete_dir, 'best_efforts.csv'), index=False)
+    best_efforts.create_pr_progression(best_efforts_df).to_csv(os.path.join(athlete_dir, 'personal_records.csv'),
+                                                               index=False)
+
+    return best_efforts_df
+
+
+def parse_streams(file_path, athlete_dir, running_df):
+    """
+
+    :param file_path: path to the 'activities.csv' file, next to the export's 'activities/' directory of track files
+    :param athlete_dir: directory the stream store is kept in
+    :param running_df: data frame containing only the running activities
+    :return: directory of the stream store, holding every run with a track file
+    """
+    stream_store_dir = os.path.join(athlete_dir, 'stream_store')
+
+    # Exports are already spread over the worker processes, so parse this export's files in this one
+    activity_streams.run(running_df, os.path.dirname(os.path.abspath(file_path)), stream_store_dir, max_workers=1)
+
+    return stream_store_dir
+
+
+def run_batch(file_paths, output_dir='output_graphs', workers=None, options=None, incremental=False, trace=False,
+              profile_stage=None, club_report=False, chunk_size=None):
+    """
+
+    :param file_paths: list of 'activities.csv' file paths
+    :param output_dir: directory under which each export gets its own output directory
+    :param workers: number of worker processes, one per CPU by default
+    :param options: dictionary of optional inputs applied to every export, keyed by the names in OPTION_NAMES
+    :param incremental: if True, only ingest each athlete's activities that are new since the last run
+    :param trace: if True, save a trace of each export's pipeline stages in its output directory
+    :param profile_stage: name of a stage to save cProfile stats of when tracing
+    :param club_report: if True, also save club-wide and per-athlete reports merged from every export in club/
+    :param chunk_size: if given, read each export this many rows at a time and only save its weekly averages and its
+    part of the club reports
+    :return: dictionary of file path to the exception raised for every export that failed
+    """
+    athlete_dirs = get_athlete_dirs(file_paths, output_dir)
+    failures = {}
+    partials = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_export, file_path, athlete_dirs[file_path], options or {}, incremental, trace,
+                                   profile_stage, club_report, chunk_size): file_path for file_path in file_paths}
+
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                athlete_dir, partial = future.result()
+                print(f"Finished {file_path}, results saved in {athlete_dir}")
+            except Exception as e:
+                print(f"Failed {file_path}: {e!r}")
+                failures[file_path] = e
+                continue
+            if partial is not None:
+                partials.append(partial)
+
+    if partials:
+        for report_path in club_aggregation.write_reports(club_aggregation.merge_partials(*partials),
+                                                          os.path.join(output_dir, 'club')):
+            print(f"Saved {report_path}")
+
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Strava running analysis over many exports without prompts.")
+    parser.add_argument('exports', nargs='*', help="paths or glob patterns of 'activities.csv' files")
+    parser.add_argument('--config', help="JSON file holding exports, output_dir, workers and optional inputs")
+    parser.add_argument('--output-dir', dest='output_dir')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--incremental', action='store_true',
+                        help="only ingest activities that are new since the last run, keeping a store per athlete")
+    parser.add_argument('--trace', action='store_true',
+                        help="save the time, CPU time, peak memory growth and rows of every stage as trace.json per "
+                             "athlete")
+    parser.add_argument('--club-report', dest='club_report', action='store_true',
+                        help="also save club-wide and per-athlete reports merged from every export in club/")
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int,
+                        help="read each export this many rows at a time, for exports larger than memory")
+    parser.add_argument('--profile-stage', dest='profile_stage',
+                        help="name of a traced stage, such as 'unit conversion', to save cProfile stats of")
+    for option_name in OPTION_NAMES:
+        parser.add_argument(f"--{option_name.replace('_', '-')}", dest=option_name)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    patterns = args.exports or config.get('exports', [])
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    output_dir = args.output_dir or config.get('output_dir', 'output_graphs')
+    workers = args.workers or config.get('workers')
+    options = {option_name: getattr(args, option_name) or config.get(option_name) for option_name in OPTION_NAMES}
+
+    chunk_size = args.chunk_size or config.get('chunk_size')
+    incremental = args.incremental or config.get('incremental', False)
+    if chunk_size and incremental:
+        raise ValueError("--chunk-size and --incremental can't be combined, since the store is kept of whole "
+                         "activities.")
+
+    file_paths = expand_export_paths(patterns)
+    if not file_paths:
+        raise ValueError("No 'activities.csv' exports to analyze. Pass paths or glob patterns, or set 'exports' in "
+                         "the config file.")
+
+    print(f"Analyzing {len(file_paths)} exports with results saved in {output_dir}/...")
+    failures = run_batch(file_paths, output_dir=output_dir, workers=workers, options=options,
+                         incremental=incremental,
+                         trace=args.trace or config.get('trace', False),
+                         profile_stage=args.profile_stage or config.get('profile_stage'),
+                         club_report=args.club_report or config.get('club_report', False), chunk_size=chunk_size)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
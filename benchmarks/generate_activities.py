@@ -0,0 +1,136 @@
+###
+# Writes a synthetic Strava 'activities.csv' for testing and benchmarking the pipeline.
+#
+#   python -m benchmarks.generate_activities 100000 benchmarks/data/activities_100000.csv --seed 0
+#
+# The file has the same quirks as a real export: 'translation missing' HTML headers, two 'Distance' columns (the first
+# in km for runs, the second always in meters), mixed activity types, missing heart rates and a multi-year span.
+###
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+TRANSLATION_MISSING = ('<span class="translation_missing" title="translation missing: '
+                       'en-US.lib.export.portability_exporter.activities.horton_values.{key}">{name}</span>')
+
+ACTIVITY_TYPES = ['Run', 'Ride', 'Walk', 'Hike', 'Swim', 'Workout']
+ACTIVITY_TYPE_WEIGHTS = [0.7, 0.12, 0.08, 0.04, 0.03, 0.03]
+GEAR = ['Pegasus 40', 'Vaporfly 3', 'Ghost 15', 'Clifton 9']
+CHUNK_ROWS = 100_000
+
+
+def generate_chunk(rng, start_id, n_rows, start_date, end_date):
+    """
+
+    :param rng: numpy random generator
+    :param start_id: Activity ID of the first row
+    :param n_rows: number of activities to generate
+    :param start_date: earliest activity date
+    :param end_date: latest activity date
+    :return: data frame of activities in the column order of a Strava export, sorted by date
+    """
+    dates = pd.to_datetime(np.sort(rng.integers(start_date.value, end_date.value, n_rows)))
+    activity_type = rng.choice(ACTIVITY_TYPES, n_rows, p=ACTIVITY_TYPE_WEIGHTS)
+    is_run = activity_type == 'Run'
+
+    distance_m = np.round(rng.gamma(shape=4, scale=1800, size=n_rows), 1)
+    distance_m[activity_type == 'Workout'] = 0
+    pace_s_per_m = rng.normal(0.34, 0.04, n_rows).clip(0.2)
+    pace_s_per_m[~is_run] *= rng.uniform(0.3, 2.5, (~is_run).sum())
+    moving_time = np.round(np.where(distance_m > 0, distance_m * pace_s_per_m, rng.uniform(600, 3600, n_rows)))
+    elapsed_time = np.round(moving_time * rng.uniform(1, 1.15, n_rows))
+
+    average_hr = np.round(rng.normal(148, 10, n_rows) + 40 * (0.34 - pace_s_per_m).clip(-0.2, 0.2), 1)
+    max_hr = np.round(average_hr + rng.uniform(8, 30, n_rows))
+    no_hr = rng.random(n_rows) < 0.15
+    average_hr[no_hr] = np.nan
+    max_hr[no_hr] = np.nan
+
+    apparent_temperature = np.round(12 - 10 * np.cos(2 * np.pi * dates.dayofyear.to_numpy() / 365)
+                                    + rng.normal(0, 4, n_rows), 1)
+    apparent_temperature[rng.random(n_rows) < 0.05] = np.nan
+
+    activity_ids = np.arange(start_id, start_id + n_rows)
+
+    columns = [
+        ('Activity ID', activity_ids),
+        ('Activity Date', dates.strftime('%b %-d, %Y, %-I:%M:%S %p')),
+        ('Activity Name', np.char.add(np.where(dates.hour < 12, 'Morning ', 'Evening '), activity_type)),
+        ('Activity Type', activity_type),
+        ('Activity Description', np.full(n_rows, np.nan)),
+        ('Elapsed Time', elapsed_time),
+        # The first distance column is in km for runs and rides
+        ('Distance', np.round(distance_m / 1000, 2)),
+        ('Max Heart Rate', max_hr),
+        ('Relative Effort', np.where(no_hr, np.nan, np.round(moving_time / 60 * rng.uniform(0.5, 1.5, n_rows)))),
+        ('Commute', rng.random(n_rows) < 0.05),
+        ('Activity Gear', np.where(is_run, rng.choice(GEAR, n_rows), None)),
+        ('Filename', [f'activities/{activity_id}.fit.gz' for activity_id in activity_ids]),
+        ('Elapsed Time', elapsed_time),
+        ('Moving Time', moving_time),
+        ('Distance', distance_m),
+        ('Max Speed', np.round(1 / pace_s_per_m * rng.uniform(1.1, 1.6, n_rows), 3)),
+        ('Average Speed', np.round(np.where(moving_time > 0, distance_m / moving_time, 0), 3)),
+        ('Elevation Gain', np.round(rng.gamma(2, 25, n_rows), 1)),
+        ('Average Heart Rate', average_hr),
+        ('Apparent Temperature', apparent_temperature),
+        ('Weather Condition', np.full(n_rows, np.nan)),
+        (TRANSLATION_MISSING.format(key='perceived_exertion', name='Perceived Exertion'),
+         np.where(rng.random(n_rows) < 0.7, np.nan, rng.integers(1, 11, n_rows))),
+        (TRANSLATION_MISSING.format(key='prefer_perceived_exertion', name='Prefer Perceived Exertion'),
+         np.full(n_rows, np.nan)),
+    ]
+
+    # Build from a list of pairs so the duplicated Strava headers survive
+    chunk = pd.DataFrame(dict(enumerate(values for _, values in columns)))
+    chunk.columns = [name for name, _ in columns]
+
+    return chunk
+
+
+def generate_activities(n_rows, file_path, seed=0, start_date='2015-01-01', end_date='2023-10-01'):
+    """
+    Writes the file in chunks so even 10^7 rows are generated in bounded memory.
+
+    :param n_rows: number of activities
+    :param file_path: path of the 'activities.csv' file to write
+    :param seed: seed of the random generator, so the same arguments always write the same file
+    :param start_date: earliest activity date
+    :param end_date: latest activity date
+    :return: file_path
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+
+    # Split the date span over the chunks so the whole file stays in date order
+    n_chunks = max(1, -(-n_rows // CHUNK_ROWS))
+    boundaries = pd.date_range(start_date, end_date, periods=n_chunks + 1)
+
+    with open(file_path, 'w', newline='') as f:
+        for chunk_index in range(n_chunks):
+            chunk_start = chunk_index * CHUNK_ROWS
+            chunk = generate_chunk(rng, 1_000_000_000 + chunk_start, min(CHUNK_ROWS, n_rows - chunk_start),
+                                   boundaries[chunk_index], boundaries[chunk_index + 1])
+            chunk.to_csv(f, header=chunk_index == 0, index=False)
+
+    return file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic Strava 'activities.csv' file.")
+    parser.add_argument('n_rows', type=int)
+    parser.add_argument('file_path')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-date', default='2015-01-01')
+    parser.add_argument('--end-date', default='2023-10-01')
+    args = parser.parse_args()
+
+    generate_activities(args.n_rows, args.file_path, seed=args.seed, start_date=args.start_date,
+                        end_date=args.end_date)
+    print(f"Wrote {args.n_rows} activities to {args.file_path}")
+
+
+if __name__ == "__main__":
+    main()
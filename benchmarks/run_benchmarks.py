@@ -0,0 +1,213 @@
+###
+# Times and memory-profiles each stage of the pipeline on synthetic exports of increasing size.
+#
+#   python -m benchmarks.run_benchmarks --sizes 1000 10000 100000 1000000
+#   python -m benchmarks.run_benchmarks --sizes 1000 10000 --compare benchmarks/results/baseline.jsonl
+#
+# Exports are generated once per size and seed into benchmarks/data/. Every run appends one JSON record per size and
+# stage to the results file, so scaling curves and regressions can be read off the history. With --compare, stages
+# that got slower than the given results by more than --threshold are reported and the exit code is non-zero.
+###
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from benchmarks.generate_activities import generate_activities
+from src import data_cleaning
+from src import heart_rate_influences
+from src import pace_over_time
+from src.mileage_and_time_run_per_week import create_weekly_avg_df
+from utils.running_utils import create_running_df, distance_m_to_mi, add_unit_columns
+import inputs
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+DATA_DIR = os.path.join('benchmarks', 'data')
+RESULTS_PATH = os.path.join('benchmarks', 'results', 'results.jsonl')
+
+
+def get_stages(file_path):
+    """
+    Each stage takes the state built by the stages before it and returns the updated state and the number of rows it
+    processed. Stages may run twice on the same state (once timed, once memory-traced), so they must not depend on
+    running only once.
+
+    :param file_path: path to the synthetic 'activities.csv' file
+    :return: list of (stage name, stage function) tuples, in pipeline order
+    """
+    def clean(state):
+        state['cleaned_df'] = data_cleaning.run(file_path, use_cache=False)
+        return state, len(state['cleaned_df'])
+
+    def clean_cached(state):
+        # run_benchmarks writes the cache before the stages run, so this is the warm read
+        data_cleaning.run(file_path, use_cache=True)
+        return state, len(state['cleaned_df'])
+
+    def filter_runs(state):
+        state['running_df'] = create_running_df(state['cleaned_df'])
+        return state, len(state['cleaned_df'])
+
+    def distance_to_miles(state):
+        distance_m_to_mi(dataframe=state['running_df'], distance_m_col_name='Distance.1', m_to_mi_conversion=1 / 1610)
+        return state, len(state['running_df'])
+
+    def unit_columns(state):
+        add_unit_columns(dataframe=state['running_df'], distance_m_col_name='Distance.1', m_to_mi_conversion=1 / 1610)
+        return state, len(state['running_df'])
+
+    def weekly_averages(state):
+        running_df = state['running_df']
+        current_year, num_weeks_current_year, num_weeks_typical = inputs.get_yearly_data_defaults(running_df)
+        state['weekly_avg_df'] = create_weekly_avg_df(
+            running_df, num_weeks_current_year=num_weeks_current_year, num_weeks_typical=num_weeks_typical,
+            current_year=current_year,
+            num_weeks_first_year=inputs.get_first_year_weeks_default(running_df, num_weeks_typical))
+        return state, len(running_df)
+
+    def heart_rate_fits(state):
+        heart_rate_influences.build_charts(state['running_df'])
+        return state, len(state['running_df'])
+
+    def pace_trend(state):
+        running_df = state['running_df']
+        start_date, end_date, degree, rounded_running_length, trend_method = inputs.get_pace_over_time_defaults(
+            running_df, running_df['Activity Year'].iloc[0])
+        pace_over_time.build_charts(running_df=running_df, start_date=start_date, end_date=end_date, degree=degree,
+                                    rounded_running_length=rounded_running_length, trend_method=trend_method)
+        return state, len(running_df)
+
+    return [('clean', clean), ('clean (cached)', clean_cached), ('filter runs', filter_runs),
+            ('distance_m_to_mi', distance_to_miles), ('add_unit_columns', unit_columns),
+            ('create_weekly_avg_df', weekly_averages), ('heart_rate_influences', heart_rate_fits),
+            ('pace_over_time', pace_trend)]
+
+
+def measure(stage, state):
+    """
+    Times the stage without tracing, then runs it again under tracemalloc for its peak allocation, since tracing
+    slows everything down.
+
+    :return: tuple of (state, rows, wall seconds, CPU seconds, peak MB allocated while the stage ran)
+    """
+    # The pipeline's progress prints would drown out the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        state, rows = stage(state)
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+
+        tracemalloc.start()
+        try:
+            state, rows = stage(state)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return state, rows, wall_seconds, cpu_seconds, peak_bytes / 2 ** 20
+
+
+def get_data_path(n_rows, seed):
+    return os.path.join(DATA_DIR, f'activities_{n_rows}_seed{seed}.csv')
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, seed=0, results_path=RESULTS_PATH):
+    """
+
+    :param sizes: list of export sizes, in rows
+    :param seed: seed of the synthetic exports
+    :param results_path: JSON lines file the records are appended to
+    :return: list of the records written, one per size and stage
+    """
+    run_info = {'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': get_git_commit(),
+                'python': platform.python_version(), 'machine': platform.machine(), 'seed': seed}
+    records = []
+
+    for n_rows in sizes:
+        file_path = get_data_path(n_rows, seed)
+        if not os.path.exists(file_path):
+            print(f"Generating {n_rows} activities in {file_path}...")
+            generate_activities(n_rows, file_path, seed=seed)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_cleaning.run(file_path, use_cache=True)
+
+        state = {}
+        for stage_name, stage in get_stages(file_path):
+            state, rows, wall_seconds, cpu_seconds, peak_mb = measure(stage, state)
+            record = dict(run_info, size=n_rows, stage=stage_name, rows=rows, wall_seconds=round(wall_seconds, 6),
+                          cpu_seconds=round(cpu_seconds, 6), peak_mb=round(peak_mb, 3))
+            records.append(record)
+            print(f"{n_rows:>10} {stage_name:<24} {wall_seconds:>10.4f}s {peak_mb:>10.1f} MB")
+
+    os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+    with open(results_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+    return records
+
+
+def find_regressions(records, baseline_path, threshold=1.25):
+    """
+
+    :param records: records returned by run_benchmarks
+    :param baseline_path: JSON lines results file to compare against; its latest record per size and stage is used
+    :param threshold: how many times slower than the baseline a stage may get before it counts as a regression
+    :return: list of (size, stage, baseline wall seconds, new wall seconds) for every regressed stage
+    """
+    baseline = {}
+    with open(baseline_path) as f:
+        for line in f:
+            record = json.loads(line)
+            baseline[(record['size'], record['stage'])] = record['wall_seconds']
+
+    regressions = []
+    for record in records:
+        baseline_seconds = baseline.get((record['size'], record['stage']))
+        if baseline_seconds and record['wall_seconds'] > threshold * baseline_seconds:
+            regressions.append((record['size'], record['stage'], baseline_seconds, record['wall_seconds']))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic Strava exports.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument('--compare', help="JSON lines results file to check for regressions against")
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(args.sizes, seed=args.seed, results_path=args.results)
+
+    if args.compare:
+        regressions = find_regressions(records, args.compare, threshold=args.threshold)
+        for size, stage_name, baseline_seconds, wall_seconds in regressions:
+            print(f"Regression: {stage_name} at {size} rows took {wall_seconds:.4f}s, "
+                  f"baseline {baseline_seconds:.4f}s")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
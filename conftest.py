@@ -0,0 +1 @@
+# Lets the tests import src and utils the same way the scripts at the top of the repository do
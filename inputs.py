@@ -9,6 +9,10 @@ from src.mileage_and_time_run_per_week import *
 from src import heart_rate_influences
 from src import pace_over_time
 from utils.running_utils import *
+from utils.plotting import render_charts
+from utils import instrumentation
+from utils import memoization
+from utils.calendar_dimension import count_weeks_through
 import pandas as pd
 from datetime import datetime
 
@@ -22,39 +26,73 @@ def get_filepath_input():
     return input("Specify the file path location for 'activities.csv' file: ")
 
 
+def get_yearly_data_defaults(running_df):
+    current_year = running_df['Activity Year'].iloc[-1]
+    # Activity Week is 0 before the year's first Sunday, so the weeks so far are counted from the calendar
+    num_weeks_current_year = count_weeks_through(current_year, running_df['Activity Week'].iloc[-1])
+    num_weeks_typical = 52
+
+    return current_year, num_weeks_current_year, num_weeks_typical
+
+
+def get_first_year_weeks_default(running_df, num_weeks_typical):
+    first_year = running_df['Activity Year'].iloc[0]
+
+    return num_weeks_typical - running_df.loc[running_df['Activity Year'] == first_year, 'Activity Week'].min()
+
+
 def get_yearly_data_inputs(running_df):
-    current_year = get_input_with_default("[Optional] The current year is: ",
-                                          running_df.reset_index()['Activity Year'][len(running_df) - 1], int)
+    default_current_year, default_num_weeks_current_year, default_num_weeks_typical = get_yearly_data_defaults(
+        running_df)
+
+    current_year = get_input_with_default("[Optional] The current year is: ", default_current_year, int)
     num_weeks_current_year = get_input_with_default(f"[Optional] The number of weeks of data collected in "
-                                                    f"{current_year} so far: ",
-                                                    running_df.reset_index()['Activity Week'][len(running_df) - 1], int)
+                                                    f"{current_year} so far: ", default_num_weeks_current_year, int)
     num_weeks_typical = get_input_with_default("[Optional] The number of weeks per year to consider in a typical year "
-                                               "is: ", 52, int)
-    first_year = running_df.reset_index()['Activity Year'][0]
+                                               "is: ", default_num_weeks_typical, int)
+    first_year = running_df['Activity Year'].iloc[0]
     num_weeks_first_year = get_input_with_default(f"[Optional] The number of weeks of data collected in {first_year}: ",
-                                                  num_weeks_typical - running_df[running_df['Activity Year'] == 2018][
-                                                      'Activity Week'].sort_values().reset_index(drop=True)[0], int)
+                                                  get_first_year_weeks_default(running_df, num_weeks_typical), int)
 
     return current_year, num_weeks_current_year, num_weeks_typical, num_weeks_first_year
 
 
+def get_pace_over_time_defaults(running_df, first_year):
+    start_date = f'01-01-{str(first_year)}'
+    # running_df is sorted by its 'Activity Date' index, so the last run is the last row
+    end_date = running_df.index[-1].strftime("%m-%d-%Y")
+    degree = 3
+    rounded_running_length = ""
+    trend_method = 'polynomial'
+
+    return start_date, end_date, degree, rounded_running_length, trend_method
+
+
 def get_pace_over_time_inputs(running_df, first_year):
+    default_start_date, default_end_date, default_degree, default_rounded_running_length, default_trend_method = \
+        get_pace_over_time_defaults(running_df, first_year)
+
     start_date = get_input_with_default("[Optional] Specify the start date in format such as 01-01-2019...",
-                                        f'01-01-{str(first_year)}')
+                                        default_start_date)
     end_date = get_input_with_default("[Optional] Specify the end date in format such as 05-01-2023...",
-                                      running_df['Activity Date'].sort_values(ascending=False).reset_index(drop=True)[
-                                          0].strftime("%m-%d-%Y"))
+                                      default_end_date)
     degree = get_input_with_default("[Optional] Specify the degree of fit for the pace over time with trend graph...",
-                                    3, int)
+                                    default_degree, int)
     rounded_running_length = get_input_with_default(
-        "[Optional] Specify the rounded running length, in miles, to assess pace over time...", "")
+        "[Optional] Specify the rounded running length, in miles, to assess pace over time...",
+        default_rounded_running_length)
+    trend_method = get_input_with_default(
+        "[Optional] Specify the pace trend: polynomial, lowess or rolling median...", default_trend_method)
 
-    return start_date, end_date, degree, rounded_running_length
+    return start_date, end_date, degree, rounded_running_length, trend_method
 
 
 def main():
     print("Welcome to My Strava Analytics Project! :)")
 
+    # Set STRAVA_TRACE to a file path to record how long each stage takes, see utils/instrumentation.py
+    instrumentation.enable_from_environment()
+
     # Specify the file path location for 'activities.csv' file as a string
     # ie, /Users/zoemcbride/repos/health_running_analysis/strava_export_36240949/activities.csv
     file_path = get_filepath_input()
@@ -62,9 +100,9 @@ def main():
     # Run the data cleaning script
     cleaned_df = data_cleaning.run(file_path)
 
-    # Create running dataframe and add distance in miles column
+    # Create running dataframe and add distance, pace, time and temperature unit columns
     running_df = create_running_df(cleaned_df)
-    running_df = distance_m_to_mi(dataframe=running_df, distance_m_col_name='Distance.1', m_to_mi_conversion=1 / 1610)
+    running_df = add_unit_columns(dataframe=running_df, distance_m_col_name='Distance.1', m_to_mi_conversion=1 / 1610)
 
     print("\n Created a data frame of running data only...\n")
 
@@ -83,33 +121,44 @@ def main():
     # Set up weekly average data frame inputs
     current_year, num_weeks_current_year, num_weeks_typical, num_weeks_first_year = get_yearly_data_inputs(running_df)
 
-    weekly_avg_df = create_weekly_avg_df(running_df, num_weeks_current_year=num_weeks_current_year,
-                                         num_weeks_typical=num_weeks_typical, current_year=current_year,
-                                         num_weeks_first_year=num_weeks_first_year)
+    # Tables and fits are kept next to the graphs, and only computed again when their runs or parameters change
+    cache_dir = os.path.join('output_graphs', memoization.STAGE_CACHE_DIR)
+
+    weekly_avg_df = memoization.run_stage('weekly averages', create_weekly_avg_df, {
+        'running_df': running_df, 'num_weeks_current_year': num_weeks_current_year,
+        'num_weeks_typical': num_weeks_typical, 'current_year': current_year,
+        'num_weeks_first_year': num_weeks_first_year}, cache_dir)
     print("\n Your weekly averages are...\n")
     print(weekly_avg_df)
 
-    print("Creating weekly average running graph and saving in output_graphs/...")
-    create_weekly_avg_graph(weekly_avg_df)
+    # Charts are only computed here and rendered together once all the inputs are in
+    print("Preparing weekly average running graph...")
+    chart_jobs = [weekly_avg_chart_job(weekly_avg_df)]
 
-    print("Creating weekly average time run graph and saving in output_graphs/...")
-    create_weekly_time_spent_running_graph(running_df)
+    print("Preparing weekly average time run graph...")
+    chart_jobs.append(weekly_time_spent_running_chart_job(running_df))
 
-    print("Creating heart rate vs pace and heart rate vs apparent temperature graphs. Saving in output_graphs/...")
-    heart_rate_influences.run(running_df)
+    print("Preparing heart rate vs pace and heart rate vs apparent temperature graphs...")
+    chart_jobs.extend(heart_rate_influences.build_charts(running_df, cache_dir=cache_dir))
 
     # Identify the first year of the data set
-    first_year = running_df.reset_index()['Activity Year'][0]
+    first_year = running_df['Activity Year'].iloc[0]
 
     print("\nThe following apply to the pace over time graphs. These can be inputted, or left blank if you want to"
           " assume default: \n")
 
     # Specify inputs to pace over time graphs
-    start_date, end_date, degree, rounded_running_length = get_pace_over_time_inputs(running_df, first_year)
+    start_date, end_date, degree, rounded_running_length, trend_method = get_pace_over_time_inputs(running_df,
+                                                                                                   first_year)
+
+    print("Preparing distance counts per year, number of runs vs distance counts and pace over time graphs...")
+    chart_jobs.extend(pace_over_time.build_charts(running_df=running_df, start_date=start_date, end_date=end_date,
+                                                  degree=degree, rounded_running_length=rounded_running_length,
+                                                  trend_method=trend_method, cache_dir=cache_dir))
 
-    print("Creating distance counts per year and number of runs vs distance counts graphs. Saving in output_graphs/...")
-    pace_over_time.run(running_df=running_df, start_date=start_date, end_date=end_date, degree=degree,
-                       rounded_running_length=rounded_running_length)
+    print(f"Rendering {len(chart_jobs)} graphs and saving in output_graphs/...")
+    for output_path in render_charts(chart_jobs):
+        print(f"Saved {output_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,316 @@
+import gzip
+import itertools
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import numpy as np
+
+# Every activity is stored with the same channels. Channels a file doesn't record are kept as all-NaN arrays.
+STREAM_DTYPES = {
+    'elapsed_time': np.float32,  # seconds since the first sample
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'altitude': np.float32,  # meters
+    'distance': np.float32,  # cumulative meters
+    'heart_rate': np.float32,  # BPM
+    'cadence': np.float32,
+}
+
+STREAMS_DIR = 'streams'
+INDEX_FILE = 'index.parquet'
+CHUNK_SIZE = 64 * 1024
+# Samples are packed into arrays this many at a time as they are read
+SAMPLE_BLOCK_SIZE = 10_000
+EARTH_RADIUS_M = 6371008.8
+
+
+def run(running_df: pd.DataFrame, export_dir, store_dir, max_workers=None):
+    """
+    Parses the per-activity track files of a Strava export into the stream store, across a process pool. Activities
+    that are already in the store are skipped.
+
+    :param running_df: data frame of activities with 'Activity ID' and 'Filename' columns
+    :param export_dir: directory of the unzipped Strava export, which the 'Filename' paths are relative to
+    :param store_dir: directory of the stream store, created on first use
+    :param max_workers: number of worker processes, one per CPU by default
+    :return: the store's index, with one row of stream summary columns per stored Activity ID
+    """
+    os.makedirs(os.path.join(store_dir, STREAMS_DIR), exist_ok=True)
+    index_df = load_index(store_dir)
+
+    to_parse = running_df.loc[running_df['Filename'].notna() & ~running_df['Activity ID'].isin(index_df['Activity ID']),
+                              ['Activity ID', 'Filename']]
+    print(f"Parsing {len(to_parse)} activity files into {store_dir}")
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(parse_and_store, activity_id, os.path.join(export_dir, filename), store_dir):
+                   filename for activity_id, filename in to_parse.itertuples(index=False)}
+
+        for future in as_completed(futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"Could not parse {futures[future]}: {e!r}")
+
+    if summaries:
+        index_df = pd.concat([index_df, pd.DataFrame(summaries)], ignore_index=True).sort_values('Activity ID')
+        index_df.to_parquet(os.path.join(store_dir, INDEX_FILE) + '.tmp', index=False)
+        os.replace(os.path.join(store_dir, INDEX_FILE) + '.tmp', os.path.join(store_dir, INDEX_FILE))
+
+    return index_df
+
+
+def parse_and_store(activity_id, file_path, store_dir):
+    """
+
+    :param activity_id: Strava Activity ID the file belongs to
+    :param file_path: path to a .fit, .gpx or .tcx file, optionally gzipped
+    :param store_dir: directory of the stream store
+    :return: dictionary of the activity's stream summary, as stored in the index
+    """
+    streams = parse_activity_file(file_path)
+    np.savez(get_stream_path(store_dir, activity_id), **streams)
+
+    return {
+        'Activity ID': activity_id,
+        'Stream Start Time': streams['start_time'][0],
+        'Stream Samples': len(streams['elapsed_time']),
+        'Stream Elapsed Time': float(np.nanmax(streams['elapsed_time'], initial=0)),
+        'Stream Distance': float(np.nanmax(streams['distance'], initial=0)),
+        'Has Heart Rate Stream': bool(np.isfinite(streams['heart_rate']).any()),
+        'Has GPS Stream': bool(np.isfinite(streams['latitude']).any()),
+    }
+
+
+def get_stream_path(store_dir, activity_id):
+    return os.path.join(store_dir, STREAMS_DIR, f'{activity_id}.npz')
+
+
+def load_index(store_dir):
+    """
+
+    :param store_dir: directory of the stream store
+    :return: data frame with one row of stream summary columns per stored Activity ID
+    """
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return pd.DataFrame({'Activity ID': pd.Series(dtype='int64')})
+
+    return pd.read_parquet(index_path)
+
+
+def load_streams(store_dir, activity_id):
+    """
+
+    :param store_dir: directory of the stream store
+    :param activity_id: Strava Activity ID
+    :return: dictionary of channel name to typed array, as described by STREAM_DTYPES, plus 'start_time'
+    """
+    with np.load(get_stream_path(store_dir, activity_id)) as streams:
+        return {channel: streams[channel] for channel in streams.files}
+
+
+def join_stream_index(running_df: pd.DataFrame, store_dir) -> pd.DataFrame:
+    """
+
+    :param running_df: data frame containing the running activities
+    :param store_dir: directory of the stream store
+    :return: running_df with the stream summary columns joined on Activity ID, NaN where no stream is stored
+    """
+    return running_df.merge(load_index(store_dir), on='Activity ID', how='left')
+
+
+def parse_activity_file(file_path):
+    """
+
+    :param file_path: path to a .fit, .gpx or .tcx file, optionally gzipped
+    :return: dictionary of channel name to typed array, as described by STREAM_DTYPES, plus 'start_time' holding the
+    first sample's time as a one element datetime64[ns] array
+    """
+    name = file_path[:-len('.gz')] if file_path.endswith('.gz') else file_path
+    extension = os.path.splitext(name)[1].lower()
+
+    if extension not in ('.gpx', '.tcx', '.fit'):
+        raise ValueError(f"Unsupported activity file type {extension} for {file_path}")
+
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rb') as f:
+        # The samples are read lazily, so the file stays open until to_streams has packed them all
+        if extension == '.gpx':
+            return to_streams(parse_xml_track(f, point_tag='trkpt', read_point=read_gpx_point))
+        elif extension == '.tcx':
+            return to_streams(parse_xml_track(f, point_tag='Trackpoint', read_point=read_tcx_point))
+        else:
+            return to_streams(parse_fit(f))
+
+
+def parse_xml_track(f, point_tag, read_point):
+    """
+    Parses a GPX or TCX track incrementally, dropping every track point from the tree once it has been read, so the
+    parsed tree doesn't grow with the size of the file. The points are yielded as they are read, for to_streams to pack
+    into arrays.
+
+    :param f: binary file object
+    :param point_tag: tag of the track point elements, without namespace
+    :param read_point: function returning a tuple of (time, latitude, longitude, altitude, distance, heart rate,
+    cadence) for a track point element
+    :return: generator of the track points' tuples
+    """
+    parser = ET.XMLPullParser(events=('end',))
+    leading = True
+
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        # Strava's files sometimes start with whitespace before the XML declaration, which XML parsers reject
+        if leading:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            leading = False
+
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            if local_name(element.tag) == point_tag:
+                yield read_point(element)
+                element.clear()
+
+    parser.close()
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def find_text(element, name):
+    for child in element.iter():
+        if local_name(child.tag) == name and child.text:
+            return child.text
+    return None
+
+
+def to_float(text):
+    return float(text) if text is not None else np.nan
+
+
+def read_gpx_point(element):
+    return (find_text(element, 'time'), to_float(element.get('lat')), to_float(element.get('lon')),
+            to_float(find_text(element, 'ele')), np.nan, to_float(find_text(element, 'hr')),
+            to_float(find_text(element, 'cad')))
+
+
+def read_tcx_point(element):
+    cadence = find_text(element, 'Cadence') or find_text(element, 'RunCadence')
+    heart_rate = None
+    for child in element:
+        if local_name(child.tag) == 'HeartRateBpm':
+            heart_rate = find_text(child, 'Value')
+
+    return (find_text(element, 'Time'), to_float(find_text(element, 'LatitudeDegrees')),
+            to_float(find_text(element, 'LongitudeDegrees')), to_float(find_text(element, 'AltitudeMeters')),
+            to_float(find_text(element, 'DistanceMeters')), to_float(heart_rate), to_float(cadence))
+
+
+def parse_fit(f):
+    """
+
+    :param f: binary file object
+    :return: generator of (time, latitude, longitude, altitude, distance, heart rate, cadence) tuples, one per record
+    """
+    try:
+        import fitparse
+    except ImportError:
+        raise ImportError("Reading .fit activity files requires the fitparse package: pip install fitparse")
+
+    semicircles_to_degrees = 180 / 2 ** 31
+
+    for record in fitparse.FitFile(f).get_messages('record'):
+        values = record.get_values()
+        latitude = values.get('position_lat')
+        longitude = values.get('position_long')
+        altitude = values.get('enhanced_altitude', values.get('altitude'))
+        yield (values.get('timestamp'),
+               latitude * semicircles_to_degrees if latitude is not None else np.nan,
+               longitude * semicircles_to_degrees if longitude is not None else np.nan,
+               to_float(altitude), to_float(values.get('distance')), to_float(values.get('heart_rate')),
+               to_float(values.get('cadence')))
+
+
+def to_streams(samples):
+    """
+
+    :param samples: iterable of (time, latitude, longitude, altitude, distance, heart rate, cadence) tuples
+    :return: dictionary of channel name to typed array, as described by STREAM_DTYPES, plus 'start_time'
+    """
+    times, values = collect_samples(samples)
+    times = pd.DatetimeIndex(times)
+    latitude, longitude, altitude, distance, heart_rate, cadence = values.T
+
+    # GPX files carry no distance, so accumulate it from the positions
+    if np.isnan(distance).all() and np.isfinite(latitude).any():
+        distance = cumulative_distance(latitude, longitude)
+
+    start_time = times[0] if len(times) else pd.NaT
+    elapsed_time = (times - start_time).total_seconds().to_numpy()
+
+    streams = {
+        'elapsed_time': elapsed_time,
+        'latitude': latitude,
+        'longitude': longitude,
+        'altitude': altitude,
+        'distance': distance,
+        'heart_rate': heart_rate,
+        'cadence': cadence,
+    }
+    streams = {channel: np.asarray(streams[channel], dtype=dtype) for channel, dtype in STREAM_DTYPES.items()}
+    streams['start_time'] = np.array([start_time], dtype='datetime64[ns]')
+
+    return streams
+
+
+def collect_samples(samples):
+    """
+    Packs the samples into arrays SAMPLE_BLOCK_SIZE at a time, so only one block of them is ever held as tuples.
+
+    :param samples: iterable of (time, latitude, longitude, altitude, distance, heart rate, cadence) tuples
+    :return: tuple of a datetime64[ns] array of the times, in UTC, and an array of shape (samples, 6) of the rest
+    """
+    samples = iter(samples)
+    time_blocks = []
+    value_blocks = []
+
+    for block in iter(lambda: list(itertools.islice(samples, SAMPLE_BLOCK_SIZE)), []):
+        time_blocks.append(pd.to_datetime([sample[0] for sample in block], utc=True).tz_localize(None).to_numpy())
+        value_blocks.append(np.array([sample[1:] for sample in block], dtype=np.float64).reshape(len(block), 6))
+
+    if not time_blocks:
+        return np.array([], dtype='datetime64[ns]'), np.empty((0, 6))
+
+    return np.concatenate(time_blocks), np.concatenate(value_blocks)
+
+
+def cumulative_distance(latitude, longitude):
+    """
+    Accumulates the haversine distance between consecutive fixes, so a sample without a fix neither adds to the
+    distance nor loses the step from the fix before it to the fix after it.
+
+    :param latitude: array of latitudes in degrees, NaN for samples without a fix
+    :param longitude: array of longitudes in degrees, NaN for samples without a fix
+    :return: array of cumulative distance in meters, carrying the last distance over samples without a fix, and 0
+    before the first fix
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    fixes = np.flatnonzero(np.isfinite(latitude) & np.isfinite(longitude))
+
+    lat = np.radians(latitude[fixes])
+    lon = np.radians(longitude[fixes])
+
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+    distance = np.zeros(len(latitude))
+    distance[fixes] = np.concatenate([[0], np.cumsum(steps)])[:len(fixes)]
+
+    # The distance never decreases, so the running maximum carries each fix's distance over the samples after it
+    return np.maximum.accumulate(distance)
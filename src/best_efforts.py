@@ -0,0 +1,157 @@
+import pandas as pd
+import numpy as np
+from src import activity_streams
+
+# Target distances in meters
+STANDARD_DISTANCES = {
+    'Mile': 1609.344,
+    '5K': 5000.0,
+    '10K': 10000.0,
+    'Half Marathon': 21097.5,
+    'Marathon': 42195.0,
+}
+
+
+def run(running_df: pd.DataFrame, store_dir, distances=None):
+    """
+
+    :param running_df: data frame containing the running activities, with 'Activity ID' and 'Activity Date'
+    :param store_dir: directory of the stream store written by activity_streams.run
+    :param distances: dictionary of effort name to distance in meters, STANDARD_DISTANCES by default
+    :return: data frame of the best effort per stored activity and distance, with the activity's date and year
+    """
+    index_df = activity_streams.load_index(store_dir)
+    activity_ids = running_df.loc[running_df['Activity ID'].isin(index_df['Activity ID']), 'Activity ID']
+
+    streams = {}
+    for activity_id in activity_ids:
+        activity_stream = activity_streams.load_streams(store_dir, activity_id)
+        streams[activity_id] = (activity_stream['distance'], activity_stream['elapsed_time'])
+
+    best_efforts_df = find_best_efforts(streams, distances=distances)
+
+    return best_efforts_df.merge(running_df[['Activity ID', 'Activity Date', 'Activity Year']], on='Activity ID',
+                                 how='left')
+
+
+def find_best_efforts(streams, distances=None):
+    """
+    Finds each activity's fastest stretch covering each target distance, interpolating the time at which the target
+    is reached between samples.
+
+    All activities are searched at once: their distance streams are laid end to end, with gaps wider than the longest
+    target between them so no stretch can span two activities. For every sample the stretch ends at the first sample
+    at least the target further on. The starts are in increasing order, so this is the same sweep as moving two
+    pointers along the stream, done by np.searchsorted in a single vectorized call per distance.
+
+    :param streams: dictionary of Activity ID to a tuple of arrays (cumulative distance in meters, elapsed seconds)
+    :param distances: dictionary of effort name to distance in meters, STANDARD_DISTANCES by default
+    :return: data frame with Activity ID, Effort, Effort Distance (m), Elapsed Time (s), Start Time (s) and
+    Pace in Mins per Mile columns, with one row per activity and distance the activity is long enough for
+    """
+    distances = distances or STANDARD_DISTANCES
+    columns = ['Activity ID', 'Effort', 'Effort Distance (m)', 'Elapsed Time (s)', 'Start Time (s)',
+               'Pace in Mins per Mile']
+
+    activity_ids, distance, elapsed_time = concatenate_streams(streams, gap=max(distances.values()) + 1)
+    if len(distance) < 2:
+        return pd.DataFrame(columns=columns)
+
+    unique_ids, activity_codes = np.unique(activity_ids, return_inverse=True)
+    best_efforts = []
+
+    for effort, effort_distance in distances.items():
+        end = np.searchsorted(distance, distance + effort_distance, side='left')
+        valid = end < len(distance)
+        # The end sample is the first one reaching the target, so the one before it is in the same activity too
+        valid[valid] &= activity_codes[end[valid]] == activity_codes[valid]
+
+        start = np.flatnonzero(valid)
+        end = end[valid]
+        before_end = end - 1
+
+        # Interpolate the time the target distance was reached between the two samples around it
+        target = distance[start] + effort_distance
+        step = distance[end] - distance[before_end]
+        fraction = np.divide(target - distance[before_end], step, out=np.ones_like(step), where=step > 0)
+        finish_time = elapsed_time[before_end] + fraction * (elapsed_time[end] - elapsed_time[before_end])
+        effort_time = finish_time - elapsed_time[start]
+
+        efforts = pd.DataFrame({'activity_code': activity_codes[start], 'Elapsed Time (s)': effort_time,
+                                'Start Time (s)': elapsed_time[start]})
+        fastest = efforts.loc[efforts.groupby('activity_code')['Elapsed Time (s)'].idxmin()]
+
+        best_efforts.append(pd.DataFrame({
+            'Activity ID': unique_ids[fastest['activity_code'].to_numpy()],
+            'Effort': effort,
+            'Effort Distance (m)': effort_distance,
+            'Elapsed Time (s)': fastest['Elapsed Time (s)'].to_numpy(),
+            'Start Time (s)': fastest['Start Time (s)'].to_numpy(),
+        }))
+
+    best_efforts_df = pd.concat(best_efforts, ignore_index=True)
+    best_efforts_df['Pace in Mins per Mile'] = (best_efforts_df['Elapsed Time (s)'] / 60) / (
+            best_efforts_df['Effort Distance (m)'] / 1610)
+
+    return best_efforts_df[columns]
+
+
+def concatenate_streams(streams, gap):
+    """
+
+    :param streams: dictionary of Activity ID to a tuple of arrays (cumulative distance in meters, elapsed seconds)
+    :param gap: distance in meters left between consecutive activities
+    :return: tuple of arrays (Activity ID per sample, offset cumulative distance, elapsed seconds), with samples that
+    have no time dropped and distances made non-decreasing within each activity
+    """
+    activity_ids = []
+    distances = []
+    elapsed_times = []
+    offset = 0.0
+
+    for activity_id, (distance, elapsed_time) in streams.items():
+        distance = np.asarray(distance, dtype=np.float64)
+        elapsed_time = np.asarray(elapsed_time, dtype=np.float64)
+
+        has_time = np.isfinite(elapsed_time)
+        distance = distance[has_time]
+        elapsed_time = elapsed_time[has_time]
+        if not len(distance) or not np.isfinite(distance).any():
+            continue
+
+        # GPS dropouts leave NaN or slightly decreasing distances; carry the furthest distance reached forward
+        distance = np.fmax.accumulate(np.nan_to_num(distance, nan=0.0))
+
+        activity_ids.append(np.full(len(distance), activity_id))
+        distances.append(distance + offset)
+        elapsed_times.append(elapsed_time)
+        offset += distance[-1] + gap
+
+    if not distances:
+        return np.array([]), np.array([]), np.array([])
+
+    return np.concatenate(activity_ids), np.concatenate(distances), np.concatenate(elapsed_times)
+
+
+def create_pr_progression(best_efforts_df: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param best_efforts_df: data frame returned by run
+    :return: the best efforts that set a new all-time record for their distance when they were run, in date order
+    """
+    best_efforts_df = best_efforts_df.sort_values('Activity Date', kind='stable')
+    all_time_best = best_efforts_df.groupby('Effort')['Elapsed Time (s)'].cummin()
+    previous_best = all_time_best.groupby(best_efforts_df['Effort']).shift(fill_value=np.inf)
+
+    return best_efforts_df[best_efforts_df['Elapsed Time (s)'] < previous_best].reset_index(drop=True)
+
+
+def create_yearly_bests(best_efforts_df: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param best_efforts_df: data frame returned by run
+    :return: the fastest effort per Activity Year and distance
+    """
+    fastest = best_efforts_df.groupby(['Activity Year', 'Effort'])['Elapsed Time (s)'].idxmin()
+
+    return best_efforts_df.loc[fastest].sort_values(['Effort Distance (m)', 'Activity Year']).reset_index(drop=True)
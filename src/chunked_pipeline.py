@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from src import club_aggregation
+from src import data_cleaning
+from utils import deduplication
+from utils import instrumentation
+from utils.running_utils import add_unit_columns
+
+# Rows of 'activities.csv' read at a time. Peak memory follows this, not the size of the export.
+CHUNK_SIZE = 50_000
+
+
+def run(file_path, athlete=None, chunk_size=CHUNK_SIZE, max_degree=club_aggregation.MAX_DEGREE, near_duplicates=True):
+    """
+    Reduces an export too large to hold in memory to a ClubPartial, reading it chunk_size rows at a time. The export is
+    read twice: once for the keys of its repeated activities, then again to clean each chunk, filter it to runs, give it
+    its unit columns and fold it into the weekly totals, rounded-distance counts, sketches and fit sums of the partial
+    like a whole export would be. Apart from the few key columns of every activity, the partial only grows with the
+    number of weeks and distances run, so the tables of club_aggregation can be made from it for exports of any size.
+
+    :param file_path: path to the 'activities.csv' file, such as a merged dump of many exports
+    :param athlete: name the aggregates are kept under, the export's folder name by default
+    :param chunk_size: number of rows read at a time
+    :param max_degree: highest degree of polynomial the partial can fit
+    :param near_duplicates: if False, only activities sharing an Activity ID are dropped as repeats, so teammates' runs
+    of the same group run in a merged dump are all counted
+    :return: ClubPartial of every run in the export
+    """
+    print(f"Running chunked aggregation of {file_path}, {chunk_size} rows at a time")
+
+    if athlete is None:
+        athlete = club_aggregation.get_athlete_names([file_path])[file_path]
+
+    duplicate = find_repeated_activities(file_path, chunk_size, near_duplicates)
+    if duplicate.any():
+        print(f"Dropped {duplicate.sum()} duplicate activities")
+
+    partial = club_aggregation.empty_partial()
+    chunk_start = 0
+
+    for chunk in read_chunks(file_path, chunk_size, report_renames=False):
+        kept = ~duplicate[chunk_start:chunk_start + len(chunk)]
+        chunk_start += len(chunk)
+
+        with instrumentation.stage('running filter', rows=len(chunk)):
+            running_chunk = chunk.take(np.flatnonzero(kept & (chunk['Activity Type'] == 'Run').to_numpy()))
+        if running_chunk.empty:
+            continue
+
+        running_chunk = add_unit_columns(dataframe=running_chunk, distance_m_col_name='Distance.1',
+                                         m_to_mi_conversion=1 / 1610)
+        partial = club_aggregation.merge_partials(
+            partial, club_aggregation.create_partial_from_running_df(running_chunk, athlete, max_degree))
+
+    if partial.period_totals.empty:
+        raise ValueError(f"No running activities recorded in {file_path}.")
+
+    return partial
+
+
+def find_repeated_activities(file_path, chunk_size=CHUNK_SIZE, near_duplicates=True):
+    """
+    Finds the repeated activities of the whole export with deduplication.find_duplicates, as data_cleaning.clean does,
+    so reading it in chunks drops the same ones however far apart the repeats are. Only the deduplication.KEY_COLUMNS
+    of each activity and its number of recorded values, which decides the copy kept, are held between chunks.
+
+    :param file_path: path to the 'activities.csv' file
+    :param chunk_size: number of rows read at a time
+    :param near_duplicates: passed to deduplication.find_duplicates
+    :return: boolean array, True for every activity of the file, in its order, that repeats one that is kept
+    """
+    keys = []
+    num_recorded = []
+
+    for chunk in read_chunks(file_path, chunk_size):
+        # Categories of different chunks differ, so the activity types are kept as plain strings
+        keys.append(chunk[[col for col in deduplication.KEY_COLUMNS if col in chunk]].astype(
+            {'Activity Type': 'object'}))
+        num_recorded.append(chunk.notna().sum(axis=1).to_numpy())
+
+    if not keys:
+        return np.zeros(0, dtype=bool)
+
+    activities = pd.concat(keys, ignore_index=True)
+    with instrumentation.stage('deduplicate', rows=len(activities)):
+        return deduplication.find_duplicates(activities, near_duplicates=near_duplicates,
+                                             num_recorded=np.concatenate(num_recorded))
+
+
+def read_chunks(file_path, chunk_size=CHUNK_SIZE, report_renames=True):
+    """
+    Reads and cleans the export chunk by chunk, with the same steps as data_cleaning.clean. Columns that are empty
+    throughout the export can't be told apart from ones that are empty in one chunk, so none are dropped; the columns
+    outside data_cleaning.COLUMN_DTYPES are never read anyway.
+
+    :param file_path: path to the 'activities.csv' file
+    :param chunk_size: number of rows read at a time
+    :param report_renames: if False, the repaired headers are not printed, for a file read again
+    :return: generator of cleaned data frames of up to chunk_size activities, in the order of the file
+    """
+    reader = pd.read_csv(file_path, chunksize=chunk_size,
+                         usecols=lambda col: data_cleaning.get_repaired_name(col) in data_cleaning.COLUMN_DTYPES)
+
+    with reader:
+        chunk_number = 0
+        while True:
+            chunk = read_next_chunk(reader)
+            if chunk is None:
+                return
+
+            if chunk_number == 0 and report_renames:
+                data_cleaning.repair_headers(chunk)
+            else:
+                # Every chunk has the same headers, so only the first one's renames are reported
+                chunk.rename(columns=data_cleaning.get_repaired_name, inplace=True)
+
+            data_cleaning.compact_columns(chunk)
+            data_cleaning.add_date_parts(chunk)
+            chunk_number += 1
+
+            yield chunk
+
+
+def read_next_chunk(reader):
+    """
+
+    :param reader: iterator returned by pd.read_csv with a chunksize
+    :return: the next chunk, or None at the end of the file
+    """
+    with instrumentation.stage('read csv chunk') as record:
+        chunk = next(reader, None)
+        record['rows'] = 0 if chunk is None else len(chunk)
+
+    return chunk
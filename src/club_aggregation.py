@@ -0,0 +1,512 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import reduce
+import pandas as pd
+import numpy as np
+from src import data_cleaning
+from src.mileage_and_time_run_per_week import create_period_totals_df, average_weekly_totals
+from utils import calendar_dimension
+from utils import instrumentation
+from utils import quantile_sketch
+from utils.polynomial_fitting import scale_to_window, to_polyval_order
+from utils.running_utils import create_running_df, add_unit_columns
+
+# Small aggregates of one or more athletes' runs. Partials of different athletes, or of different runs of the same
+# athlete, merge into the partial of all of them with merge_partials, in any order and grouping.
+#   period_totals: data frame of summed totals per Athlete, Activity Year, Activity Month and Activity Week
+#   distance_counts: data frame of the Number of Runs per Athlete, Activity Year and Rounded Distance
+#   hr_vs_pace: dictionary of Athlete to the sufficient statistics of the heart rate vs. pace polynomial fit
+#   distributions: data frame of the quantile_sketch centroids of the DISTRIBUTION_METRICS per Athlete, Activity Year
+#   and Rounded Distance
+#   pace_trends: data frame of the sufficient statistics of the pace vs. date polynomial fit per Athlete and Rounded
+#   Distance, in the columns named by get_statistics_columns
+ClubPartial = namedtuple('ClubPartial', ['period_totals', 'distance_counts', 'hr_vs_pace', 'distributions',
+                                         'pace_trends'])
+
+PERIOD_KEYS = ['Athlete', 'Activity Year', 'Activity Month', 'Activity Week']
+DISTANCE_KEYS = ['Athlete', 'Activity Year', 'Rounded Distance']
+HR_TARGETS = ['Average Heart Rate', 'Max Heart Rate']
+DISTRIBUTION_METRICS = ['Pace in Mins per Mile', 'Average Heart Rate', 'Distance in Miles']
+PERCENTILES = (0.1, 0.5, 0.9)
+PACE_TREND_KEYS = ['Athlete', 'Rounded Distance']
+PACE_TREND_DEGREE = 3
+
+# Every partial scales pace onto the same window before taking powers of it, so their sums can be added together.
+# Paces in this domain map onto [-1, 1], which keeps the powers well conditioned. Runs outside it, such as a walk
+# recorded as a run, are left out of the sums, as their powers up to 2 * MAX_DEGREE would swamp everyone else's.
+PACE_DOMAIN = (5.0, 15.0)
+MAX_DEGREE = 5
+# Likewise for dates, as calendar_dimension day numbers, which the pace trends are fitted against
+DATE_DOMAIN = tuple(calendar_dimension.get_day_numbers(['2000-01-01', '2040-01-01']))
+# Fits whose Hankel matrix of power sums is conditioned worse than this are refused rather than solved to noise
+MAX_CONDITION_NUMBER = 1e12
+
+
+def run(file_paths, max_workers=None, max_degree=MAX_DEGREE):
+    """
+    Aggregates many athletes' exports in one parallel pass. Each worker reduces one export to its partial, and the
+    partials are merged as they come in, so the combined runs are never held in memory at once.
+
+    :param file_paths: list of 'activities.csv' file paths, one per athlete
+    :param max_workers: number of worker processes, one per CPU by default
+    :param max_degree: highest degree of heart rate vs. pace polynomial the merged partial can fit
+    :return: the merged ClubPartial of every export that could be aggregated
+    """
+    athlete_names = get_athlete_names(file_paths)
+    merged = empty_partial()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(create_partial, file_path, athlete_names[file_path], max_degree): file_path
+                   for file_path in file_paths}
+
+        for future in as_completed(futures):
+            try:
+                merged = merge_partials(merged, future.result())
+            except Exception as e:
+                print(f"Could not aggregate {futures[future]}: {e!r}")
+
+    return merged
+
+
+def get_athlete_names(file_paths):
+    """
+    Names each export after the folder it lives in, such as strava_export_36240949, adding a numeric suffix when two
+    exports share a folder name.
+
+    :param file_paths: list of 'activities.csv' file paths
+    :return: dictionary of file path to athlete name
+    """
+    athlete_names = {}
+    seen_names = {}
+
+    for file_path in file_paths:
+        name = os.path.basename(os.path.dirname(file_path)) or 'export'
+        seen_names[name] = seen_names.get(name, 0) + 1
+        if seen_names[name] > 1:
+            name = f'{name}_{seen_names[name]}'
+        athlete_names[file_path] = name
+
+    return athlete_names
+
+
+def create_partial(file_path, athlete, max_degree=MAX_DEGREE):
+    """
+
+    :param file_path: path to one athlete's 'activities.csv' file
+    :param athlete: name the athlete's aggregates are kept under
+    :param max_degree: highest degree of heart rate vs. pace polynomial the partial can fit
+    :return: ClubPartial of the athlete's runs
+    """
+    running_df = create_running_df(data_cleaning.run(file_path))
+    running_df = add_unit_columns(dataframe=running_df, distance_m_col_name='Distance.1', m_to_mi_conversion=1 / 1610)
+
+    return create_partial_from_running_df(running_df, athlete, max_degree)
+
+
+def create_partial_from_running_df(running_df: pd.DataFrame, athlete, max_degree=MAX_DEGREE) -> ClubPartial:
+    """
+
+    :param running_df: data frame containing only the running activities, with the unit columns added
+    :param athlete: name the athlete's aggregates are kept under
+    :param max_degree: highest degree of heart rate vs. pace polynomial the partial can fit
+    :return: ClubPartial of the runs
+    """
+    with instrumentation.stage('club partial', rows=len(running_df)):
+        period_totals = create_period_totals_df(running_df)
+        period_totals.insert(0, 'Athlete', athlete)
+
+        rounded_distance = np.round(running_df['Distance in Miles']).rename('Rounded Distance')
+        distance_counts = running_df.groupby(['Activity Year', rounded_distance]).size()
+        distance_counts = distance_counts.rename('Number of Runs').reset_index()
+        distance_counts.insert(0, 'Athlete', athlete)
+
+        distributions = quantile_sketch.create_sketches(
+            running_df[['Activity Year'] + DISTRIBUTION_METRICS].assign(Athlete=athlete, **{
+                'Rounded Distance': rounded_distance}), DISTANCE_KEYS, DISTRIBUTION_METRICS)
+
+        hr_runs = running_df.dropna(subset=['Pace in Mins per Mile'] + HR_TARGETS)
+        hr_vs_pace = {athlete: get_sufficient_statistics(hr_runs['Pace in Mins per Mile'].to_numpy(),
+                                                         hr_runs[HR_TARGETS].to_numpy(), max_degree)}
+
+        pace_trends = create_pace_trend_statistics(running_df.assign(**{'Rounded Distance': rounded_distance}),
+                                                   athlete, max_degree)
+
+    return ClubPartial(period_totals, distance_counts, hr_vs_pace, distributions, pace_trends)
+
+
+def get_sufficient_statistics(pace, heart_rates, max_degree):
+    """
+    Everything a least-squares polynomial fit and its R^2 need, as sums over the runs, so that the statistics of
+    separate sets of runs add up to the statistics of all of them. Runs with a pace outside PACE_DOMAIN are left out.
+
+    :param pace: array of shape (n,) of paces in minutes per mile
+    :param heart_rates: array of shape (n, number of targets)
+    :param max_degree: highest polynomial degree the statistics can fit
+    :return: dictionary with 'x_powers', the sums of scaled pace to the powers 0 to 2 * max_degree, 'xy', the sums of
+    scaled pace to the powers 0 to max_degree times each target, of shape (max_degree + 1, number of targets), and
+    'yy', the sums of each target squared
+    """
+    pace = np.asarray(pace, dtype=np.float64)
+    in_domain = (pace >= PACE_DOMAIN[0]) & (pace <= PACE_DOMAIN[1])
+    x = scale_to_window(pace[in_domain], PACE_DOMAIN)
+    y = np.asarray(heart_rates, dtype=np.float64)[in_domain]
+    powers = np.polynomial.polynomial.polyvander(x, 2 * max_degree)
+
+    return {
+        'x_powers': powers.sum(axis=0),
+        'xy': powers[:, :max_degree + 1].T @ y,
+        'yy': (y ** 2).sum(axis=0),
+    }
+
+
+def create_pace_trend_statistics(running_df: pd.DataFrame, athlete, max_degree=MAX_DEGREE) -> pd.DataFrame:
+    """
+    The same sums as get_sufficient_statistics, of the pace against the run date, per rounded distance. Unlike the
+    run number pace_over_time fits against, the date of a run doesn't depend on the runs before it, so the sums of
+    separate sets of runs add up. Runs dated outside DATE_DOMAIN are left out.
+
+    :param running_df: data frame containing only the running activities, with the unit columns and 'Rounded Distance'
+    :param athlete: name the athlete's statistics are kept under
+    :param max_degree: highest polynomial degree the statistics can fit
+    :return: data frame with one row per Rounded Distance, holding the sums in the columns named by
+    get_statistics_columns
+    """
+    runs = running_df.dropna(subset=['Pace in Mins per Mile', 'Rounded Distance'])
+    day_numbers = calendar_dimension.get_day_numbers(runs['Activity Date']).astype(np.float64)
+    in_domain = (day_numbers >= DATE_DOMAIN[0]) & (day_numbers <= DATE_DOMAIN[1])
+    runs = runs[in_domain]
+    x = scale_to_window(day_numbers[in_domain], DATE_DOMAIN)
+    y = runs['Pace in Mins per Mile'].to_numpy(np.float64)
+    powers = np.polynomial.polynomial.polyvander(x, 2 * max_degree)
+
+    x_power_columns, xy_columns = get_statistics_columns(max_degree)
+    sums = pd.DataFrame(np.column_stack([powers, powers[:, :max_degree + 1] * y[:, None], y ** 2]),
+                        columns=x_power_columns + xy_columns + ['yy'])
+    sums['Rounded Distance'] = runs['Rounded Distance'].to_numpy()
+
+    pace_trends = sums.groupby('Rounded Distance', sort=True).sum().reset_index()
+    pace_trends.insert(0, 'Athlete', athlete)
+
+    return pace_trends
+
+
+def get_statistics_columns(max_degree):
+    """
+
+    :param max_degree: highest polynomial degree the statistics can fit
+    :return: tuple of the lists of the pace_trends columns holding the sums of the powers of x, and of the powers of x
+    times y, as get_sufficient_statistics names 'x_powers' and 'xy'
+    """
+    return [f'x^{power}' for power in range(2 * max_degree + 1)], [f'x^{power} y' for power in range(max_degree + 1)]
+
+
+def empty_partial():
+    return ClubPartial(pd.DataFrame(columns=PERIOD_KEYS), pd.DataFrame(columns=DISTANCE_KEYS), {},
+                       pd.DataFrame(columns=DISTANCE_KEYS + quantile_sketch.CENTROID_COLUMNS),
+                       pd.DataFrame(columns=PACE_TREND_KEYS))
+
+
+def merge_partials(*partials):
+    """
+    Merges partials by adding up their sums and counts, and pooling their sketches' centroids. The merge is associative
+    and commutative, up to the sketches' approximation, so partials can be merged in whatever order and grouping the
+    workers finish in.
+
+    :param partials: ClubPartial objects
+    :return: the ClubPartial of every run in partials
+    """
+    return reduce(merge_two_partials, partials)
+
+
+def merge_two_partials(left: ClubPartial, right: ClubPartial) -> ClubPartial:
+    period_totals = add_totals(left.period_totals, right.period_totals, PERIOD_KEYS)
+    distance_counts = add_totals(left.distance_counts, right.distance_counts, DISTANCE_KEYS)
+
+    hr_vs_pace = dict(left.hr_vs_pace)
+    for athlete, statistics in right.hr_vs_pace.items():
+        if athlete not in hr_vs_pace:
+            hr_vs_pace[athlete] = statistics
+            continue
+        if len(hr_vs_pace[athlete]['x_powers']) != len(statistics['x_powers']):
+            raise ValueError(f"Partials of {athlete} were made for different highest polynomial degrees.")
+        hr_vs_pace[athlete] = {name: hr_vs_pace[athlete][name] + statistics[name] for name in statistics}
+
+    distributions = add_sketches(left.distributions, right.distributions, DISTANCE_KEYS)
+
+    if not left.pace_trends.empty and not right.pace_trends.empty and \
+            set(left.pace_trends.columns) != set(right.pace_trends.columns):
+        raise ValueError("Pace trends were made for different highest polynomial degrees.")
+    pace_trends = add_totals(left.pace_trends, right.pace_trends, PACE_TREND_KEYS)
+
+    return ClubPartial(period_totals, distance_counts, hr_vs_pace, distributions, pace_trends)
+
+
+def add_totals(left, right, keys):
+    if left.empty:
+        return right
+    if right.empty:
+        return left
+
+    return pd.concat([left, right], ignore_index=True).groupby(keys, sort=True).sum().reset_index()
+
+
+def add_sketches(left, right, keys):
+    if left.empty:
+        return right
+    if right.empty:
+        return left
+
+    return quantile_sketch.compress_sketches(pd.concat([left, right], ignore_index=True), keys)
+
+
+def select_athlete_totals(totals, keys, athlete=None):
+    """
+
+    :param totals: period_totals or distance_counts of a ClubPartial
+    :param keys: the columns the totals are kept per, other than Athlete
+    :param athlete: name of the athlete, or None for the whole club
+    :return: the totals of one athlete, or of the whole club summed over every athlete, without the Athlete column
+    """
+    if athlete is not None:
+        totals = totals[totals['Athlete'] == athlete]
+
+    return totals.drop(columns='Athlete').groupby(keys, sort=True).sum().reset_index()
+
+
+def create_weekly_avg_df(partial: ClubPartial, athlete=None, num_weeks_typical=52, current_year=None,
+                         num_weeks_current_year=None, num_weeks_first_year=None):
+    """
+    Same table as mileage_and_time_run_per_week.create_weekly_avg_df, for one athlete or for the club's combined
+    running. The inputs left as None get the defaults inputs.py would suggest: the partial first and current years are
+    counted from the first and last weeks that have runs.
+
+    :param partial: merged ClubPartial
+    :param athlete: name of the athlete, or None for the whole club
+    :param num_weeks_typical: typical number of weeks in a year to consider, 52 weeks by default
+    :param current_year: the current year as an integer, the year of the last run by default
+    :param num_weeks_current_year: number of weeks in the current year collected so far, through the last run's week
+    by default
+    :param num_weeks_first_year: number of weeks in the first year collected, from the first run's week by default
+    :return: data frame with 3 columns: Activity Year, Average Weekly Distance Run in Miles, Average Elapsed Time Run per Week
+    """
+    period_totals = select_athlete_totals(partial.period_totals, PERIOD_KEYS[1:], athlete)
+    if period_totals.empty:
+        raise ValueError(f"No runs aggregated for {athlete or 'the club'}.")
+
+    first_year = period_totals['Activity Year'].min()
+    last_year = period_totals['Activity Year'].max()
+    if current_year is None:
+        current_year = last_year
+    if num_weeks_first_year is None:
+        num_weeks_first_year = num_weeks_typical - period_totals.loc[period_totals['Activity Year'] == first_year,
+                                                                     'Activity Week'].min()
+    if num_weeks_current_year is None:
+        num_weeks_current_year = calendar_dimension.count_weeks_through(
+            last_year, period_totals.loc[period_totals['Activity Year'] == last_year, 'Activity Week'].max())
+
+    return average_weekly_totals(period_totals, first_year=first_year, num_weeks_current_year=num_weeks_current_year,
+                                 num_weeks_first_year=num_weeks_first_year, num_weeks_typical=num_weeks_typical,
+                                 current_year=current_year)
+
+
+def create_distance_counts(partial: ClubPartial, athlete=None) -> pd.DataFrame:
+    """
+
+    :param partial: merged ClubPartial
+    :param athlete: name of the athlete, or None for the whole club
+    :return: data frame of run counts with one row per Activity Year and one column per Rounded Distance, as drawn by
+    pace_over_time.draw_distance_counts_graph
+    """
+    distance_counts = select_athlete_totals(partial.distance_counts, DISTANCE_KEYS[1:], athlete)
+
+    return distance_counts.set_index(['Activity Year', 'Rounded Distance'])['Number of Runs'].unstack(fill_value=0)
+
+
+def create_percentiles_df(partial: ClubPartial, athlete=None, by=('Activity Year', 'Rounded Distance'),
+                          percentiles=PERCENTILES) -> pd.DataFrame:
+    """
+    Answers percentiles of the pace, Average Heart Rate and distance of runs from the merged sketches, in memory that
+    doesn't grow with the number of runs.
+
+    :param partial: merged ClubPartial
+    :param athlete: name of the athlete, or None for the whole club
+    :param by: columns of DISTANCE_KEYS, other than Athlete, to answer the percentiles per. The sketches are merged
+    over the others, so () gives the percentiles of all the runs of every year and distance
+    :param percentiles: quantiles between 0 and 1
+    :return: data frame with one row per value of by and metric, holding the Count of runs and columns such as 'P50'
+    """
+    distributions = partial.distributions
+    if athlete is not None:
+        distributions = distributions[distributions['Athlete'] == athlete]
+
+    return quantile_sketch.get_quantiles(distributions, list(by), percentiles)
+
+
+def fit_hr_vs_pace(partial: ClubPartial, athlete=None, degrees=(1, 2, 3, 4, 5)):
+    """
+    Solves the least-squares heart rate vs. pace fits from the merged sufficient statistics. Cross-validation needs the
+    individual runs, so it is not available here.
+
+    :param partial: merged ClubPartial
+    :param athlete: name of the athlete, or None for the whole club
+    :param degrees: list of polynomial degrees, none higher than the partial was made for
+    :return: dictionary of degree to a dictionary with 'coefficients', an array of shape (2, degree + 1) in np.polyval
+    order for Average and Max Heart Rate, 'r_squared', an array of shape (2,), and 'cv_rmse', all NaN, in the form
+    polynomial_fitting.fit_polynomials returns
+    """
+    athletes = [athlete] if athlete is not None else list(partial.hr_vs_pace)
+    if not athletes or any(name not in partial.hr_vs_pace for name in athletes):
+        raise ValueError(f"No heart rate vs. pace statistics aggregated for {athlete or 'the club'}.")
+
+    statistics = [partial.hr_vs_pace[name] for name in athletes]
+    x_powers = sum(s['x_powers'] for s in statistics)
+    xy = sum(s['xy'] for s in statistics)
+    yy = sum(s['yy'] for s in statistics)
+
+    fits = {}
+    for degree, (scaled_coefficients, r_squared) in solve_sufficient_statistics(x_powers, xy, yy, degrees).items():
+        fits[degree] = {
+            'coefficients': np.array([to_polyval_order(target_coefficients, PACE_DOMAIN)
+                                      for target_coefficients in scaled_coefficients.T]),
+            'r_squared': r_squared,
+            'cv_rmse': np.full(len(yy), np.nan),
+        }
+
+    return fits
+
+
+def solve_sufficient_statistics(x_powers, xy, yy, degrees):
+    """
+
+    :param x_powers: array of the sums of scaled x to the powers 0 to 2 * max_degree
+    :param xy: array of shape (max_degree + 1, number of targets) of the sums of scaled x to the powers 0 to max_degree
+    times each target
+    :param yy: array of shape (number of targets,) of the sums of each target squared
+    :param degrees: list of polynomial degrees, none higher than max_degree
+    :return: dictionary of degree to a tuple of the least-squares coefficients of scaled x, in increasing powers, of
+    shape (degree + 1, number of targets), and the R^2 of each target
+    :raises ValueError: if there are too few points, or they are too bunched up, to fit a degree reliably
+    """
+    n = x_powers[0]
+    max_degree = len(xy) - 1
+    if max(degrees) > max_degree:
+        raise ValueError(f"The partials were made for polynomials up to degree {max_degree}, not {max(degrees)}.")
+    if n <= max(degrees):
+        raise ValueError(f"Fitting a degree {max(degrees)} polynomial needs more than {max(degrees)} points, "
+                         f"got {int(n)}.")
+
+    # X^T X of the scaled Vandermonde matrix is the Hankel matrix of the power sums
+    gram = x_powers[np.add.outer(np.arange(max_degree + 1), np.arange(max_degree + 1))]
+    sst = yy - xy[0] ** 2 / n
+
+    solutions = {}
+    for degree in degrees:
+        degree_gram = gram[:degree + 1, :degree + 1]
+        # Runs of only a few distinct paces, or all bunched at one end of the domain, leave the matrix nearly singular
+        condition_number = np.linalg.cond(degree_gram)
+        if not condition_number <= MAX_CONDITION_NUMBER:
+            raise ValueError(f"The degree {degree} fit is too ill-conditioned to solve, with a condition number of "
+                             f"{condition_number:.3g}.")
+        scaled_coefficients = np.linalg.lstsq(degree_gram, xy[:degree + 1], rcond=None)[0]
+        # The sum of squared residuals, y^T y - 2 b^T X^T y + b^T X^T X b, simplifies to y^T y - b^T X^T y at the
+        # least-squares solution
+        sse = yy - (scaled_coefficients * xy[:degree + 1]).sum(axis=0)
+        solutions[degree] = (scaled_coefficients, 1 - sse / sst)
+
+    return solutions
+
+
+def create_pace_trend_df(partial: ClubPartial, athlete=None, degree=PACE_TREND_DEGREE) -> pd.DataFrame:
+    """
+    Solves the pace vs. date polynomial fit of every rounded distance from the merged sufficient statistics, and
+    evaluates each one in the middle of every year with runs of that distance. Rounded distances with too few runs to
+    fit are left out.
+
+    :param partial: merged ClubPartial
+    :param athlete: name of the athlete, or None for the whole club
+    :param degree: degree of the polynomial, no higher than the partial was made for
+    :return: data frame with one row per Rounded Distance and Activity Year, holding the Number of Runs that year, the
+    'Trend Pace' in minutes per mile on July 1st and the R-squared of the distance's fit
+    """
+    pace_trends = select_athlete_totals(partial.pace_trends, PACE_TREND_KEYS[1:], athlete)
+    distance_counts = select_athlete_totals(partial.distance_counts, DISTANCE_KEYS[1:], athlete)
+    columns = ['Rounded Distance', 'Activity Year', 'Number of Runs', 'Trend Pace', 'R-squared']
+
+    max_degree = sum(col.endswith(' y') for col in pace_trends.columns) - 1
+    x_power_columns, xy_columns = get_statistics_columns(max_degree)
+
+    trend_dfs = []
+    for _, statistics in pace_trends.iterrows():
+        try:
+            [(scaled_coefficients, r_squared)] = solve_sufficient_statistics(
+                statistics[x_power_columns].to_numpy(np.float64), statistics[xy_columns].to_numpy(np.float64)[:, None],
+                statistics[['yy']].to_numpy(np.float64), [degree]).values()
+        except (ValueError, np.linalg.LinAlgError):
+            continue
+
+        years = distance_counts[distance_counts['Rounded Distance'] == statistics['Rounded Distance']]
+        mid_year = calendar_dimension.get_day_numbers(pd.to_datetime(years['Activity Year'].astype(str) + '-07-01'))
+        trend_pace = np.polynomial.polynomial.polyval(scale_to_window(mid_year, DATE_DOMAIN), scaled_coefficients[:, 0])
+
+        trend_dfs.append(years.assign(**{'Trend Pace': trend_pace, 'R-squared': r_squared[0]})[columns])
+
+    if not trend_dfs:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(trend_dfs, ignore_index=True)
+
+
+def write_reports(partial: ClubPartial, output_dir, degrees=(1, 2, 3, 4, 5)):
+    """
+    Writes the club-wide and per-athlete reports of a merged partial as CSV files.
+
+    :param partial: merged ClubPartial
+    :param output_dir: directory the reports are saved in
+    :param degrees: polynomial degrees of the heart rate vs. pace fits
+    :return: list of the paths written
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    athletes = sorted(partial.period_totals['Athlete'].unique())
+
+    weekly_avg_dfs = [create_weekly_avg_df(partial).assign(Athlete='Club')]
+    weekly_avg_dfs += [create_weekly_avg_df(partial, athlete).assign(Athlete=athlete) for athlete in athletes]
+
+    distance_counts_dfs = [create_distance_counts(partial).stack().rename('Number of Runs').reset_index().assign(
+        Athlete='Club'), partial.distance_counts]
+
+    fit_rows = []
+    for athlete in [None] + sorted(partial.hr_vs_pace):
+        try:
+            fits = fit_hr_vs_pace(partial, athlete, degrees)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            print(f"Skipping the heart rate vs. pace fit of {athlete or 'the club'}: {e}")
+            continue
+        for degree, fit in fits.items():
+            for target_index, target in enumerate(HR_TARGETS):
+                fit_rows.append({'Athlete': athlete or 'Club', 'Target': target, 'Degree': degree,
+                                 'R-squared': fit['r_squared'][target_index],
+                                 'Coefficients': ' '.join(f'{c:.6g}' for c in fit['coefficients'][target_index])})
+
+    percentiles_dfs = [create_percentiles_df(partial).assign(Athlete='Club')]
+    percentiles_dfs += [create_percentiles_df(partial, athlete).assign(Athlete=athlete) for athlete in athletes]
+
+    pace_trend_dfs = [create_pace_trend_df(partial).assign(Athlete='Club')]
+    pace_trend_dfs += [create_pace_trend_df(partial, athlete).assign(Athlete=athlete) for athlete in athletes]
+
+    reports = {
+        'weekly_averages.csv': pd.concat(weekly_avg_dfs, ignore_index=True),
+        'distance_counts.csv': pd.concat(distance_counts_dfs, ignore_index=True),
+        'hr_vs_pace_fits.csv': pd.DataFrame(fit_rows),
+        'distribution_percentiles.csv': pd.concat(percentiles_dfs, ignore_index=True),
+        'pace_trends.csv': pd.concat(pace_trend_dfs, ignore_index=True),
+    }
+
+    output_paths = []
+    for file_name, report_df in reports.items():
+        output_path = os.path.join(output_dir, file_name)
+        report_df = report_df[['Athlete'] + [col for col in report_df.columns if col != 'Athlete']]
+        report_df.to_csv(output_path, index=False)
+        output_paths.append(output_path)
+
+    return output_paths
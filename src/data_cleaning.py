@@ -1,42 +1,274 @@
+import hashlib
+import os
 import pandas as pd
 import numpy as np
-import inputs
+from utils import calendar_dimension
+from utils import instrumentation
+from utils.deduplication import drop_duplicates
+from utils.running_utils import index_by_activity_date
 
+# Bump this whenever the cleaning below changes, so cleaned frames cached by older code are not reused
+CLEANING_VERSION = 6
 
-def run(file_path):
+# The columns the analyses use, named as after repair_headers, and the compact dtype each is stored as. Strava repeats
+# some headers and pandas names the second one '<name>.1': 'Distance.1' is always in meters, while 'Distance' is in
+# the units of the activity's sport. Every other column of the export is never read into memory. Activity names are
+# mostly distinct, so they stay plain strings rather than categories.
+COLUMN_DTYPES = {
+    'Activity ID': 'int64',
+    'Activity Date': None,  # parsed by add_date_parts
+    'Activity Name': 'object',
+    'Activity Type': 'category',
+    'Activity Gear': 'category',
+    'Filename': 'object',
+    'Elapsed Time': 'float32',
+    'Moving Time': 'float32',
+    'Distance.1': 'float32',
+    'Average Heart Rate': 'float32',
+    'Max Heart Rate': 'float32',
+    'Apparent Temperature': 'float32',
+}
+
+DATE_PART_DTYPES = {
+    'Activity Year': 'int16',
+    'Activity Month': 'int8',
+    'Activity Week': 'int8',
+    'Activity Hour': 'int8',
+}
+
+# How Strava writes 'Activity Date', such as 'Jan 1, 2015, 12:05:21 AM'
+STRAVA_DATE_FORMAT = '%b %d, %Y, %I:%M:%S %p'
+
+TRANSLATION_MISSING_PREFIX = '<span class="translation_missing" title="translation missing: ' \
+                             'en-US.lib.export.portability_exporter.activities.horton_values'
+
+
+def run(file_path, use_cache=True):
+    """
+
+    :param file_path: path to the 'activities.csv' file from the Strava export
+    :param use_cache: if True, reuse the cleaned data frame cached next to the export when neither the export nor the
+    cleaning code has changed since it was written
+    :return: the cleaned data frame
+    """
     print(f"Running data cleaning on {file_path}")
 
+    if not use_cache:
+        return clean(file_path)
+
+    cache_path = get_cache_path(file_path)
+
+    if os.path.exists(cache_path):
+        print(f"Loading cleaned data from cache {cache_path}")
+        with instrumentation.stage('read cache') as record:
+            cleaned_df = pd.read_parquet(cache_path)
+            record['rows'] = len(cleaned_df)
+        return cleaned_df
+
+    cleaned_df = clean(file_path)
+    write_cache(cleaned_df, cache_path)
+
+    return cleaned_df
+
+
+def clean(file_path):
     # Read in original data
-    raw_ugly_data = pd.read_csv(file_path)
-
-    # Rename columns
-    # Some of Strava's column headers are buggy looking!
-    for col in raw_ugly_data:
-        if '<span class="translation_missing" title="translation missing: ' \
-           'en-US.lib.export.portability_exporter.activities.horton_values' in col:
-            shortened_col = col.replace(
-                '<span class="translation_missing" title="translation missing: '
-                'en-US.lib.export.portability_exporter.activities.horton_values',
-                '').replace('</span>', '')
-            new_col_name = shortened_col.split('>')[1]
-            raw_ugly_data.rename(columns={col: new_col_name}, inplace=True)
-            print(f'Renamed {col[0:30]}... to {new_col_name}')
-
-    # Drop unneeded columns
-    for col in raw_ugly_data:
-        if raw_ugly_data[col].isna().sum() == len(raw_ugly_data[col]):
-            raw_ugly_data.drop(columns=col, inplace=True)
-            print(f'Dropped {col}')
-
-    # Working with Activity date as date-time, and making that info split out into columns
-    raw_ugly_data['Activity Date'] = pd.to_datetime(raw_ugly_data['Activity Date'])
-
-    raw_ugly_data['Activity Year'] = raw_ugly_data['Activity Date'].dt.year
-    raw_ugly_data['Activity Month'] = raw_ugly_data['Activity Date'].dt.month
-    raw_ugly_data['Activity Week'] = raw_ugly_data['Activity Date'].dt.isocalendar().week
-    raw_ugly_data['Activity Hour'] = raw_ugly_data['Activity Date'].dt.hour
-
-    # Create new df called cleaned_df. Obviously it is not perfectly cleaned but it's a start!
-    cleaned_df = raw_ugly_data.copy()
+    raw_ugly_data = read_export(file_path)
+
+    repair_headers(raw_ugly_data)
+    drop_empty_columns(raw_ugly_data)
+    compact_columns(raw_ugly_data)
+    add_date_parts(raw_ugly_data)
+
+    # Overlapping exports and runs recorded on two devices would otherwise be counted twice
+    raw_ugly_data = drop_duplicates(raw_ugly_data)
+
+    # Create new df called cleaned_df, sorted and indexed by date. Obviously it is not perfectly cleaned but it's a
+    # start!
+    with instrumentation.stage('index by date', rows=len(raw_ugly_data)):
+        cleaned_df = index_by_activity_date(raw_ugly_data)
 
     return cleaned_df
+
+
+def read_export(file_path):
+    """
+
+    :param file_path: path to the 'activities.csv' file from the Strava export
+    :return: data frame read from 'activities.csv', holding only the columns in COLUMN_DTYPES under their original
+    headers
+    """
+    with instrumentation.stage('read csv') as record:
+        raw_ugly_data = pd.read_csv(file_path, usecols=lambda col: get_repaired_name(col) in COLUMN_DTYPES)
+        record['rows'] = len(raw_ugly_data)
+
+    return raw_ugly_data
+
+
+def repair_headers(raw_ugly_data):
+    """
+    Renames, in place, the columns whose Strava headers came through as 'translation missing' HTML.
+
+    :param raw_ugly_data: data frame read from 'activities.csv'
+    :return: raw_ugly_data
+    """
+    with instrumentation.stage('repair headers', rows=len(raw_ugly_data)):
+        # Some of Strava's column headers are buggy looking!
+        for col in raw_ugly_data:
+            new_col_name = get_repaired_name(col)
+            if new_col_name != col:
+                raw_ugly_data.rename(columns={col: new_col_name}, inplace=True)
+                print(f'Renamed {col[0:30]}... to {new_col_name}')
+
+    return raw_ugly_data
+
+
+def get_repaired_name(col):
+    """
+
+    :param col: column header from 'activities.csv'
+    :return: the header with any 'translation missing' HTML around it removed
+    """
+    if TRANSLATION_MISSING_PREFIX not in col:
+        return col
+
+    shortened_col = col.replace(TRANSLATION_MISSING_PREFIX, '').replace('</span>', '')
+
+    return shortened_col.split('>')[1]
+
+
+def drop_empty_columns(raw_ugly_data):
+    """
+    Drops, in place, the columns that hold no values at all.
+
+    :param raw_ugly_data: data frame read from 'activities.csv'
+    :return: raw_ugly_data
+    """
+    with instrumentation.stage('drop empty columns', rows=len(raw_ugly_data)):
+        for col in raw_ugly_data:
+            if raw_ugly_data[col].isna().sum() == len(raw_ugly_data[col]):
+                raw_ugly_data.drop(columns=col, inplace=True)
+                print(f'Dropped {col}')
+
+    return raw_ugly_data
+
+
+def compact_columns(raw_ugly_data):
+    """
+    Converts, in place, the columns in COLUMN_DTYPES to their compact dtypes: categories for the few distinct activity
+    types and gear, and float32 for the measurements.
+
+    :param raw_ugly_data: data frame read from 'activities.csv', with repaired headers
+    :return: raw_ugly_data
+    """
+    with instrumentation.stage('compact columns', rows=len(raw_ugly_data)):
+        for col, dtype in COLUMN_DTYPES.items():
+            if dtype is not None and col in raw_ugly_data and raw_ugly_data[col].dtype != dtype:
+                raw_ugly_data[col] = raw_ugly_data[col].astype(dtype)
+
+    return raw_ugly_data
+
+
+def add_date_parts(raw_ugly_data):
+    """
+    Parses 'Activity Date', in place, and splits it out into Activity Year, Month, Week and Hour columns, stored in
+    the small integer types of DATE_PART_DTYPES.
+
+    :param raw_ugly_data: data frame read from 'activities.csv'
+    :return: raw_ugly_data
+    """
+    with instrumentation.stage('derive date parts', rows=len(raw_ugly_data)):
+        raw_ugly_data['Activity Date'] = parse_activity_dates(raw_ugly_data['Activity Date'])
+        add_calendar_parts(raw_ugly_data)
+
+    return raw_ugly_data
+
+
+def add_calendar_parts(activities):
+    """
+    Sets, in place, the Activity Year, Month, Week and Hour columns from the parsed 'Activity Date'. The year, month
+    and week are looked up in the calendar table by day number rather than derived again for every activity, and the
+    week is numbered as calendar_dimension.ACTIVITY_WEEK, like every chart.
+
+    :param activities: data frame with a parsed 'Activity Date' column
+    :return: activities
+    """
+    calendar_parts = calendar_dimension.join_calendar(activities['Activity Date'],
+                                                      ['Year', 'Month', calendar_dimension.ACTIVITY_WEEK])
+
+    activities['Activity Year'] = calendar_parts['Year'].to_numpy()
+    activities['Activity Month'] = calendar_parts['Month'].to_numpy()
+    activities['Activity Week'] = calendar_parts[calendar_dimension.ACTIVITY_WEEK].to_numpy()
+    activities['Activity Hour'] = activities['Activity Date'].dt.hour
+
+    for col, dtype in DATE_PART_DTYPES.items():
+        activities[col] = activities[col].astype(dtype)
+
+    return activities
+
+
+def parse_activity_dates(activity_dates):
+    """
+
+    :param activity_dates: series of 'Activity Date' strings
+    :return: series of datetimes, parsed with STRAVA_DATE_FORMAT, or by inferring the format of exports that differ
+    """
+    try:
+        return pd.to_datetime(activity_dates, format=STRAVA_DATE_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(activity_dates)
+
+
+def get_cache_key(file_path):
+    """
+
+    :param file_path: path to the 'activities.csv' file from the Strava export
+    :return: hex digest of the export's bytes together with CLEANING_VERSION
+    """
+    file_hash = hashlib.sha256(f'cleaning-v{CLEANING_VERSION}'.encode())
+
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def get_cache_path(file_path):
+    """
+
+    :param file_path: path to the 'activities.csv' file from the Strava export
+    :return: path of the parquet file holding the cleaned data frame, next to the export and named after its cache key
+    """
+    export_dir, file_name = os.path.split(os.path.abspath(file_path))
+
+    return os.path.join(export_dir, f'.{file_name}.{get_cache_key(file_path)[:16]}.parquet')
+
+
+def write_cache(cleaned_df, cache_path):
+    """
+    Writes the cleaned data frame to cache_path and removes caches left behind by older versions of the same export.
+    Caching is best effort: if the frame can't be stored as parquet, the pipeline carries on without it.
+
+    :param cleaned_df: the cleaned data frame returned by clean()
+    :param cache_path: path returned by get_cache_path()
+    """
+    export_dir, cache_name = os.path.split(cache_path)
+    cache_prefix = cache_name.rsplit('.', 2)[0] + '.'
+
+    tmp_path = cache_path + '.tmp'
+    try:
+        cleaned_df.to_parquet(tmp_path)
+    except (ImportError, ValueError, TypeError, OSError) as e:
+        print(f"Could not cache cleaned data, continuing without it: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    os.replace(tmp_path, cache_path)
+    print(f"Cached cleaned data at {cache_path}")
+
+    for old_cache_name in os.listdir(export_dir):
+        if old_cache_name.startswith(cache_prefix) and old_cache_name.endswith('.parquet') \
+                and old_cache_name != cache_name:
+            os.remove(os.path.join(export_dir, old_cache_name))
@@ -1,129 +1,237 @@
+import os
 import pandas as pd
 import numpy as np
-import inputs
-import seaborn as sns
-import matplotlib.pyplot as plt
-
-
-def run(running_df):
-    moving_time_in_minutes = running_df['Moving Time'] / 60
-    running_df['Pace in Mins per Mile'] = moving_time_in_minutes / running_df['Distance in Miles']
+from utils import instrumentation
+from utils import memoization
+from utils.plotting import ChartJob, render_charts, save_and_close, create_density_grid, draw_density_grid
+from utils.polynomial_fitting import fit_polynomials, select_degree, clip_degrees
+
+# With chart_mode='auto', charts of more runs than this are drawn as density grids instead of scatter plots
+DENSITY_THRESHOLD = 20_000
+# Number of paces the trend lines are evaluated at, whatever the number of runs
+TREND_POINTS = 200
+
+
+def run(running_df, output_dir='output_graphs', degrees_to_test=(1, 2, 3, 4, 5), chart_mode='auto'):
+    return render_charts(build_charts(running_df, output_dir=output_dir, degrees_to_test=degrees_to_test,
+                                      chart_mode=chart_mode))
+
+
+def build_charts(running_df, output_dir='output_graphs', degrees_to_test=(1, 2, 3, 4, 5), chart_mode='auto',
+                 grid_bins=(60, 40), cache_dir=None):
+    """
+
+    :param running_df: data frame containing only the running activities, with the unit columns added
+    :param output_dir: directory the graphs are saved in, output_graphs/ by default
+    :param degrees_to_test: candidate degrees of the heart rate vs. pace trend lines. The degree with the lowest
+    cross-validated error is plotted for each of Average HR and Max HR, of those polynomial_fitting.clip_degrees keeps
+    for the number of runs
+    :param chart_mode: 'scatter' to draw a marker per run, 'density' to bin the runs into a grid first and draw that as
+    an image, which takes the same time however many runs there are, or 'auto' to draw density grids only for more than
+    DENSITY_THRESHOLD runs
+    :param grid_bins: number of bins along x and y of the density grids
+    :param cache_dir: directory to keep the fits in with memoization.run_stage, so they are only fitted again when the
+    runs or degrees change. Not kept by default
+    :return: chart jobs drawing heart rate vs. pace and heart rate vs. apparent temperature
+    """
+    if chart_mode == 'auto':
+        chart_mode = 'density' if len(running_df) > DENSITY_THRESHOLD else 'scatter'
+    if chart_mode not in ('scatter', 'density'):
+        raise ValueError(f"chart_mode must be 'scatter', 'density' or 'auto', not {chart_mode!r}.")
+
+    # Pace and Fahrenheit columns are derived up front by utils.running_utils.add_unit_columns
 
     # HR vs. Pace
-    # Define the degree values to test
-    degrees_to_test = [3]
-
     # From playing with this, degrees of 2 and 3 worked the best for my data, though 3 looks slightly better than 2.
-    # Greater than degrees = 3, the R^2 value plateaus.
+    # Greater than degrees = 3, the R^2 value plateaus. Sweeping the degrees is cheap, so they are all fitted and the
+    # plotted degree is picked by k-fold cross-validation.
+    hr_targets = {'Average HR': 'Average Heart Rate', 'Max HR': 'Max Heart Rate'}
 
-    # Create a function to calculate R-squared
-    def calculate_r_squared(x, y, degree):
-        # Fit a polynomial regression model
-        coefficients = np.polyfit(x, y, degree)
+    # Sort the data by 'Pace in Mins per Mile'
+    running_df_sorted = running_df.sort_values(by='Pace in Mins per Mile')
+
+    # Drop rows with NaN values in 'Pace in Mins per Mile', 'Average Heart Rate', and 'Max Heart Rate' columns
+    running_df_cleaned = running_df_sorted.dropna(
+        subset=['Pace in Mins per Mile', 'Average Heart Rate', 'Max Heart Rate'])
 
-        # Calculate the predicted values using the polynomial model
-        predicted_values = np.polyval(coefficients, x)
+    # A few runs can't fit or cross-validate the highest degrees, so only the ones they can are tested
+    fitted_degrees = clip_degrees(degrees_to_test, len(running_df_cleaned))
+    if len(fitted_degrees) < len(degrees_to_test):
+        print(f'HR vs Pace - Only {len(running_df_cleaned)} runs, so testing degrees {fitted_degrees}')
+
+    # Fit both heart rate targets for every degree from one shared factorization
+    with instrumentation.stage('fit: heart rate vs pace', rows=len(running_df_cleaned)):
+        fits = memoization.run_stage('fit: heart rate vs pace', fit_polynomials, {
+            'x': running_df_cleaned['Pace in Mins per Mile'], 'y': running_df_cleaned[list(hr_targets.values())],
+            'degrees': tuple(fitted_degrees)}, cache_dir)
+
+    # The trend lines are smooth, so a fixed number of points draws them whatever the number of runs
+    trend_pace = np.linspace(running_df_cleaned['Pace in Mins per Mile'].min(),
+                             running_df_cleaned['Pace in Mins per Mile'].max(), TREND_POINTS)
+    trend_lines = []
+
+    for target_index, target_name in enumerate(hr_targets):
+        # Print the R^2 and cross-validated error for each degree
+        for degree, fit in fits.items():
+            print(f'HR vs Pace - R-squared (R^2) Degree {degree} ({target_name}): '
+                  f'{round(fit["r_squared"][target_index], 2)}, CV RMSE: {round(fit["cv_rmse"][target_index], 2)}')
+
+        # Keep the best polynomial regression line for plotting
+        degree = select_degree(fits, target_index)
+        r_squared = round(fits[degree]['r_squared'][target_index], 2)
+        print(f'HR vs Pace - Using degree {degree} for {target_name}')
+        trend_lines.append((f'Trend Line ({target_name}) Degree {degree}, R^2={r_squared}',
+                            np.polyval(fits[degree]['coefficients'][target_index], trend_pace)))
+
+    if chart_mode == 'density':
+        with instrumentation.stage('bin: heart rate charts', rows=len(running_df)):
+            pace = running_df['Pace in Mins per Mile'].to_numpy()
+            apparent_temperature = running_df['Apparent Temperature (Fahrenheit)'].to_numpy()
+            hr_vs_pace_data = {
+                'grids': [create_density_grid(pace, running_df[column].to_numpy(), bins=grid_bins)
+                          for column in hr_targets.values()],
+                'titles': list(hr_targets),
+                'trend_pace': trend_pace,
+                'trend_lines': trend_lines,
+            }
+            hr_vs_temperature_data = {
+                'grids': [create_density_grid(apparent_temperature, running_df[column].to_numpy(), bins=grid_bins)
+                          for column in hr_targets.values()],
+                'titles': list(hr_targets),
+            }
+
+        return [ChartJob(draw_hr_vs_pace_density, hr_vs_pace_data, os.path.join(output_dir, 'heartrate_vs_pace.png')),
+                ChartJob(draw_hr_vs_temperature_density, hr_vs_temperature_data,
+                         os.path.join(output_dir, 'heartrate_vs_apparenttemp.png'))]
+
+    hr_vs_pace_data = {
+        'pace': running_df_sorted['Pace in Mins per Mile'].to_numpy(),
+        'average_hr': running_df_sorted['Average Heart Rate'].to_numpy(),
+        'max_hr': running_df_sorted['Max Heart Rate'].to_numpy(),
+        'trend_pace': trend_pace,
+        'trend_lines': trend_lines,
+    }
 
-        # Calculate SST (total sum of squares)
-        mean_y = np.mean(y)
-        sst = np.sum((y - mean_y) ** 2)
+    # HR vs. Apparent temperature
+    hr_vs_temperature_data = {
+        'apparent_temperature': running_df['Apparent Temperature (Fahrenheit)'].to_numpy(),
+        'average_hr': running_df['Average Heart Rate'].to_numpy(),
+        'max_hr': running_df['Max Heart Rate'].to_numpy(),
+    }
 
-        # Calculate SSE (residual sum of squares)
-        sse = np.sum((y - predicted_values) ** 2)
+    return [ChartJob(draw_hr_vs_pace_graph, hr_vs_pace_data, os.path.join(output_dir, 'heartrate_vs_pace.png')),
+            ChartJob(draw_hr_vs_temperature_graph, hr_vs_temperature_data,
+                     os.path.join(output_dir, 'heartrate_vs_apparenttemp.png'))]
 
-        # Calculate R-squared (R^2)
-        r_squared = 1 - (sse / sst)
 
-        return r_squared
+def draw_hr_vs_pace_graph(hr_vs_pace_data, output_path):
+    """
 
-    # Sort the data by 'Pace in Mins per Mile'
-    running_df_sorted = running_df.sort_values(by='Pace in Mins per Mile')
+    :param hr_vs_pace_data: dictionary of plot data built by build_charts
+    :param output_path: file path the graph is saved to
+    """
+    import matplotlib.pyplot as plt
 
     # Create a figure to display the plots
-    plt.figure(figsize=(12, 6))
+    fig, ax = plt.subplots(figsize=(12, 6))
 
     # Create the scatter plot
-    plt.scatter(running_df_sorted['Pace in Mins per Mile'], running_df_sorted['Average Heart Rate'], label='Average HR',
-                marker='o')
-    plt.scatter(running_df_sorted['Pace in Mins per Mile'], running_df_sorted['Max Heart Rate'], label='Max HR',
-                marker='x')
+    ax.scatter(hr_vs_pace_data['pace'], hr_vs_pace_data['average_hr'], label='Average HR', marker='o')
+    ax.scatter(hr_vs_pace_data['pace'], hr_vs_pace_data['max_hr'], label='Max HR', marker='x')
 
-    # Drop rows with NaN values in 'Pace in Mins per Mile', 'Average Heart Rate', and 'Max Heart Rate' columns
-    running_df_cleaned = running_df_sorted.dropna(
-        subset=['Pace in Mins per Mile', 'Average Heart Rate', 'Max Heart Rate'])
-
-    # Initialize a dictionary to store R^2 values for each degree
-    r_squared_values = {}
-
-    for degree in degrees_to_test:
-        # Fit a polynomial regression line for 'Average Heart Rate' in the cleaned dataset
-        coefficients_avg = np.polyfit(running_df_cleaned['Pace in Mins per Mile'],
-                                      running_df_cleaned['Average Heart Rate'], degree)
-
-        # Fit a polynomial regression line for 'Max Heart Rate' in the cleaned dataset
-        coefficients_max = np.polyfit(running_df_cleaned['Pace in Mins per Mile'], running_df_cleaned['Max Heart Rate'],
-                                      degree)
-
-        # Calculate R-squared (R^2) for 'Average Heart Rate'
-        r_squared_avg = calculate_r_squared(running_df_cleaned['Pace in Mins per Mile'],
-                                            running_df_cleaned['Average Heart Rate'], degree)
-
-        # Calculate R-squared (R^2) for 'Max Heart Rate'
-        r_squared_max = calculate_r_squared(running_df_cleaned['Pace in Mins per Mile'],
-                                            running_df_cleaned['Max Heart Rate'], degree)
-
-        # Store the R^2 values in the dictionary
-        r_squared_values[f'Degree {degree} (Average HR)'] = round(r_squared_avg, 2)
-        r_squared_values[f'Degree {degree} (Max HR)'] = round(r_squared_max, 2)
-
-        # Plot the polynomial regression lines
-        plt.plot(
-            running_df_cleaned['Pace in Mins per Mile'],
-            np.polyval(coefficients_avg, running_df_cleaned['Pace in Mins per Mile']),
-            label=f'Trend Line (Average HR) Degree {degree}, R^2={round(r_squared_avg, 2)}',
-        )
-        plt.plot(
-            running_df_cleaned['Pace in Mins per Mile'],
-            np.polyval(coefficients_max, running_df_cleaned['Pace in Mins per Mile']),
-            label=f'Trend Line (Max HR) Degree {degree}, R^2={round(r_squared_max, 2)}',
-        )
+    # Plot the polynomial regression lines
+    for label, trend_line in hr_vs_pace_data['trend_lines']:
+        ax.plot(hr_vs_pace_data['trend_pace'], trend_line, label=label)
 
     # Set axis labels and a legend
-    plt.xlabel('Pace (min/mile)')
-    plt.ylabel('Heart Rate (BPM)')
-    plt.legend()
+    ax.set_xlabel('Pace (min/mile)')
+    ax.set_ylabel('Heart Rate (BPM)')
+    ax.legend()
 
-    # Show the plot
-    plt.grid(True)  # Add gridlines for better readability
-    plt.title('Heart Rate vs. Pace')
-    plt.savefig('output_graphs/heartrate_vs_pace.png')
-    plt.show()
+    ax.grid(True)  # Add gridlines for better readability
+    ax.set_title('Heart Rate vs. Pace')
 
-    # Print the R^2 values for each degree
-    for degree, r_squared in r_squared_values.items():
-        print(f'HR vs Pace - R-squared (R^2) {degree}: {r_squared}')
+    save_and_close(fig, output_path)
 
 
-    # HR vs. Apparent temperature
-    # Convert apparent temperature from Celsius to Fahrenheit
-    running_df['Apparent Temperature (Fahrenheit)'] = (running_df['Apparent Temperature'] * 9 / 5) + 32
+def draw_hr_vs_temperature_graph(hr_vs_temperature_data, output_path):
+    """
+
+    :param hr_vs_temperature_data: dictionary of plot data built by build_charts
+    :param output_path: file path the graph is saved to
+    """
+    import matplotlib.pyplot as plt
 
     # Establish the size of the figure
-    plt.figure(figsize=(12, 6))
+    fig, ax = plt.subplots(figsize=(12, 6))
 
     # Create the scatter plot
-    plt.scatter(running_df['Apparent Temperature (Fahrenheit)'], running_df['Average Heart Rate'], label='Average HR',
-                marker='o')
-    plt.scatter(running_df['Apparent Temperature (Fahrenheit)'], running_df['Max Heart Rate'], label='Max HR',
-                marker='x')
+    ax.scatter(hr_vs_temperature_data['apparent_temperature'], hr_vs_temperature_data['average_hr'],
+               label='Average HR', marker='o')
+    ax.scatter(hr_vs_temperature_data['apparent_temperature'], hr_vs_temperature_data['max_hr'], label='Max HR',
+               marker='x')
 
     # Set axis labels and a legend
-    plt.xlabel('Apparent Temperature (*F)')
-    plt.ylabel('Heart Rate (BPM)')
-    plt.legend()
-
-    # Show the plot
-    plt.grid(True)  # Add gridlines for better readability
-    plt.title('Heart Rate vs. Apparent Temperature')
-    plt.savefig('output_graphs/heartrate_vs_apparenttemp.png')
-    plt.show()
+    ax.set_xlabel('Apparent Temperature (*F)')
+    ax.set_ylabel('Heart Rate (BPM)')
+    ax.legend()
+
+    ax.grid(True)  # Add gridlines for better readability
+    ax.set_title('Heart Rate vs. Apparent Temperature')
+
+    save_and_close(fig, output_path)
+
+
+def draw_hr_vs_pace_density(hr_vs_pace_data, output_path):
+    """
+    Draws Average HR and Max HR vs. pace side by side as density grids, each with its trend line.
+
+    :param hr_vs_pace_data: dictionary of plot data built by build_charts in 'density' mode
+    :param output_path: file path the graph is saved to
+    """
+    def add_trend_line(ax, target_index):
+        label, trend_line = hr_vs_pace_data['trend_lines'][target_index]
+        ax.plot(hr_vs_pace_data['trend_pace'], trend_line, color='red', label=label)
+        ax.set_xlabel('Pace (min/mile)')
+
+    draw_density_panels(hr_vs_pace_data, output_path, 'Heart Rate vs. Pace', add_trend_line)
+
+
+def draw_hr_vs_temperature_density(hr_vs_temperature_data, output_path):
+    """
+
+    :param hr_vs_temperature_data: dictionary of plot data built by build_charts in 'density' mode
+    :param output_path: file path the graph is saved to
+    """
+    def add_label(ax, target_index):
+        ax.set_xlabel('Apparent Temperature (*F)')
+
+    draw_density_panels(hr_vs_temperature_data, output_path, 'Heart Rate vs. Apparent Temperature', add_label)
+
+
+def draw_density_panels(data, output_path, title, decorate):
+    """
+
+    :param data: dictionary with 'grids' and 'titles', one per heart rate target
+    :param output_path: file path the graph is saved to
+    :param title: title of the figure
+    :param decorate: function called with each panel's axes and target index to draw on top of the grid
+    """
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, len(data['grids']), figsize=(14, 6), squeeze=False)
+
+    for target_index, (ax, grid, panel_title) in enumerate(zip(axes[0], data['grids'], data['titles'])):
+        image = draw_density_grid(ax, grid)
+        decorate(ax, target_index)
+        # Keep the view on the grid even where a trend line runs off it
+        ax.set_xlim(grid['extent'][:2])
+        ax.set_ylim(grid['extent'][2:])
+        ax.set_ylabel('Heart Rate (BPM)')
+        ax.set_title(panel_title)
+        ax.legend(loc='upper right')
+        fig.colorbar(image, ax=ax, label='Runs')
+
+    fig.suptitle(title)
+
+    save_and_close(fig, output_path)
@@ -0,0 +1,319 @@
+import json
+import os
+import time
+import pandas as pd
+import numpy as np
+from src import data_cleaning
+from src.mileage_and_time_run_per_week import create_period_totals_df, average_weekly_totals
+from utils import deduplication
+from utils import instrumentation
+from utils.running_utils import add_unit_columns, index_by_activity_date
+
+# Layout of a persistent store directory
+ACTIVITIES_DIR = 'activities'
+# Bump this whenever the keys of the stored totals change, so totals written by older code are rebuilt from the stored
+# activities rather than merged into. Version 2 numbers Activity Week as calendar_dimension.ACTIVITY_WEEK, not ISO
+# weeks.
+PERIOD_TOTALS_VERSION = 2
+PERIOD_TOTALS_FILE = f'period_totals.v{PERIOD_TOTALS_VERSION}.parquet'
+LEGACY_PERIOD_TOTALS_FILES = ['period_totals.parquet']
+PERIOD_KEYS = ['Activity Year', 'Activity Month', 'Activity Week']
+# The totals file lists the activity parts it includes in its parquet metadata under this key, so the totals and the
+# set of ingested activities are committed together by the one os.replace of the totals
+PARTS_METADATA_KEY = b'ingested_parts'
+
+
+def run(file_path, store_dir):
+    """
+    Adds the activities of a new Strava export that aren't in the store yet, by Activity ID, and updates the stored
+    running totals with only those new runs. Each export is expected to be a superset of the ones before it, so the
+    cost of a refresh follows the number of new activities rather than the length of the history.
+
+    :param file_path: path to the 'activities.csv' file from the Strava export
+    :param store_dir: directory of the persistent store, created on first use
+    :return: tuple of the newly added running activities, with unit columns, and the updated period totals
+    """
+    print(f"Running incremental ingest of {file_path} into {store_dir}")
+
+    raw_ugly_data = data_cleaning.read_export(file_path)
+    data_cleaning.repair_headers(raw_ugly_data)
+
+    # Loaded first, so the runs of a part a crashed ingest left out of the totals are added to them
+    period_totals_df = load_period_totals(store_dir)
+
+    stored_ids = get_stored_activity_ids(store_dir)
+    new_activities = raw_ugly_data.take(np.flatnonzero(~raw_ugly_data['Activity ID'].isin(stored_ids)))
+
+    if new_activities.empty:
+        print("No new activities since the last ingest")
+        return new_activities, period_totals_df
+
+    data_cleaning.compact_columns(new_activities)
+    data_cleaning.add_date_parts(new_activities)
+    new_activities = drop_stored_duplicates(new_activities, store_dir)
+
+    if new_activities.empty:
+        print("No new activities since the last ingest")
+        return new_activities, period_totals_df
+
+    print(f"Found {len(new_activities)} new activities")
+    committed_parts = [os.path.basename(part_path) for part_path in get_part_paths(store_dir)]
+    part_path = append_activities(new_activities, store_dir)
+
+    # Until the totals listing the new part replace the old ones, the part isn't counted as ingested
+    with instrumentation.stage('running filter', rows=len(new_activities)):
+        new_running_df = new_activities.take(np.flatnonzero(new_activities['Activity Type'] == 'Run'))
+    new_running_df = add_unit_columns(new_running_df)
+    period_totals_df = merge_period_totals(period_totals_df, create_period_totals_df(new_running_df))
+    write_period_totals(period_totals_df, store_dir, committed_parts + [os.path.basename(part_path)])
+
+    return new_running_df, period_totals_df
+
+
+def get_stored_activity_ids(store_dir):
+    """
+
+    :param store_dir: directory of the persistent store
+    :return: array of the Activity IDs already in the store, only reading that one column from disk
+    """
+    part_paths = get_part_paths(store_dir)
+    if not part_paths:
+        return np.array([], dtype='int64')
+
+    return np.concatenate([pd.read_parquet(part_path, columns=['Activity ID'])['Activity ID'].to_numpy()
+                           for part_path in part_paths])
+
+
+def drop_stored_duplicates(new_activities, store_dir):
+    """
+    Drops the new activities that repeat each other, or that repeat an activity already in the store under another
+    Activity ID, such as a run synced from a second device after the first one's copy was ingested. Only the key
+    columns of the stored activities that started around the same time as the new ones are compared.
+
+    :param new_activities: cleaned data frame of activities not yet in the store, 'Activity Date' parsed
+    :param store_dir: directory of the persistent store
+    :return: new_activities without the repeats
+    """
+    with instrumentation.stage('deduplicate', rows=len(new_activities)):
+        stored_keys = get_stored_keys(store_dir)
+        stored_keys = stored_keys[
+            (stored_keys['Activity Date'] >= new_activities['Activity Date'].min() - deduplication.START_TOLERANCE) &
+            (stored_keys['Activity Date'] <= new_activities['Activity Date'].max() + deduplication.START_TOLERANCE)]
+
+        # Stored activities are protected, so only new ones are ever dropped
+        activities = pd.concat([stored_keys, new_activities.astype({'Activity Type': 'object'})], ignore_index=True)
+        protected = np.arange(len(activities)) < len(stored_keys)
+        duplicate = deduplication.find_duplicates(activities, protected)[len(stored_keys):]
+
+        if duplicate.any():
+            print(f"Dropped {duplicate.sum()} duplicate activities")
+            new_activities = new_activities.take(np.flatnonzero(~duplicate))
+
+    return new_activities
+
+
+def get_stored_keys(store_dir):
+    """
+
+    :param store_dir: directory of the persistent store
+    :return: data frame of the deduplication.KEY_COLUMNS of the stored activities, only reading those columns from disk
+    """
+    import pyarrow.parquet as pq
+
+    parts = []
+    for part_path in get_part_paths(store_dir):
+        stored_columns = pq.read_schema(part_path).names
+        parts.append(pd.read_parquet(part_path, columns=[col for col in deduplication.KEY_COLUMNS
+                                                         if col in stored_columns]))
+
+    if not parts:
+        return pd.DataFrame({'Activity ID': pd.Series(dtype='int64'),
+                             'Activity Date': pd.Series(dtype='datetime64[ns]')})
+
+    stored_keys = pd.concat(parts, ignore_index=True)
+    if 'Activity Type' in stored_keys:
+        stored_keys['Activity Type'] = stored_keys['Activity Type'].astype('object')
+
+    return stored_keys
+
+
+def get_part_paths(store_dir):
+    """
+
+    :param store_dir: directory of the persistent store
+    :return: sorted list of the parquet files holding the stored activities, one per ingest
+    """
+    activities_dir = os.path.join(store_dir, ACTIVITIES_DIR)
+    if not os.path.isdir(activities_dir):
+        return []
+
+    return sorted(os.path.join(activities_dir, name) for name in os.listdir(activities_dir)
+                  if name.endswith('.parquet'))
+
+
+def append_activities(new_activities, store_dir):
+    """
+    Writes new cleaned activities to their own part file, so earlier parts are never rewritten.
+
+    :param new_activities: cleaned data frame of activities not yet in the store
+    :param store_dir: directory of the persistent store
+    :return: path of the part file written
+    """
+    activities_dir = os.path.join(store_dir, ACTIVITIES_DIR)
+    os.makedirs(activities_dir, exist_ok=True)
+
+    part_path = os.path.join(activities_dir, f'part-{time.time_ns()}.parquet')
+    new_activities.to_parquet(part_path + '.tmp')
+    os.replace(part_path + '.tmp', part_path)
+
+    return part_path
+
+
+def load_activities(store_dir, activity_type=None):
+    """
+
+    :param store_dir: directory of the persistent store
+    :param activity_type: if given, such as 'Run', only the stored activities of this type are read from disk
+    :return: cleaned data frame of every stored activity, in the same form data_cleaning.run returns
+    """
+    part_paths = get_part_paths(store_dir)
+    if not part_paths:
+        raise ValueError(f"No activities stored in {store_dir} yet. Ingest an export first.")
+
+    filters = [('Activity Type', '==', activity_type)] if activity_type is not None else None
+    activities = pd.concat([pd.read_parquet(part_path, filters=filters) for part_path in part_paths])
+
+    # Parts written at different times hold different categories, which concat widens back to plain objects
+    data_cleaning.compact_columns(activities)
+    # Parts written before the week numbering was unified hold ISO weeks
+    data_cleaning.add_calendar_parts(activities)
+
+    return index_by_activity_date(activities)
+
+
+def load_period_totals(store_dir):
+    """
+    Totals of a store written before PERIOD_TOTALS_VERSION are rebuilt from its activities on first load. The runs of
+    parts that aren't listed in the totals, written by an ingest that stopped before saving its totals, are added to
+    them.
+
+    :param store_dir: directory of the persistent store
+    :return: stored period totals, in the form create_period_totals_df returns, or None before the first ingest
+    """
+    import pyarrow.parquet as pq
+
+    period_totals_path = os.path.join(store_dir, PERIOD_TOTALS_FILE)
+    part_names = [os.path.basename(part_path) for part_path in get_part_paths(store_dir)]
+
+    if not os.path.exists(period_totals_path):
+        return rebuild_period_totals(store_dir) if part_names else None
+
+    table = pq.read_table(period_totals_path)
+    period_totals_df = table.to_pandas()
+    metadata = table.schema.metadata or {}
+    if PARTS_METADATA_KEY not in metadata:
+        # Totals saved before the parts were listed include every part there is
+        return period_totals_df
+
+    committed_parts = json.loads(metadata[PARTS_METADATA_KEY])
+    uncommitted_parts = [part_name for part_name in part_names if part_name not in committed_parts]
+    if not uncommitted_parts:
+        return period_totals_df
+
+    print(f"Adding the runs of {len(uncommitted_parts)} activity parts left out of the totals of {store_dir}")
+    activities = pd.concat([pd.read_parquet(os.path.join(store_dir, ACTIVITIES_DIR, part_name))
+                            for part_name in uncommitted_parts])
+    data_cleaning.compact_columns(activities)
+    data_cleaning.add_calendar_parts(activities)
+    running_df = activities.take(np.flatnonzero(activities['Activity Type'] == 'Run'))
+    period_totals_df = merge_period_totals(period_totals_df, create_period_totals_df(add_unit_columns(running_df)))
+    write_period_totals(period_totals_df, store_dir, committed_parts + uncommitted_parts)
+
+    return period_totals_df
+
+
+def rebuild_period_totals(store_dir):
+    """
+    Recomputes the period totals from every stored activity, with the current week numbering, saves them and removes
+    the totals of older versions.
+
+    :param store_dir: directory of the persistent store
+    :return: the rebuilt period totals, in the form create_period_totals_df returns
+    """
+    print(f"Rebuilding the running totals of {store_dir}")
+    activities = load_activities(store_dir)
+
+    with instrumentation.stage('running filter', rows=len(activities)):
+        running_df = activities.take(np.flatnonzero(activities['Activity Type'] == 'Run'))
+    period_totals_df = create_period_totals_df(add_unit_columns(running_df))
+    write_period_totals(period_totals_df, store_dir, [os.path.basename(part_path)
+                                                      for part_path in get_part_paths(store_dir)])
+
+    for legacy_file in LEGACY_PERIOD_TOTALS_FILES:
+        if os.path.exists(os.path.join(store_dir, legacy_file)):
+            os.remove(os.path.join(store_dir, legacy_file))
+
+    return period_totals_df
+
+
+def write_period_totals(period_totals_df, store_dir, part_names):
+    """
+    Saves the totals along with the names of the activity parts they include, replacing both at once.
+
+    :param period_totals_df: period totals, in the form create_period_totals_df returns
+    :param store_dir: directory of the persistent store
+    :param part_names: file names of the parts in the activities directory whose runs the totals include
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(period_totals_df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           PARTS_METADATA_KEY: json.dumps(sorted(part_names)).encode()})
+
+    period_totals_path = os.path.join(store_dir, PERIOD_TOTALS_FILE)
+    pq.write_table(table, period_totals_path + '.tmp')
+    os.replace(period_totals_path + '.tmp', period_totals_path)
+
+
+def merge_period_totals(period_totals_df, new_period_totals_df):
+    """
+    Adds the totals of new runs onto the stored totals. Only the year/month/week rows the new runs fall in change.
+
+    :param period_totals_df: stored period totals, or None before the first ingest
+    :param new_period_totals_df: period totals of the new runs only
+    :return: merged period totals, in the form create_period_totals_df returns
+    """
+    if period_totals_df is None or period_totals_df.empty:
+        return new_period_totals_df
+
+    merged = period_totals_df.set_index(PERIOD_KEYS).add(new_period_totals_df.set_index(PERIOD_KEYS), fill_value=0)
+    merged['Number of Runs'] = merged['Number of Runs'].astype('int64')
+
+    return merged.sort_index().reset_index()
+
+
+def create_weekly_avg_df(store_dir, num_weeks_current_year: int, num_weeks_first_year: int, num_weeks_typical=52,
+                         current_year=2023, period_totals_df=None):
+    """
+    Same table as mileage_and_time_run_per_week.create_weekly_avg_df, computed from the stored totals without
+    touching the stored activities.
+
+    :param store_dir: directory of the persistent store
+    :param num_weeks_current_year: number of weeks in the current year collected so far, since it is not yet complete
+    :param num_weeks_first_year: number of weeks in the first year collected
+    :param num_weeks_typical: typical number of weeks in a year to consider, 52 weeks by default
+    :param current_year: the current year as an integer, 2023 by default
+    :param period_totals_df: the stored totals, as run returns them, so they aren't read again. Read from the store by
+    default
+    :return: data frame with 3 columns: Activity Year, Average Weekly Distance Run in Miles, Average Elapsed Time Run per Week
+    """
+    if period_totals_df is None:
+        period_totals_df = load_period_totals(store_dir)
+    if period_totals_df is None:
+        raise ValueError(f"No running totals stored in {store_dir} yet. Ingest an export first.")
+
+    return average_weekly_totals(period_totals_df, first_year=period_totals_df['Activity Year'].min(),
+                                 num_weeks_current_year=num_weeks_current_year,
+                                 num_weeks_first_year=num_weeks_first_year, num_weeks_typical=num_weeks_typical,
+                                 current_year=current_year)
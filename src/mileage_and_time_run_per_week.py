@@ -1,8 +1,37 @@
+import os
 import pandas as pd
 import numpy as np
-import inputs
-import seaborn as sns
-import matplotlib.pyplot as plt
+from utils import instrumentation
+from utils.calendar_dimension import ACTIVITY_WEEK, create_calendar_df
+from utils.plotting import ChartJob, render_charts, save_and_close
+
+
+def create_period_totals_df(running_df: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param running_df: data frame containing only the running activities
+    :return: tidy data frame with one row per Activity Year, Activity Month and Activity Week containing runs, holding
+    the summed Distance in Miles, Elapsed Time and Moving Time, and the Number of Runs
+    """
+    # One grouped pass over the runs; every coarser total is a roll-up of this small table
+    with instrumentation.stage('weekly aggregation', rows=len(running_df)):
+        return running_df.groupby(['Activity Year', 'Activity Month', 'Activity Week'], sort=True).agg(
+            **{'Distance in Miles': ('Distance in Miles', 'sum'),
+               'Elapsed Time': ('Elapsed Time', 'sum'),
+               'Moving Time': ('Moving Time', 'sum'),
+               'Number of Runs': ('Distance in Miles', 'size')}).reset_index()
+
+
+def roll_up_period_totals(period_totals_df: pd.DataFrame, by) -> pd.DataFrame:
+    """
+
+    :param period_totals_df: data frame returned by create_period_totals_df
+    :param by: column name or list of column names to total over, such as 'Activity Year' or
+    ['Activity Year', 'Activity Week']
+    :return: tidy data frame with one row per value of by, holding the summed totals
+    """
+    return period_totals_df.groupby(by, sort=True)[
+        ['Distance in Miles', 'Elapsed Time', 'Moving Time', 'Number of Runs']].sum().reset_index()
 
 
 def create_weekly_avg_df(running_df, num_weeks_current_year: int, num_weeks_first_year: int, num_weeks_typical=52,
@@ -17,134 +46,177 @@ def create_weekly_avg_df(running_df, num_weeks_current_year: int, num_weeks_firs
     :return: data frame with 3 columns: Activity Year, Average Weekly Distance Run in Miles, Average Elapsed Time Run per Week
     """
 
-    # Identify the years for which we have data
-    years_studied = running_df['Activity Year'].unique()
+    # Establish the first year
+    first_year = running_df['Activity Year'].iloc[0]
 
-    # Initialize the data frame
-    weekly_avg_df = pd.DataFrame(
-        data={'Activity Year': years_studied, 'Weekly Distance Run (Miles)': np.zeros(len(years_studied)),
-              'Elapsed Time Run': np.zeros(len(years_studied))})
+    return average_weekly_totals(create_period_totals_df(running_df), first_year=first_year,
+                                 num_weeks_current_year=num_weeks_current_year,
+                                 num_weeks_first_year=num_weeks_first_year, num_weeks_typical=num_weeks_typical,
+                                 current_year=current_year)
 
-    # Establish the first year
-    first_year = running_df.reset_index()['Activity Year'][0]
-
-    for year in years_studied:
-        if year == first_year:
-            weekly_avg = running_df[(running_df['Activity Year'] == year)][
-                             ['Activity Week', 'Distance in Miles', 'Elapsed Time']].groupby('Activity Week',
-                                                                                             dropna=False).sum().sum() / num_weeks_first_year
-
-        elif year < current_year:
-            weekly_avg = running_df[(running_df['Activity Year'] == year)][
-                             ['Activity Week', 'Distance in Miles', 'Elapsed Time']].groupby('Activity Week',
-                                                                                             dropna=False).sum().sum() / num_weeks_typical
-
-        elif year == current_year:
-            weekly_avg = running_df[(running_df['Activity Year'] == year)][
-                             ['Activity Week', 'Distance in Miles', 'Elapsed Time']].groupby('Activity Week',
-                                                                                             dropna=False).sum().sum() / num_weeks_current_year
-        else:
-            raise ValueError(
-                f"Please check your current_year variable. Is {current_year} less than one of these?: {years_studied}")
-
-        weekly_avg_df.loc[weekly_avg_df['Activity Year'] == year, 'Weekly Distance Run (Miles)'] = weekly_avg[
-            'Distance in Miles']
-        weekly_avg_df.loc[weekly_avg_df['Activity Year'] == year, 'Elapsed Time Run'] = weekly_avg['Elapsed Time']
+
+def average_weekly_totals(period_totals_df: pd.DataFrame, first_year: int, num_weeks_current_year: int,
+                          num_weeks_first_year: int, num_weeks_typical=52, current_year=2023):
+    """
+
+    :param period_totals_df: data frame returned by create_period_totals_df
+    :param first_year: the first year of the data set
+    :param num_weeks_current_year: number of weeks in the current year collected so far, since it is not yet complete
+    :param num_weeks_first_year: number of weeks in the first year collected
+    :param num_weeks_typical: typical number of weeks in a year to consider, 52 weeks by default
+    :param current_year: the current year as an integer, 2023 by default
+    :return: data frame with 3 columns: Activity Year, Average Weekly Distance Run in Miles, Average Elapsed Time Run per Week
+    """
+    yearly_totals = roll_up_period_totals(period_totals_df, 'Activity Year')
+    years_studied = yearly_totals['Activity Year'].to_numpy()
+
+    if (years_studied > current_year).any():
+        raise ValueError(
+            f"Please check your current_year variable. Is {current_year} less than one of these?: {years_studied}")
+
+    # The first year and the current year are only partially covered, every other year counts as a typical year
+    num_weeks = np.select([years_studied == first_year, years_studied == current_year],
+                          [num_weeks_first_year, num_weeks_current_year], default=num_weeks_typical)
+
+    weekly_avg_df = pd.DataFrame(
+        data={'Activity Year': years_studied,
+              'Weekly Distance Run (Miles)': yearly_totals['Distance in Miles'].to_numpy() / num_weeks,
+              'Elapsed Time Run': yearly_totals['Elapsed Time'].to_numpy() / num_weeks})
 
     return weekly_avg_df
 
 
-def create_weekly_avg_graph(weekly_avg_df: pd.DataFrame):
+def weekly_avg_chart_job(weekly_avg_df: pd.DataFrame, output_dir='output_graphs') -> ChartJob:
     """
 
     :param weekly_avg_df: data frame with 3 columns: Activity Year, Average Weekly Distance Run in Miles, Average
     Elapsed Time Run per Week
+    :param output_dir: directory the graph is saved in, output_graphs/ by default
+    :return: chart job drawing average weekly miles run vs. year
+    """
+    return ChartJob(draw_weekly_avg_graph, weekly_avg_df.reset_index(),
+                    os.path.join(output_dir, 'averaged_weekly_miles_run.png'))
+
+
+def create_weekly_avg_graph(weekly_avg_df: pd.DataFrame, output_dir='output_graphs'):
+    """
+
+    :param weekly_avg_df: data frame with 3 columns: Activity Year, Average Weekly Distance Run in Miles, Average
+    Elapsed Time Run per Week
+    :param output_dir: directory the graph is saved in, output_graphs/ by default
     :return: graph of average weekly miles run vs. year
     """
     # TODO: ZMcB Oct 4 2023 Add ability to filter by years such as:
     #  [(weekly_avg_df['Activity Year'] > 2018) & (weekly_avg_df['Activity Year'] < 2023)]
-    weekly_avg_df_graph = weekly_avg_df.reset_index()
+    return render_charts([weekly_avg_chart_job(weekly_avg_df, output_dir)], max_workers=1)[0]
 
-    ax = sns.barplot(data=weekly_avg_df_graph, x='Activity Year', y='Weekly Distance Run (Miles)', palette='flare')
+
+def draw_weekly_avg_graph(weekly_avg_df_graph: pd.DataFrame, output_path):
+    """
+
+    :param weekly_avg_df_graph: weekly_avg_df with a reset index
+    :param output_path: file path the graph is saved to
+    """
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+
+    sns.barplot(data=weekly_avg_df_graph, x='Activity Year', y='Weekly Distance Run (Miles)', palette='flare', ax=ax)
     ax.grid(True, alpha=0.4)  # Add gridlines for better readability
     ax.set_axisbelow(True)
-    plt.title('Average Weekly Miles Run')
+    ax.set_title('Average Weekly Miles Run')
 
     x = 0
     for value in weekly_avg_df_graph['Weekly Distance Run (Miles)']:
-        plt.text(x=x, y=value + 0.15, s=f"{round(value, 1)}", ha='center')
+        ax.text(x=x, y=value + 0.15, s=f"{round(value, 1)}", ha='center')
         x = x + 1
-    plt.savefig('output_graphs/averaged_weekly_miles_run.png')
-    plt.show()
 
+    save_and_close(fig, output_path)
 
-def create_weekly_time_spent_running_graph(running_df: pd.DataFrame):
+
+def create_weekly_time_spent_running_df(running_df: pd.DataFrame) -> pd.DataFrame:
     """
 
     :param running_df: data frame containing only the running activities
-    :return: graphs of weekly time spent running per week, split per year
+    :return: data frame with the Week, Year and Weekly Time Spent Running (hours) of every week of every year studied,
+    weeks numbered as calendar_dimension.ACTIVITY_WEEK
     """
     # Define the years you're interested in
-    years = np.arange(running_df['Activity Year'].min(), running_df['Activity Year'].max(), 1)
+    first_year = int(running_df['Activity Year'].min())
+    last_year = int(running_df['Activity Year'].max()) - 1
 
-    # Create a list to store DataFrames for each year
-    yearly_dfs = []
+    # Every week of every year studied, from the calendar, so weeks without runs are kept as 0 hours
+    calendar_df = create_calendar_df(first_year, max(first_year, last_year))
+    all_weeks = calendar_df.loc[calendar_df['Year'] <= last_year, ['Year', ACTIVITY_WEEK]].drop_duplicates().rename(
+        columns={ACTIVITY_WEEK: 'Week'}).astype('int64')
 
-    # Loop through each year and create DataFrames for weekly time spent running
-    for year in years:
-        # Filter data for the current year
-        year_data = running_df[running_df['Activity Year'] == year]
+    # One grouped pass over the runs, by the week numbers computed once at cleaning
+    weekly_time_hours = running_df.groupby(['Activity Year', 'Activity Week'])['Moving Time in Hours'].sum().rename_axis(
+        ['Year', 'Week']).reset_index().astype({'Year': 'int64', 'Week': 'int64'})
 
-        # Group the data by week and sum the 'Moving Time' in seconds
-        weekly_time_seconds = year_data.groupby(year_data['Activity Date'].dt.strftime('%U'))['Moving Time'].sum()
+    merged_df = all_weeks.merge(weekly_time_hours, on=['Year', 'Week'], how='left').fillna(0)
 
-        # Convert the summed time to hours
-        weekly_time_hours = weekly_time_seconds / 3600  # 3600 seconds in an hour
+    return merged_df.rename(columns={'Moving Time in Hours': 'Weekly Time Spent Running (hours)'})[
+        ['Week', 'Year', 'Weekly Time Spent Running (hours)']]
 
-        # Create a DataFrame for the current year
-        yearly_df = pd.DataFrame({
-            'Week': np.arange(1, 53),  # All weeks of the year
-            'Year': year,
-            'Weekly Time Spent Running (hours)': 0  # Initialize all weeks with 0 hours
-        })
 
-        # Update weeks with actual data
-        weekly_time_hours.index = weekly_time_hours.index.astype(int)  # Convert index to int
-        yearly_df['Weekly Time Spent Running (hours)'] = weekly_time_hours.reindex(range(1, 53), fill_value=0).values
+def weekly_time_spent_running_chart_job(running_df: pd.DataFrame, output_dir='output_graphs') -> ChartJob:
+    """
+
+    :param running_df: data frame containing only the running activities
+    :param output_dir: directory the graphs are saved in, output_graphs/ by default
+    :return: chart job drawing weekly time spent running per week, split per year
+    """
+    return ChartJob(draw_weekly_time_spent_running_graph, create_weekly_time_spent_running_df(running_df),
+                    os.path.join(output_dir, 'weekly_hours_run.png'))
+
+
+def create_weekly_time_spent_running_graph(running_df: pd.DataFrame, output_dir='output_graphs'):
+    """
+
+    :param running_df: data frame containing only the running activities
+    :param output_dir: directory the graphs are saved in, output_graphs/ by default
+    :return: graphs of weekly time spent running per week, split per year
+    """
+    return render_charts([weekly_time_spent_running_chart_job(running_df, output_dir)], max_workers=1)[0]
 
-        yearly_dfs.append(yearly_df)
 
-    # Concatenate the DataFrames for all years
-    merged_df = pd.concat(yearly_dfs, ignore_index=True)
+def draw_weekly_time_spent_running_graph(merged_df: pd.DataFrame, output_path):
+    """
+
+    :param merged_df: data frame returned by create_weekly_time_spent_running_df
+    :param output_path: file path the graphs are saved to
+    """
+    import matplotlib.pyplot as plt
+
+    years = merged_df['Year'].unique()
 
     # Create subplots for each year in a nx1 grid
-    fig, axes = plt.subplots(len(years), 1, figsize=(10, 10))  # 4x1 grid
+    fig, axes = plt.subplots(len(years), 1, figsize=(10, 10), squeeze=False)
 
     for i, year in enumerate(years):
-        row = i
+        ax = axes[i, 0]
 
         # Filter data for the current year
         year_data = merged_df[merged_df['Year'] == year]
 
         # Create a line plot for the current year
-        axes[row].plot(year_data['Week'], year_data['Weekly Time Spent Running (hours)'], marker='o', linestyle='-',
-                       label=f'Year {year}')
-        axes[row].set_title(f'Weekly Time Spent Running - {year}')
-        axes[row].set_xlabel('Week')
-        axes[row].set_ylabel('Weekly Hours Run')
-        axes[row].legend()
+        ax.plot(year_data['Week'], year_data['Weekly Time Spent Running (hours)'], marker='o', linestyle='-',
+                label=f'Year {year}')
+        ax.set_title(f'Weekly Time Spent Running - {year}')
+        ax.set_xlabel('Week')
+        ax.set_ylabel('Weekly Hours Run')
+        ax.legend()
 
         # Show x-axis tick labels for every nth week (e.g., every 4th week)
         n = 4
         tick_indices = range(0, len(year_data['Week']), n)
-        axes[row].set_xticks([year_data['Week'].iloc[i] for i in tick_indices])
+        ax.set_xticks([year_data['Week'].iloc[i] for i in tick_indices])
 
-        axes[row].grid(True)
+        ax.grid(True)
 
     # Adjust subplot layout
-    plt.tight_layout()
-
-    plt.savefig('output_graphs/weekly_hours_run.png')
+    fig.tight_layout()
 
-    # Show the plot
-    plt.show()
+    save_and_close(fig, output_path)
@@ -1,51 +1,230 @@
+import os
 import pandas as pd
 import numpy as np
-import inputs
-import seaborn as sns
-import matplotlib.pyplot as plt
+from src import best_efforts
+from utils import instrumentation
+from utils import memoization
+from utils import pace_trend
+from utils.plotting import ChartJob, render_charts, save_and_close
+from utils.polynomial_fitting import fit_polynomials
+from utils.running_utils import index_by_activity_date, select_date_range
+
+
+TREND_METHODS = ('polynomial', 'lowess', 'rolling median')
+
+
+def run(running_df, start_date, end_date, degree, rounded_running_length, output_dir='output_graphs',
+        trend_method='polynomial', route_id=None):
+    return render_charts(build_charts(running_df=running_df, start_date=start_date, end_date=end_date, degree=degree,
+                                      rounded_running_length=rounded_running_length, output_dir=output_dir,
+                                      trend_method=trend_method, route_id=route_id))
+
+
+def build_charts(running_df, start_date, end_date, degree, rounded_running_length, output_dir='output_graphs',
+                 trend_method='polynomial', trend_store_dir=None, route_id=None, cache_dir=None, best_efforts_df=None,
+                 best_effort=None):
+    """
+
+    :param running_df: data frame containing only the running activities, with the unit columns added
+    :param start_date: only runs after this date are used for the pace trend, in format such as 01-01-2019
+    :param end_date: only runs before this date are used for the pace trend, in format such as 05-01-2023
+    :param degree: degree of the polynomial pace trend line
+    :param rounded_running_length: rounded running length, in miles, of the runs in the pace trend. When empty the
+    most common rounded length is used
+    :param output_dir: directory the graphs are saved in, output_graphs/ by default
+    :param trend_method: 'polynomial' to fit a polynomial of the given degree against the run number, 'lowess' to
+    smooth the pace over the run dates with pace_trend.lowess, or 'rolling median' to draw the median and interquartile
+    range of the pace over the last pace_trend.DEFAULT_WINDOW_DAYS days
+    :param trend_store_dir: directory to keep the 'lowess' and 'rolling median' trends in between runs, so the rolling
+    quantiles are only computed for the runs added since. Not kept by default
+    :param route_id: Route ID of the runs in the pace trend, as route_clustering.join_routes adds to running_df. When
+    given, rounded_running_length is not used
+    :param cache_dir: directory to keep the pace trend fit or table in with memoization.run_stage, so it is only
+    computed again when the windowed runs or the parameters change. Not kept by default
+    :param best_efforts_df: data frame returned by best_efforts.run, to draw the records of best_effort from
+    :param best_effort: name of the effort in best_efforts.STANDARD_DISTANCES, such as '5K', whose personal records
+    between the start and end dates are drawn over the pace
+    :return: chart jobs drawing the rounded distance counts per year, number of runs vs. distance and pace over time
+    """
+    if trend_method not in TREND_METHODS:
+        raise ValueError(f"trend_method must be one of {', '.join(TREND_METHODS)}, not {trend_method!r}.")
 
-
-def run(running_df, start_date, end_date, degree, rounded_running_length):
     # Round 'Distance in Miles' to the nearest mile
     running_df['Rounded Distance'] = np.round(running_df['Distance in Miles'])
 
     # Group the data by 'Activity Year' and 'Rounded Distance' and count the occurrences
     distance_counts = running_df.groupby(['Activity Year', 'Rounded Distance']).size().unstack(fill_value=0)
 
+    # Identify top distance run
+    top_distance_run = int(distance_counts.sum().index[distance_counts.sum() == distance_counts.sum().max()].values)
+    print(f"Most of your runs were around {round(top_distance_run,0)} miles long")
+
+    # Pace over time with trend line
+    if route_id is not None:
+        if 'Route ID' not in running_df:
+            raise ValueError("Runs can only be filtered by route once their routes are joined. Use "
+                             "route_clustering.join_routes first.")
+        print(f"Using runs of route {route_id}...")
+        # running_df is sorted and indexed by 'Activity Date', so the filtered runs are already in date order
+        filtered_running_df = running_df[running_df['Route ID'] == int(route_id)]
+        trend_name = f'route{route_id}'
+        title = f"Route {route_id}: Pace Over Time with Trend Line"
+    else:
+        if rounded_running_length=="":
+            rounded_running_length = str(top_distance_run)
+        else:
+            print(f"Using runs of distance {rounded_running_length}...")
+
+        # Filter runs with distances equal to specified number of miles (rounded_running_length). running_df is sorted
+        # and indexed by 'Activity Date', so the filtered runs are already in date order for polynomial fitting
+        filtered_running_df = running_df[running_df['Rounded Distance'] == int(rounded_running_length)]
+        trend_name = f'{rounded_running_length}mi'
+        title = f"{rounded_running_length} Mile Runs: Pace Over Time with Trend Line"
+
+    # Only the runs between the start and end dates are plotted
+    windowed_running_df = select_date_range(filtered_running_df, start_date, end_date)
+
+    if trend_method == 'polynomial':
+        # Fit a linear regression trend line
+        x = np.arange(len(windowed_running_df))
+        y = windowed_running_df['Pace in Mins per Mile']
+        with instrumentation.stage('fit: pace trend', rows=len(x)):
+            pace_fit = memoization.run_stage('fit: pace trend', fit_polynomials, {'x': x, 'y': y, 'degrees': (degree,)},
+                                             cache_dir)[degree]
+        trend_line = np.poly1d(pace_fit['coefficients'][0])(x)
+        trend_band = None
+        trend_label = 'Pace Trend Line'
+        print(f'Degree {degree} R-squared: {pace_fit["r_squared"][0]:.4f}, CV RMSE: {pace_fit["cv_rmse"][0]:.4f}')
+    else:
+        with instrumentation.stage('fit: pace trend', rows=len(windowed_running_df)):
+            if trend_store_dir is None:
+                trend_df = memoization.run_stage('pace trend table', get_pace_trend_df, {
+                    'windowed_running_df': windowed_running_df[['Activity Date', 'Pace in Mins per Mile']],
+                    'trend_name': trend_name, 'start_date': start_date}, cache_dir)
+            else:
+                # The store already only computes the rolling quantiles of the runs added since the last run
+                trend_df = get_pace_trend_df(windowed_running_df, trend_name, start_date, trend_store_dir)
+        if trend_method == 'lowess':
+            trend_line = trend_df['LOWESS'].to_numpy()
+            trend_band = None
+            trend_label = f'LOWESS Trend ({pace_trend.DEFAULT_BANDWIDTH_DAYS} day bandwidth)'
+        else:
+            trend_line = trend_df['P50'].to_numpy()
+            trend_band = (trend_df['P25'].to_numpy(), trend_df['P75'].to_numpy())
+            trend_label = f'Rolling Median ({pace_trend.DEFAULT_WINDOW_DAYS} days)'
+
+    records = None
+    if best_effort:
+        if best_effort not in best_efforts.STANDARD_DISTANCES:
+            raise ValueError(f"best_effort must be one of {', '.join(best_efforts.STANDARD_DISTANCES)}, not "
+                             f"{best_effort!r}.")
+        pr_progression_df = best_efforts.create_pr_progression(best_efforts_df)
+        records = select_date_range(index_by_activity_date(
+            pr_progression_df[pr_progression_df['Effort'] == best_effort]), start_date, end_date)
+
+    pace_trend_data = {
+        'activity_date': windowed_running_df['Activity Date'].to_numpy(),
+        'pace': windowed_running_df['Pace in Mins per Mile'].to_numpy(),
+        'trend_line': trend_line,
+        'trend_label': trend_label,
+        'trend_band': trend_band,
+        'title': title,
+        'records': None if records is None else {
+            'activity_date': records['Activity Date'].to_numpy(),
+            'pace': records['Pace in Mins per Mile'].to_numpy(),
+            'label': f'{best_effort} Record Pace',
+        },
+    }
+
+    print(f'Pace vs Time Maximum Pace: {round(np.nanmax(trend_line), 2)}')
+    print(f'Pace vs Time Minimum Pace: {round(np.nanmin(trend_line), 2)}')
+
+    return [ChartJob(draw_distance_counts_graph, distance_counts,
+                     os.path.join(output_dir, 'rounded_distance_counts_per_year.png')),
+            ChartJob(draw_runs_vs_distance_graph, (distance_counts, top_distance_run),
+                     os.path.join(output_dir, 'numberruns_vs_distancerounded.png')),
+            ChartJob(draw_pace_trend_graph, pace_trend_data, os.path.join(output_dir, 'pace_trend_vs_time.png'))]
+
+
+def get_pace_trend_df(windowed_running_df, trend_name, start_date, trend_store_dir=None):
+    """
+    Computes the rolling quantiles and LOWESS trend of the pace of the windowed runs. With trend_store_dir, the trend
+    of the same runs and start date saved by the last run is extended by the runs added since, and saved again.
+
+    :param windowed_running_df: the runs of one rounded distance or route between the start and end dates, in date
+    order
+    :param trend_name: name of the runs the trend is kept per, such as '5mi' or 'route123'
+    :param start_date: start date of the window, which the saved trend is kept per
+    :param trend_store_dir: directory the trend is kept in, or None to compute it from scratch
+    :return: data frame returned by pace_trend.create_pace_trend_df
+    """
+    dates = windowed_running_df['Activity Date']
+    paces = windowed_running_df['Pace in Mins per Mile']
+
+    if trend_store_dir is None:
+        return pace_trend.create_pace_trend_df(dates, paces)
+
+    store_path = os.path.join(trend_store_dir, f"pace_trend_{trend_name}_"
+                                               f"{pd.Timestamp(start_date).strftime('%Y%m%d')}.parquet")
+    previous_trend_df = pd.read_parquet(store_path) if os.path.exists(store_path) else None
+    trend_df = pace_trend.update_pace_trend_df(previous_trend_df, dates, paces)
+
+    os.makedirs(trend_store_dir, exist_ok=True)
+    trend_df.to_parquet(store_path + '.tmp', index=False)
+    os.replace(store_path + '.tmp', store_path)
+
+    return trend_df
+
+
+def draw_distance_counts_graph(distance_counts, output_path):
+    """
+
+    :param distance_counts: data frame of run counts with one row per Activity Year and one column per Rounded Distance
+    :param output_path: file path the graph is saved to
+    """
+    import matplotlib.pyplot as plt
+
     # Create a colormap with a gradient of colors
     cmap = plt.get_cmap('viridis', len(distance_counts.columns))
 
     # Plot the counts for each Rounded Distance per year with the gradient colormap
-    ax = distance_counts.plot(kind='bar', stacked=True, figsize=(12, 6), colormap=cmap)
-    plt.xlabel('Activity Year')
-    plt.ylabel('Count')
-    plt.title('Rounded Distance Counts per Year')
-    plt.xticks(rotation=0)  # Rotate x-axis labels for better visibility
+    fig, ax = plt.subplots(figsize=(12, 6))
+    distance_counts.plot(kind='bar', stacked=True, colormap=cmap, ax=ax)
+    ax.set_xlabel('Activity Year')
+    ax.set_ylabel('Count')
+    ax.set_title('Rounded Distance Counts per Year')
+    ax.tick_params(axis='x', labelrotation=0)  # Rotate x-axis labels for better visibility
 
     # Customize the legend with a color bar for the gradient
-    legend = plt.legend(title='Rounded Distance', loc='upper right')
+    legend = ax.legend(title='Rounded Distance', loc='upper right')
     legend.set_bbox_to_anchor((1.25, 1))  # Adjust the legend position
 
     # Add color patches to the legend for each Rounded Distance
     for i, distance in enumerate(distance_counts.columns):
         legend.get_patches()[i].set_facecolor(cmap(i))
 
-    plt.tight_layout()
-    plt.show()
-    plt.savefig('output_graphs/rounded_distance_counts_per_year.png')
+    fig.tight_layout()
+    save_and_close(fig, output_path)
+
+
+def draw_runs_vs_distance_graph(runs_vs_distance_data, output_path):
+    """
+
+    :param runs_vs_distance_data: tuple of the distance counts data frame and the most common rounded distance
+    :param output_path: file path the graph is saved to
+    """
+    import matplotlib.pyplot as plt
+
+    distance_counts, top_distance_run = runs_vs_distance_data
 
     # Plotting the counts of mileage run each year, emphasizing most consistent mile run length.
     # Create subplots for each year
     fig, axes = plt.subplots(len(distance_counts.index), 1, figsize=(4, 1.3 * len(distance_counts.index)), sharex=True,
-                             sharey=True)
-
-    # Identify top distance run
-    top_distance_run = int(distance_counts.sum().index[distance_counts.sum() == distance_counts.sum().max()].values)
-    print(f"Most of your runs were around {round(top_distance_run,0)} miles long")
+                             sharey=True, squeeze=False)
 
     # Iterate through the years and plot the counts for each Rounded Distance
     for i, year in enumerate(distance_counts.index):
-        ax = axes[i]
+        ax = axes[i, 0]
         counts = distance_counts.loc[year]
         # Highlight top distance run with orange:
         color = ['orange' if index == top_distance_run else 'skyblue' for index in counts.index]
@@ -60,43 +239,36 @@ def run(running_df, start_date, end_date, degree, rounded_running_length):
     # Adjust spacing and layout
     fig.tight_layout()
 
-    fig.savefig('output_graphs/numberruns_vs_distancerounded.png')
+    save_and_close(fig, output_path)
 
-    # Show the plot
-    fig.show()
-
-    # Pace over time with trend line
-    if rounded_running_length=="":
-        rounded_running_length = str(top_distance_run)
-    else:
-        print(f"Using runs of distance {rounded_running_length}...")
 
-    # Filter runs with distances equal to specified number of miles (rounded_running_length)
-    filtered_running_df = running_df[running_df['Rounded Distance'] == int(rounded_running_length)].copy()
+def draw_pace_trend_graph(pace_trend_data, output_path):
+    """
 
-    # Sort the dataframe by 'Miles Run Last Month' for polynomial fitting
-    filtered_running_df.sort_values(by='Activity Date', ascending=True, inplace=True)
+    :param pace_trend_data: dictionary of plot data built by build_charts
+    :param output_path: file path the graph is saved to
+    """
+    import matplotlib.pyplot as plt
 
     # Create the first plot with the left y-axis
     fig2, ax1 = plt.subplots(figsize=(12, 6))
 
     # Create a line plot to visualize pace over time
-    ax1.plot(filtered_running_df.loc[(filtered_running_df['Activity Date'] > start_date) & (
-            filtered_running_df['Activity Date'] < end_date), 'Activity Date'], filtered_running_df.loc[
-                 (filtered_running_df['Activity Date'] > start_date) & (
-                         filtered_running_df['Activity Date'] < end_date), 'Pace in Mins per Mile'], marker='o',
-             linestyle='-', color='b', label='Pace')
-
-    # Fit a linear regression trend line
-    x = np.arange(len(filtered_running_df[(filtered_running_df['Activity Date'] > start_date) & (filtered_running_df['Activity Date'] < end_date)]))
-    y = filtered_running_df.loc[(filtered_running_df['Activity Date'] > start_date) & (
-            filtered_running_df['Activity Date'] < end_date), 'Pace in Mins per Mile']
-    coefficients = np.polyfit(x, y, degree)
-    trend_line = np.poly1d(coefficients)
-
-    ax1.plot(filtered_running_df.loc[(filtered_running_df['Activity Date'] > start_date) & (
-            filtered_running_df['Activity Date'] < end_date), 'Activity Date'], trend_line(x), linestyle='--', color='r',
-             label='Pace Trend Line')
+    ax1.plot(pace_trend_data['activity_date'], pace_trend_data['pace'], marker='o', linestyle='-', color='b',
+             label='Pace')
+
+    ax1.plot(pace_trend_data['activity_date'], pace_trend_data['trend_line'], linestyle='--', color='r',
+             label=pace_trend_data['trend_label'])
+
+    if pace_trend_data['trend_band'] is not None:
+        ax1.fill_between(pace_trend_data['activity_date'], *pace_trend_data['trend_band'], color='r', alpha=0.15,
+                         label='Interquartile Range')
+
+    # Each record holds until the next one is set
+    if pace_trend_data.get('records') is not None:
+        records = pace_trend_data['records']
+        ax1.step(records['activity_date'], records['pace'], where='post', marker='*', markersize=10, color='g',
+                 label=records['label'])
 
     # Set axis labels and a title
     ax1.set_xlabel('Activity Date')
@@ -105,33 +277,11 @@ def run(running_df, start_date, end_date, degree, rounded_running_length):
     # Combine the legends from both axes
     lines, labels = ax1.get_legend_handles_labels()
 
-    if len(rounded_running_length) == 0:
-        plt.title('Pace Over Time with Trend Line')
-    else:
-        plt.title(f"{rounded_running_length} Mile Runs: Pace Over Time with Trend Line")
-
-    # Show the plot
-    plt.grid(True)
-    plt.xticks(rotation=45)  # This sets the x-tick labels with the desired rotation
-    plt.legend(lines, labels)
-    plt.tight_layout()
-    plt.savefig('output_graphs/pace_trend_vs_time.png')
-    plt.show()
-
-    # Calculate the mean of the actual values
-    mean_actual = np.mean(y)
-
-    # Calculate the sum of squared residuals (SSR)
-    ssr = np.sum((y - trend_line(x)) ** 2)
-
-    # Calculate the total sum of squares (SST)
-    sst = np.sum((y - mean_actual) ** 2)
-
-    # Calculate R-squared
-    r2 = 1 - (ssr / sst)
-
-    print(f'Degree {degree} R-squared: {r2:.4f}')
-    print(f'Pace vs Time Maximum Pace: {round(trend_line(x).max(), 2)}')
-    print(f'Pace vs Time Minimum Pace: {round(trend_line(x).min(), 2)}')
+    ax1.set_title(pace_trend_data['title'])
 
+    ax1.grid(True)
+    ax1.tick_params(axis='x', labelrotation=45)  # This sets the x-tick labels with the desired rotation
+    ax1.legend(lines, labels)
+    fig2.tight_layout()
 
+    save_and_close(fig2, output_path)
@@ -0,0 +1,221 @@
+import os
+import pandas as pd
+import numpy as np
+from src import activity_streams
+from utils import instrumentation
+
+# Each track is reduced to TRACK_POINTS positions spaced evenly by distance along it, so tracks of any length and
+# sampling rate compare point by point
+TRACK_POINTS = 32
+# Two runs follow the same route when their tracks' corresponding points are on average within TRACK_TOLERANCE meters
+# of each other, and their lengths are within LENGTH_TOLERANCE of each other
+TRACK_TOLERANCE = 100.0
+LENGTH_TOLERANCE = 0.1
+# Only runs whose start, middle and end points are each within ENDPOINT_TOLERANCE meters of each other are compared,
+# and of those only each run's NEIGHBOURS nearest
+ENDPOINT_TOLERANCE = 250.0
+NEIGHBOURS = 16
+
+# Signatures are kept in the stream store, so each activity's streams are only read once
+SIGNATURES_FILE = 'route_signatures.npz'
+ROUTES_FILE = 'routes.parquet'
+
+
+def run(running_df: pd.DataFrame, store_dir):
+    """
+    Groups the stored runs with a GPS track into routes, and saves the Route ID of each one in the stream store.
+
+    :param running_df: data frame containing the running activities, with an 'Activity ID' column
+    :param store_dir: directory of the stream store written by activity_streams.run
+    :return: data frame returned by find_routes
+    """
+    index_df = activity_streams.load_index(store_dir)
+    if 'Has GPS Stream' in index_df:
+        index_df = index_df[index_df['Has GPS Stream']]
+    activity_ids = running_df.loc[running_df['Activity ID'].isin(index_df['Activity ID']), 'Activity ID'].to_numpy()
+
+    activity_ids, lengths, tracks = get_signatures(store_dir, activity_ids)
+    print(f"Grouping {len(activity_ids)} GPS tracks into routes")
+
+    routes_df = find_routes(activity_ids, lengths, tracks)
+
+    top_routes = routes_df.drop_duplicates('Route ID').nlargest(5, 'Route Runs')
+    if not top_routes.empty:
+        print("Most run routes: " + ', '.join(f"{route_id} ({route_runs} runs)" for route_id, route_runs in
+                                              top_routes[['Route ID', 'Route Runs']].itertuples(index=False)))
+
+    routes_path = os.path.join(store_dir, ROUTES_FILE)
+    routes_df.to_parquet(routes_path + '.tmp', index=False)
+    os.replace(routes_path + '.tmp', routes_path)
+
+    return routes_df
+
+
+def get_signatures(store_dir, activity_ids):
+    """
+    Loads the saved signatures of the activities, and computes and saves those of the activities stored since.
+
+    :param store_dir: directory of the stream store
+    :param activity_ids: array of the Activity IDs with a GPS stream
+    :return: tuple of arrays (Activity IDs, track length in meters, resampled tracks), as create_signature returns,
+    of the activities whose track has at least two positions, in Activity ID order
+    """
+    signatures_path = os.path.join(store_dir, SIGNATURES_FILE)
+    if os.path.exists(signatures_path):
+        with np.load(signatures_path) as signatures:
+            saved_ids, saved_lengths, saved_tracks = signatures['activity_id'], signatures['length'], \
+                signatures['track']
+    else:
+        saved_ids, saved_lengths, saved_tracks = np.array([], dtype=np.int64), np.array([]), \
+            np.empty((0, TRACK_POINTS, 3))
+
+    new_ids = np.setdiff1d(activity_ids, saved_ids)
+    with instrumentation.stage('route signatures', rows=len(new_ids)):
+        new_signatures = {}
+        for activity_id in new_ids:
+            streams = activity_streams.load_streams(store_dir, activity_id)
+            signature = create_signature(streams['latitude'], streams['longitude'])
+            if signature is not None:
+                new_signatures[activity_id] = signature
+
+    if new_signatures:
+        saved_ids = np.concatenate([saved_ids, np.fromiter(new_signatures, dtype=np.int64)])
+        saved_lengths = np.concatenate([saved_lengths, [length for length, _ in new_signatures.values()]])
+        saved_tracks = np.concatenate([saved_tracks, np.stack([track for _, track in new_signatures.values()])])
+
+        order = np.argsort(saved_ids)
+        saved_ids, saved_lengths, saved_tracks = saved_ids[order], saved_lengths[order], saved_tracks[order]
+        # np.savez adds .npz to names without it, so the temporary file keeps the extension
+        np.savez(signatures_path + '.tmp.npz', activity_id=saved_ids, length=saved_lengths, track=saved_tracks)
+        os.replace(signatures_path + '.tmp.npz', signatures_path)
+
+    requested = np.isin(saved_ids, activity_ids)
+
+    return saved_ids[requested], saved_lengths[requested], saved_tracks[requested]
+
+
+def create_signature(latitude, longitude):
+    """
+
+    :param latitude: array of latitudes in degrees
+    :param longitude: array of longitudes in degrees
+    :return: tuple of the track's length in meters and an array of shape (TRACK_POINTS, 3) of the positions spaced
+    evenly by distance along it, as to_cartesian returns, or None for tracks with fewer than two positions
+    """
+    has_fix = np.isfinite(latitude) & np.isfinite(longitude)
+    latitude = np.asarray(latitude, dtype=np.float64)[has_fix]
+    longitude = np.asarray(longitude, dtype=np.float64)[has_fix]
+    if len(latitude) < 2:
+        return None
+
+    distance = activity_streams.cumulative_distance(latitude, longitude)
+    targets = np.linspace(0, distance[-1], TRACK_POINTS)
+    positions = to_cartesian(latitude, longitude)
+
+    track = np.stack([np.interp(targets, distance, positions[:, axis]) for axis in range(3)], axis=1)
+
+    return distance[-1], track
+
+
+def to_cartesian(latitude, longitude):
+    """
+    Places positions on a sphere the size of the Earth, in meters from its center. Straight-line distances between
+    points there are within a millimetre of distances along the ground at the scale of a run, wherever in the world it
+    is, so tracks can be indexed and compared with plain Euclidean distances.
+
+    :param latitude: array of latitudes in degrees
+    :param longitude: array of longitudes in degrees
+    :return: array of shape (positions, 3)
+    """
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+
+    return activity_streams.EARTH_RADIUS_M * np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                                                       np.sin(lat)], axis=1)
+
+
+def find_routes(activity_ids, lengths, tracks) -> pd.DataFrame:
+    """
+    Groups the tracks into routes. Every track is keyed by its start, middle and end points, and a KD-tree of the keys
+    finds each track's nearest neighbours with all three points within ENDPOINT_TOLERANCE. Only those candidates are
+    compared on their whole resampled tracks, so the cost grows with the number of tracks times NEIGHBOURS rather than
+    with the number of pairs of tracks. Loops run from home share their start and end, but not their middle.
+
+    Tracks of the same route are grouped even when only linked through others, and the route is named after its
+    lowest Activity ID. Route IDs therefore stay the same as runs are added, unless a new run links two routes, which
+    then both take the lower ID.
+
+    :param activity_ids: array of Activity IDs
+    :param lengths: array of track lengths in meters
+    :param tracks: array of shape (activities, TRACK_POINTS, 3) of resampled tracks
+    :return: data frame with the Activity ID, the Route ID and the number of runs of the route, as 'Route Runs'
+    """
+    num_tracks = len(activity_ids)
+    if not num_tracks:
+        return pd.DataFrame({'Activity ID': pd.Series(dtype='int64'), 'Route ID': pd.Series(dtype='int64'),
+                             'Route Runs': pd.Series(dtype='int64')})
+
+    with instrumentation.stage('route clustering', rows=num_tracks):
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        from scipy.spatial import cKDTree
+
+        keys = tracks[:, [0, TRACK_POINTS // 2, TRACK_POINTS - 1], :].reshape(num_tracks, 9)
+        # Three points each within ENDPOINT_TOLERANCE are within this of each other as one nine dimensional key
+        _, neighbours = cKDTree(keys).query(keys, k=min(NEIGHBOURS + 1, num_tracks),
+                                            distance_upper_bound=ENDPOINT_TOLERANCE * np.sqrt(3))
+        neighbours = neighbours.reshape(num_tracks, -1)
+
+        # Missing neighbours are numbered num_tracks
+        first = np.repeat(np.arange(num_tracks), neighbours.shape[1])
+        second = neighbours.ravel()
+        candidate = (second < num_tracks) & (first != second)
+        first, second = first[candidate], second[candidate]
+
+        point_distances = np.linalg.norm(keys[first].reshape(-1, 3, 3) - keys[second].reshape(-1, 3, 3), axis=2)
+        mean_distance = np.linalg.norm(tracks[first] - tracks[second], axis=2).mean(axis=1)
+        same_route = (point_distances.max(axis=1) <= ENDPOINT_TOLERANCE) & (mean_distance <= TRACK_TOLERANCE) & (
+            np.abs(lengths[first] - lengths[second]) <= LENGTH_TOLERANCE * np.maximum(lengths[first], lengths[second]))
+
+        graph = coo_matrix((np.ones(same_route.sum()), (first[same_route], second[same_route])),
+                           shape=(num_tracks, num_tracks))
+        _, groups = connected_components(graph, directed=False)
+
+        routes_df = pd.DataFrame({'Activity ID': activity_ids.astype(np.int64), 'Route': groups})
+        routes_df['Route ID'] = routes_df.groupby('Route')['Activity ID'].transform('min')
+        routes_df['Route Runs'] = routes_df.groupby('Route')['Activity ID'].transform('size').astype(np.int64)
+
+    return routes_df[['Activity ID', 'Route ID', 'Route Runs']]
+
+
+def load_routes(store_dir):
+    """
+
+    :param store_dir: directory of the stream store
+    :return: data frame saved by run, or None if the routes haven't been found yet
+    """
+    routes_path = os.path.join(store_dir, ROUTES_FILE)
+    if not os.path.exists(routes_path):
+        return None
+
+    return pd.read_parquet(routes_path)
+
+
+def join_routes(running_df: pd.DataFrame, store_dir) -> pd.DataFrame:
+    """
+
+    :param running_df: data frame containing the running activities
+    :param store_dir: directory of the stream store
+    :return: running_df with the 'Route ID' and 'Route Runs' columns looked up by Activity ID, NaN for runs without a
+    GPS track, keeping running_df's index
+    """
+    routes_df = load_routes(store_dir)
+    if routes_df is None:
+        raise ValueError(f"No routes found in {store_dir} yet. Run route_clustering.run first.")
+
+    routes_df = routes_df.set_index('Activity ID')
+
+    activity_ids = running_df['Activity ID']
+
+    return running_df.assign(**{'Route ID': activity_ids.map(routes_df['Route ID']),
+                                'Route Runs': activity_ids.map(routes_df['Route Runs'])})
@@ -0,0 +1,286 @@
+import json
+import os
+import pandas as pd
+import numpy as np
+from utils import instrumentation
+
+# Time constants, in days, of the acute (fatigue) and chronic (fitness) training loads
+ATL_DAYS = 7
+CTL_DAYS = 42
+DEFAULT_RESTING_HR = 60
+
+# Banister's TRIMP weighting, 0.64 * e^(1.92 * heart rate reserve) for men and 0.86 * e^(1.67 * ...) for women
+TRIMP_WEIGHTING = {'male': (0.64, 1.92), 'female': (0.86, 1.67)}
+
+# Days of daily TRIMP kept in the state, so runs uploaded up to this late recompute the days they change exactly
+RECENT_DAYS = 90
+
+STATE_VERSION = 2
+
+
+def run(running_df: pd.DataFrame, state_path, max_hr=None, resting_hr=DEFAULT_RESTING_HR, sex='male'):
+    """
+    Brings an athlete's training load up to date. The first run computes it from the whole history and saves the
+    state at state_path. After that only the activities uploaded since, and the days since, are processed.
+
+    :param running_df: data frame containing the running activities, with the unit columns added
+    :param state_path: JSON file the training load state is kept in
+    :param max_hr: the athlete's maximum heart rate, only used on the first run. The highest Max Heart Rate recorded
+    by default
+    :param resting_hr: the athlete's resting heart rate, only used on the first run
+    :param sex: 'male' or 'female', which TRIMP weighting to use, only used on the first run
+    :return: data frame of the daily TRIMP, ATL, CTL and TSB of every day that was added or changed, from the first
+    one on, as save_training_load writes
+    """
+    state = load_state(state_path)
+
+    if state is None:
+        daily_load_df, state = compute_training_load(running_df, max_hr=max_hr, resting_hr=resting_hr, sex=sex)
+    else:
+        daily_load_df, state = update_training_load(state, running_df)
+
+    save_state(state, state_path)
+
+    return daily_load_df
+
+
+def add_trimp_column(running_df: pd.DataFrame, max_hr, resting_hr=DEFAULT_RESTING_HR, sex='male'):
+    """
+    Adds Banister's training impulse, the moving time weighted by how hard the heart worked, to running_df in place.
+    Activities without an Average Heart Rate get a NaN TRIMP.
+
+    :param running_df: data frame containing 'Moving Time in Minutes' and 'Average Heart Rate'
+    :param max_hr: the athlete's maximum heart rate
+    :param resting_hr: the athlete's resting heart rate
+    :param sex: 'male' or 'female', which TRIMP weighting to use
+    :return: running_df with a new 'TRIMP' column
+    """
+    if max_hr <= resting_hr:
+        raise ValueError(f"The maximum heart rate ({max_hr}) must be above the resting heart rate ({resting_hr}).")
+
+    factor, exponent = TRIMP_WEIGHTING[sex]
+    heart_rate_reserve = ((running_df['Average Heart Rate'] - resting_hr) / (max_hr - resting_hr)).clip(0, 1)
+    running_df['TRIMP'] = running_df['Moving Time in Minutes'] * heart_rate_reserve * factor * np.exp(
+        exponent * heart_rate_reserve)
+
+    return running_df
+
+
+def create_daily_trimp(running_df: pd.DataFrame, start_date, end_date) -> pd.Series:
+    """
+
+    :param running_df: data frame with 'Activity Date' and 'TRIMP' columns
+    :param start_date: first day of the series
+    :param end_date: last day of the series
+    :return: series of the summed TRIMP per day, indexed by every day from start_date to end_date, 0 on rest days
+    """
+    days = pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize(), freq='D')
+
+    return running_df.groupby(running_df['Activity Date'].dt.normalize())['TRIMP'].sum().reindex(
+        days, fill_value=0.0).rename_axis('Date')
+
+
+def exponentially_weighted_load(daily_trimp, time_constant, initial_load=0.0):
+    """
+    Runs the training load recursion load[t] = load[t - 1] + (trimp[t] - load[t - 1]) * (1 - e^(-1 / time_constant))
+    over every day at once, as a first-order IIR filter seeded with the load of the day before.
+
+    :param daily_trimp: array of the TRIMP of consecutive days
+    :param time_constant: time constant of the load in days
+    :param initial_load: load at the end of the day before the first day
+    :return: array of the load at the end of each day
+    """
+    from scipy.signal import lfilter
+
+    decay = np.exp(-1 / time_constant)
+    load, _ = lfilter([1 - decay], [1, -decay], np.asarray(daily_trimp, dtype=np.float64),
+                      zi=[decay * initial_load])
+
+    return load
+
+
+def create_training_load_df(daily_trimp: pd.Series, initial_atl=0.0, initial_ctl=0.0,
+                            atl_days=ATL_DAYS, ctl_days=CTL_DAYS) -> pd.DataFrame:
+    """
+
+    :param daily_trimp: series returned by create_daily_trimp
+    :param initial_atl: ATL at the end of the day before the series starts
+    :param initial_ctl: CTL at the end of the day before the series starts
+    :param atl_days: time constant of the acute training load
+    :param ctl_days: time constant of the chronic training load
+    :return: data frame indexed by day with TRIMP, ATL and CTL at the end of the day, and TSB, the form going into the
+    day: the CTL minus the ATL of the day before
+    """
+    atl = exponentially_weighted_load(daily_trimp, atl_days, initial_atl)
+    ctl = exponentially_weighted_load(daily_trimp, ctl_days, initial_ctl)
+
+    return pd.DataFrame({
+        'TRIMP': daily_trimp.to_numpy(),
+        'ATL': atl,
+        'CTL': ctl,
+        'TSB': np.concatenate([[initial_ctl - initial_atl], (ctl - atl)[:-1]]),
+    }, index=daily_trimp.index)
+
+
+def compute_training_load(running_df: pd.DataFrame, max_hr=None, resting_hr=DEFAULT_RESTING_HR, sex='male'):
+    """
+
+    :param running_df: data frame containing the running activities, with the unit columns added
+    :param max_hr: the athlete's maximum heart rate, the highest Max Heart Rate recorded by default
+    :param resting_hr: the athlete's resting heart rate
+    :param sex: 'male' or 'female', which TRIMP weighting to use
+    :return: tuple of the data frame returned by create_training_load_df for every day from the first run to the last,
+    and the state to continue from with update_training_load
+    """
+    if running_df.empty:
+        raise ValueError("No runs to compute the training load of.")
+
+    max_hr = float(max_hr or running_df['Max Heart Rate'].max())
+    if not np.isfinite(max_hr):
+        raise ValueError("No Max Heart Rate recorded to compute the training load from. Pass max_hr instead.")
+
+    with instrumentation.stage('training load', rows=len(running_df)):
+        running_df = add_trimp_column(running_df[['Activity ID', 'Activity Date', 'Moving Time in Minutes',
+                                                  'Average Heart Rate']].copy(), max_hr, resting_hr, sex)
+        daily_trimp = create_daily_trimp(running_df, running_df['Activity Date'].min(),
+                                         running_df['Activity Date'].max())
+        training_load_df = create_training_load_df(daily_trimp)
+
+    state = {
+        'version': STATE_VERSION,
+        'max_activity_id': int(running_df['Activity ID'].max()),
+        'max_hr': max_hr,
+        'resting_hr': resting_hr,
+        'sex': sex,
+        'atl_days': ATL_DAYS,
+        'ctl_days': CTL_DAYS,
+        **get_recent_state(training_load_df, 0.0, 0.0),
+    }
+
+    return training_load_df, state
+
+
+def get_recent_state(training_load_df: pd.DataFrame, initial_atl, initial_ctl):
+    """
+
+    :param training_load_df: data frame returned by create_training_load_df
+    :param initial_atl: ATL at the end of the day before training_load_df starts
+    :param initial_ctl: CTL at the end of the day before training_load_df starts
+    :return: dictionary of the state's 'through_date', 'atl' and 'ctl', the last day and its loads, 'recent_trimp',
+    the daily TRIMP of up to the last RECENT_DAYS days, and 'recent_atl' and 'recent_ctl', the loads the day before them
+    """
+    num_before = max(len(training_load_df) - RECENT_DAYS, 0)
+    if num_before:
+        initial_atl = training_load_df['ATL'].iloc[num_before - 1]
+        initial_ctl = training_load_df['CTL'].iloc[num_before - 1]
+
+    return {
+        'through_date': training_load_df.index[-1].strftime('%Y-%m-%d'),
+        'atl': float(training_load_df['ATL'].iloc[-1]),
+        'ctl': float(training_load_df['CTL'].iloc[-1]),
+        'recent_trimp': training_load_df['TRIMP'].iloc[num_before:].astype(float).tolist(),
+        'recent_atl': float(initial_atl),
+        'recent_ctl': float(initial_ctl),
+    }
+
+
+def update_training_load(state, running_df: pd.DataFrame):
+    """
+    Adds the activities uploaded since the state was saved, recognised by their higher Activity IDs, since Strava hands
+    out IDs in upload order. The state keeps the daily TRIMP of its last RECENT_DAYS days, so those days and the days
+    after them are run through the recursion again from the loads before them, with the new activities added in. The
+    cost follows RECENT_DAYS and the new days only.
+
+    The loads are linear in the daily TRIMP, so an activity uploaded even later is added straight onto the loads before
+    the recent days, decayed by the days since. The days between it and the recent days are not recomputed, and keep
+    the loads they were first given.
+
+    :param state: state returned by compute_training_load or an earlier update_training_load
+    :param running_df: data frame containing the running activities, with the unit columns added. Only the activities
+    newer than the state are used, so this can be the whole history or only the new runs
+    :return: tuple of the data frame returned by create_training_load_df for the days from the first one that changed,
+    or the first recent day if an activity before them was added, up to the last new run, and the updated state
+    """
+    new_runs = running_df[running_df['Activity ID'] > state['max_activity_id']]
+
+    if new_runs.empty:
+        return create_training_load_df(pd.Series(dtype='float64', index=pd.DatetimeIndex([], name='Date'))), state
+
+    with instrumentation.stage('training load update', rows=len(new_runs)):
+        new_runs = add_trimp_column(new_runs[['Activity ID', 'Activity Date', 'Moving Time in Minutes',
+                                              'Average Heart Rate']].copy(), state['max_hr'], state['resting_hr'],
+                                    state['sex'])
+        new_days = new_runs['Activity Date'].dt.normalize()
+
+        recent_trimp = pd.Series(state['recent_trimp'], dtype='float64', index=pd.date_range(
+            end=pd.Timestamp(state['through_date']), periods=len(state['recent_trimp']), freq='D', name='Date'))
+        recent_start = recent_trimp.index[0]
+        atl = state['recent_atl']
+        ctl = state['recent_ctl']
+
+        # Late uploads of days before the recent ones
+        backfilled = new_runs[new_days < recent_start]
+        if not backfilled.empty:
+            days_since = (recent_start - pd.Timedelta(days=1) - backfilled['Activity Date'].dt.normalize()).dt.days
+            days_since = days_since.to_numpy()
+            trimp = backfilled['TRIMP'].fillna(0).to_numpy()
+            atl += (trimp * (1 - np.exp(-1 / state['atl_days'])) * np.exp(-days_since / state['atl_days'])).sum()
+            ctl += (trimp * (1 - np.exp(-1 / state['ctl_days'])) * np.exp(-days_since / state['ctl_days'])).sum()
+
+        recent = new_runs[new_days >= recent_start]
+        end_date = recent_trimp.index[-1]
+        if not recent.empty:
+            end_date = max(end_date, recent['Activity Date'].max().normalize())
+        daily_trimp = recent_trimp.reindex(pd.date_range(recent_start, end_date, freq='D', name='Date'),
+                                           fill_value=0.0) + create_daily_trimp(recent, recent_start, end_date)
+        recent_load_df = create_training_load_df(daily_trimp, initial_atl=atl, initial_ctl=ctl,
+                                                 atl_days=state['atl_days'], ctl_days=state['ctl_days'])
+
+        first_changed = recent_start if not backfilled.empty else new_days[new_days >= recent_start].min()
+        training_load_df = recent_load_df[recent_load_df.index >= first_changed]
+
+    state = dict(state, **get_recent_state(recent_load_df, atl, ctl),
+                 max_activity_id=int(max(state['max_activity_id'], new_runs['Activity ID'].max())))
+
+    return training_load_df, state
+
+
+def load_state(state_path):
+    """
+
+    :param state_path: JSON file the training load state is kept in
+    :return: the saved state, or None if there is none or it was saved by an incompatible version
+    """
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path) as f:
+        state = json.load(f)
+
+    return state if state.get('version') == STATE_VERSION else None
+
+
+def save_state(state, state_path):
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def save_training_load(training_load_df: pd.DataFrame, csv_path):
+    """
+    Writes the days returned by run over the same days of the CSV file, keeping the days before them.
+
+    :param training_load_df: data frame returned by run
+    :param csv_path: training load CSV file, written by this or by saving compute_training_load's data frame
+    """
+    if training_load_df.empty:
+        return
+
+    if os.path.exists(csv_path):
+        saved_df = pd.read_csv(csv_path, index_col='Date', parse_dates=['Date'])
+        training_load_df = pd.concat([saved_df[saved_df.index < training_load_df.index[0]], training_load_df])
+
+    training_load_df.to_csv(csv_path + '.tmp')
+    os.replace(csv_path + '.tmp', csv_path)
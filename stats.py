@@ -0,0 +1,48 @@
+###
+# Stats-only counterpart to batch.py: prints the weekly averages and the fit numbers of one export without rendering
+# any graphs, so matplotlib and seaborn are never imported. Meant for short-lived per-athlete jobs where start-up time
+# matters.
+#
+#   python stats.py exports/strava_export_36240949/activities.csv
+#   python stats.py exports/strava_export_36240949/activities.csv --output-dir stats --degree 2
+#
+# Takes the same optional inputs as batch.py. With --output-dir the weekly averages are also saved there as CSV.
+###
+
+import argparse
+import os
+import sys
+
+import batch
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Print the weekly averages and fits of a Strava export, without graphs.")
+    parser.add_argument('export', help="path of an 'activities.csv' file")
+    parser.add_argument('--output-dir', dest='output_dir', help="directory to save weekly_averages.csv in")
+    for option_name in batch.OPTION_NAMES:
+        parser.add_argument(f"--{option_name.replace('_', '-')}", dest=option_name)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {option_name: getattr(args, option_name) for option_name in batch.OPTION_NAMES}
+
+    # The chart jobs only hold the data to draw; nothing is drawn unless they are rendered
+    _, weekly_avg_df, _ = batch.compute_export(args.export, args.output_dir or '.', options,
+                                               use_cache=bool(args.output_dir))
+
+    print("\n Your weekly averages are...\n")
+    print(weekly_avg_df)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        weekly_avg_df.to_csv(os.path.join(args.output_dir, 'weekly_averages.csv'), index=False)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
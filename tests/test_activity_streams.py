@@ -0,0 +1,34 @@
+import numpy as np
+from src import activity_streams
+
+GPX = b"""
+<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>
+<trkpt lat="51.5000" lon="-0.1000"><ele>10</ele><time>2024-03-01T07:00:00Z</time></trkpt>
+<trkpt><time>2024-03-01T07:00:05Z</time></trkpt>
+<trkpt lat="51.5010" lon="-0.1000"><ele>11</ele><time>2024-03-01T07:00:10Z</time></trkpt>
+<trkpt lat="51.5020" lon="-0.1000"><ele>12</ele><time>2024-03-01T07:00:15Z</time></trkpt>
+<trkpt lat="51.5030" lon="-0.1000"><ele>13</ele><time>2024-03-01T07:00:20Z</time></trkpt>
+</trkseg></trk></gpx>
+"""
+
+
+def test_gpx_distance_steps_over_missing_fix(tmp_path, monkeypatch):
+    # Blocks smaller than the track, so the samples are packed across several of them
+    monkeypatch.setattr(activity_streams, 'SAMPLE_BLOCK_SIZE', 2)
+    file_path = tmp_path / '1.gpx'
+    file_path.write_bytes(GPX)
+
+    streams = activity_streams.parse_activity_file(str(file_path))
+
+    np.testing.assert_array_equal(streams['elapsed_time'], [0, 5, 10, 15, 20])
+    assert streams['start_time'][0] == np.datetime64('2024-03-01T07:00:00')
+    # 0.001 degrees of latitude is about 111.2 meters, and the fix missing after the start mustn't lose the first one
+    np.testing.assert_allclose(streams['distance'], [0, 0, 111.2, 222.4, 333.6], atol=0.1)
+
+
+def test_cumulative_distance_before_first_fix():
+    distance = activity_streams.cumulative_distance(np.array([np.nan, 0, np.nan, 0.001]),
+                                                    np.array([np.nan, 0, np.nan, 0]))
+
+    np.testing.assert_allclose(distance, [0, 0, 0, 111.2], atol=0.1)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import batch
+from src import best_efforts
+from test_route_option import HEADER, write_gpx
+
+DISTANCES = {'400m': 400.0, 'Mile': 1609.344, '2K': 2000.0}
+
+
+def brute_force_best_efforts(streams, distances):
+    """
+    Tries every start sample of every activity and scans forward to the first sample reaching the target.
+    """
+    best = {}
+    for activity_id, (distance, elapsed_time) in streams.items():
+        has_time = np.isfinite(elapsed_time)
+        distance, elapsed_time = distance[has_time], elapsed_time[has_time]
+
+        # Carry the furthest distance reached over GPS dropouts
+        furthest = 0.0
+        carried = []
+        for value in distance:
+            if np.isfinite(value):
+                furthest = max(furthest, value)
+            carried.append(furthest)
+
+        for effort, effort_distance in distances.items():
+            for start in range(len(carried)):
+                for end in range(start + 1, len(carried)):
+                    if carried[end] - carried[start] < effort_distance:
+                        continue
+                    step = carried[end] - carried[end - 1]
+                    fraction = (carried[start] + effort_distance - carried[end - 1]) / step if step > 0 else 1.0
+                    effort_time = (elapsed_time[end - 1] + fraction * (elapsed_time[end] - elapsed_time[end - 1])
+                                   - elapsed_time[start])
+                    best[activity_id, effort] = min(best.get((activity_id, effort), np.inf), effort_time)
+                    break
+
+    return best
+
+
+def make_streams(seed=0):
+    rng = np.random.default_rng(seed)
+    streams = {}
+
+    for activity_id, num_samples in [(1, 400), (2, 250), (3, 120)]:
+        elapsed_time = np.arange(num_samples, dtype=np.float64)
+        distance = np.cumsum(rng.uniform(0, 8, num_samples))
+        streams[activity_id] = (distance, elapsed_time)
+
+    # A GPS gap: no fixes for 20 samples, then the distance jumps by what was run meanwhile
+    distance, elapsed_time = streams[1]
+    distance[100:120] = np.nan
+    distance[120:] += 300
+    # A fix slightly behind the one before it
+    distance[200] = distance[199] - 5
+    # Samples with no time
+    streams[2][1][[10, 11, 50]] = np.nan
+
+    return streams
+
+
+def test_sweep_matches_brute_force():
+    streams = make_streams()
+
+    best_efforts_df = best_efforts.find_best_efforts(streams, distances=DISTANCES)
+    expected = brute_force_best_efforts(streams, DISTANCES)
+
+    found = best_efforts_df.set_index(['Activity ID', 'Effort'])['Elapsed Time (s)'].to_dict()
+    # Activity 3 is under 1 km, so only its 400m is found, and no stretch runs from one activity into the next
+    assert set(found) == set(expected)
+    assert (3, 'Mile') not in found
+    for key, effort_time in expected.items():
+        assert np.isclose(found[key], effort_time)
+
+
+def test_best_effort_option_draws_record_progression(tmp_path):
+    rng = np.random.default_rng(0)
+    (tmp_path / 'activities').mkdir()
+    rows = []
+
+    # Every run lasts the same minute of track time, and covers a little more road than the week before
+    for activity_id in range(1, 7):
+        write_gpx(tmp_path / 'activities' / f'{activity_id}.gpx',
+                  51.5 + np.linspace(0, 0.05 * (1 + activity_id / 50), 60), -0.1)
+        date = pd.Timestamp('2024-01-01 07:00') + pd.Timedelta(days=7 * activity_id)
+        elapsed_time = 1800 + rng.uniform(0, 300)
+        heart_rate = rng.uniform(140, 160)
+        rows.append(f'{activity_id},"{date:%b %-d, %Y, %-I:%M:%S %p}",Morning Run,Run,{elapsed_time:.0f},5.56,'
+                    f'{heart_rate + 20:.0f},activities/{activity_id}.gpx,{elapsed_time:.0f},{elapsed_time - 60:.0f},'
+                    f'5560,{heart_rate:.0f},10\n')
+    (tmp_path / 'activities.csv').write_text(HEADER + ''.join(rows))
+
+    _, _, chart_jobs = batch.compute_export(str(tmp_path / 'activities.csv'), str(tmp_path / 'out'),
+                                            {'best_effort': 'Mile', 'degree': '1', 'start_date': '01-01-2024'},
+                                            use_cache=False)
+
+    best_efforts_df = pd.read_csv(tmp_path / 'out' / 'best_efforts.csv')
+    assert set(best_efforts_df['Effort']) == {'Mile', '5K'}
+    assert len(best_efforts_df) == 12
+    [pace_trend_data] = [job.data for job in chart_jobs if job.output_path.endswith('pace_trend_vs_time.png')]
+    # Every run sets a new mile record, and the records are windowed like the runs drawn
+    assert len(pace_trend_data['records']['pace']) == len(pace_trend_data['pace']) == 5
+    assert (np.diff(pace_trend_data['records']['pace']) < 0).all()
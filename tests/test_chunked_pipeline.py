@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import batch
+from src import chunked_pipeline
+
+
+def write_export(path, rows):
+    pd.DataFrame(rows, columns=['Activity ID', 'Activity Date', 'Activity Type', 'Elapsed Time', 'Moving Time',
+                                'Distance.1', 'Average Heart Rate', 'Max Heart Rate', 'Apparent Temperature']).to_csv(path, index=False)
+
+
+def make_repeated_export(path):
+    rows = [[activity_id, f'Jun {activity_id}, 2023, 7:00:00 AM', 'Run', 1800 + 60 * activity_id, 1750,
+             5000.0 + 20 * activity_id, 140 + activity_id, 160 + 2 * activity_id, 12.0]
+            for activity_id in range(1, 13)]
+    # The same run recorded on a phone too, two minutes later and without heart rate, in the next chunk
+    rows.insert(3, [20, 'Jun 3, 2023, 7:02:00 AM', 'Run', 1990, 1750, 5070.0, np.nan, np.nan, 12.0])
+    # An overlapping export repeating the first run many chunks after it
+    rows.append(rows[0])
+    write_export(path, rows)
+
+
+def test_teammates_group_runs_are_all_counted(tmp_path):
+    group_run = ['Jun 4, 2023, 8:00:00 AM', 'Run', 3600, 3500, 10000.0, 150, 170, 14.0]
+    write_export(tmp_path / 'activities.csv', [
+        [1, 'Jun 1, 2023, 7:00:00 AM', 'Run', 1800, 1750, 5000.0, 145, 165, 12.0],
+        # The same group run, recorded by two athletes of a merged dump
+        [2] + group_run,
+        [3] + group_run,
+        # Overlapping exports repeat the same activity under its Activity ID, across the chunk boundary
+        [3] + group_run,
+        [4, 'Jun 6, 2023, 7:00:00 AM', 'Run', 1800, 1750, 5000.0, 145, 165, 12.0],
+    ])
+
+    partial = chunked_pipeline.run(str(tmp_path / 'activities.csv'), 'club', chunk_size=3, near_duplicates=False)
+
+    assert partial.period_totals['Number of Runs'].sum() == 4
+
+
+def test_chunked_weekly_averages_match_whole_export(tmp_path):
+    make_repeated_export(tmp_path / 'activities.csv')
+    options = {'current_year': '2024', 'num_weeks_current_year': '10', 'num_weeks_first_year': '30'}
+
+    _, weekly_avg_df, _ = batch.compute_export(str(tmp_path / 'activities.csv'), str(tmp_path / 'whole'), options,
+                                               use_cache=False)
+    (tmp_path / 'chunked').mkdir()
+    batch.analyze_export_in_chunks(str(tmp_path / 'activities.csv'), str(tmp_path / 'chunked'), options,
+                                   club_report=False, chunk_size=2)
+    chunked_avg_df = pd.read_csv(tmp_path / 'chunked' / 'weekly_averages.csv')
+
+    np.testing.assert_allclose(chunked_avg_df.iloc[:, 1:].to_numpy(), weekly_avg_df.iloc[:, 1:].to_numpy())
+    # 2023 is the first year, counted over num_weeks_first_year weeks rather than as the current year, and the phone's
+    # copy and the repeated first run are dropped however far apart they are
+    total_miles = sum(5000.0 + 20 * activity_id for activity_id in range(1, 13)) / 1610
+    assert chunked_avg_df['Weekly Distance Run (Miles)'].iloc[0] == pytest.approx(total_miles / 30)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from src import club_aggregation
+
+
+def test_paces_outside_domain_left_out_of_fit():
+    rng = np.random.default_rng(0)
+    pace = rng.uniform(7, 11, 500)
+    heart_rates = np.column_stack([190 - 5 * pace, 200 - 4 * pace]) + rng.normal(0, 3, (500, 2))
+
+    # A walk recorded as a run, and a GPS glitch, split between two partials
+    first = club_aggregation.get_sufficient_statistics(np.append(pace[:250], 45.0), np.vstack([heart_rates[:250],
+                                                                                             [[95, 110]]]), 5)
+    second = club_aggregation.get_sufficient_statistics(np.append(pace[250:], 0.5), np.vstack([heart_rates[250:],
+                                                                                              [[150, 160]]]), 5)
+    partial = club_aggregation.empty_partial()._replace(hr_vs_pace={'a': first, 'b': second})
+
+    fits = club_aggregation.fit_hr_vs_pace(partial, degrees=[1, 3])
+
+    for degree, fit in fits.items():
+        for target_index in range(2):
+            np.testing.assert_allclose(fit['coefficients'][target_index],
+                                       np.polyfit(pace, heart_rates[:, target_index], degree), rtol=1e-6, atol=1e-8)
+
+
+def test_ill_conditioned_fit_refused():
+    # Every run at nearly the same pace can't pin down a degree 5 polynomial
+    pace = np.random.default_rng(0).uniform(8.5, 8.6, 200)
+    statistics = club_aggregation.get_sufficient_statistics(pace, 150 + pace[:, None], 5)
+
+    with pytest.raises(ValueError, match='ill-conditioned'):
+        club_aggregation.solve_sufficient_statistics(statistics['x_powers'], statistics['xy'], statistics['yy'], [5])
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from utils import deduplication
+
+
+def make_activities(rows):
+    activities = pd.DataFrame(rows, columns=['Activity ID', 'Activity Date', 'Activity Type', 'Elapsed Time',
+                                             'Distance.1', 'Average Heart Rate'])
+    activities['Activity Date'] = pd.to_datetime(activities['Activity Date'])
+
+    return activities
+
+
+def get_pairs(pairs):
+    return {tuple(sorted(pair)) for pair in pairs.T.tolist()}
+
+
+def test_exact_repeated_id():
+    activities = make_activities([
+        [5, '2023-06-01 07:00', 'Run', 1800, 5000.0, np.nan],
+        [7, '2023-06-02 07:00', 'Run', 1800, 5000.0, 150],
+        # The same activity from an overlapping export, with its heart rate
+        [5, '2023-06-01 07:00', 'Run', 1800, 5000.0, 145],
+    ])
+
+    assert get_pairs(deduplication.find_repeated_ids(activities['Activity ID'].to_numpy())) == {(0, 2)}
+    # The copy with more values recorded is kept
+    assert deduplication.find_duplicates(activities).tolist() == [True, False, False]
+
+
+def test_near_duplicate_pair():
+    activities = make_activities([
+        # A watch and a phone recording the same run under different IDs
+        [11, '2023-06-01 07:00:00', 'Run', 3600, 10000.0, np.nan],
+        [12, '2023-06-01 07:02:00', 'Run', 3650, 10200.0, 150],
+        # The same times as a ride are a different activity
+        [13, '2023-06-01 07:01:00', 'Ride', 3600, 10000.0, 130],
+    ])
+
+    assert get_pairs(deduplication.find_near_duplicate_pairs(activities)) == {(0, 1)}
+    assert deduplication.find_duplicates(activities).tolist() == [True, False, False]
+    assert not deduplication.find_duplicates(activities, near_duplicates=False).any()
+
+
+def test_pairs_just_outside_tolerance():
+    # Distances compare on log1p(distance / DISTANCE_SLACK_METERS), so 10 km is within the tolerance of 10500 m
+    # but not of 10520 m, and starts more than START_TOLERANCE apart are never paired
+    activities = make_activities([
+        [21, '2023-06-01 07:00:00', 'Run', 3600, 10000.0, 150],
+        [22, '2023-06-01 07:01:00', 'Run', 3600, 10520.0, 150],
+        [23, '2023-06-01 07:05:01', 'Run', 3600, 10000.0, 150],
+        [24, '2023-06-01 07:00:00', 'Run', 3600, 10500.0, 150],
+    ])
+
+    assert get_pairs(deduplication.find_near_duplicate_pairs(activities)) == {(0, 3), (1, 3)}
+
+
+def test_transitive_chain_is_one_activity():
+    # Each start is 4 minutes after the one before, so the first and last are too far apart to pair directly
+    activities = make_activities([
+        [31, '2023-06-01 07:00', 'Run', 3600, 10000.0, np.nan],
+        [32, '2023-06-01 07:04', 'Run', 3600, 10000.0, 150],
+        [33, '2023-06-01 07:08', 'Run', 3600, 10000.0, np.nan],
+    ])
+
+    assert get_pairs(deduplication.find_near_duplicate_pairs(activities)) == {(0, 1), (1, 2)}
+    # connected_components joins the chain, and only the one with heart rate is kept
+    assert deduplication.find_duplicates(activities).tolist() == [True, False, True]
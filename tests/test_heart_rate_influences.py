@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from src import data_cleaning
+from src import heart_rate_influences
+from utils import polynomial_fitting
+from utils.running_utils import add_unit_columns, index_by_activity_date
+
+
+def make_running_df(num_runs, seed=0):
+    rng = np.random.default_rng(seed)
+    running_df = pd.DataFrame({
+        'Activity ID': np.arange(num_runs),
+        'Activity Date': pd.date_range('2023-01-01 07:00', periods=num_runs, freq='h'),
+        'Activity Type': 'Run',
+        'Distance.1': rng.uniform(3000, 20000, num_runs),
+        'Elapsed Time': rng.uniform(1000, 7000, num_runs),
+        'Moving Time': rng.uniform(1000, 7000, num_runs),
+        'Average Heart Rate': rng.uniform(120, 170, num_runs),
+        'Max Heart Rate': rng.uniform(160, 195, num_runs),
+        'Apparent Temperature': rng.uniform(-5, 30, num_runs),
+    })
+    data_cleaning.add_calendar_parts(running_df)
+
+    return index_by_activity_date(add_unit_columns(running_df))
+
+
+def test_few_runs_only_test_the_degrees_they_can_fit(tmp_path):
+    chart_jobs = heart_rate_influences.build_charts(make_running_df(4), output_dir=str(tmp_path))
+
+    # 4 runs fit up to degree 3, but cross-validation leaves 3 runs in a training fold, so degrees 1 and 2 are tested
+    trend_lines = chart_jobs[0].data['trend_lines']
+    assert len(trend_lines) == 2
+    assert all('Degree 1' in label or 'Degree 2' in label for label, _ in trend_lines)
+
+
+def test_clip_degrees_falls_back_to_r_squared():
+    # 2 points are too few to cross-validate any degree, but fit a line
+    assert polynomial_fitting.clip_degrees((1, 2, 3, 4, 5), 2) == [1]
+    assert polynomial_fitting.clip_degrees((1, 2, 3, 4, 5), 100) == [1, 2, 3, 4, 5]
+
+
+def test_auto_mode_bins_runs_above_density_threshold(tmp_path):
+    running_df = make_running_df(heart_rate_influences.DENSITY_THRESHOLD + 1)
+    # Runs without heart rate are left out of the grids
+    running_df.iloc[:50, running_df.columns.get_loc('Max Heart Rate')] = np.nan
+
+    hr_vs_pace_job, hr_vs_temperature_job = heart_rate_influences.build_charts(running_df, output_dir=str(tmp_path))
+
+    assert hr_vs_pace_job.draw is heart_rate_influences.draw_hr_vs_pace_density
+    assert hr_vs_temperature_job.draw is heart_rate_influences.draw_hr_vs_temperature_density
+    for grid, column in zip(hr_vs_pace_job.data['grids'], ['Average Heart Rate', 'Max Heart Rate']):
+        pace = running_df['Pace in Mins per Mile'].to_numpy(np.float64)
+        heart_rate = running_df[column].to_numpy(np.float64)
+        present = np.isfinite(heart_rate)
+        x_min, x_max, y_min, y_max = grid['extent']
+        # The grid counts every run with both values inside its extent exactly once
+        inside = present & (pace >= x_min) & (pace <= x_max) & (heart_rate >= y_min) & (heart_rate <= y_max)
+        assert grid['counts'].sum() == grid['count_x'].sum() == inside.sum()
+
+    # At the threshold itself the runs are still drawn one by one
+    [scatter_job, _] = heart_rate_influences.build_charts(
+        running_df.iloc[:heart_rate_influences.DENSITY_THRESHOLD], output_dir=str(tmp_path))
+    assert scatter_job.draw is heart_rate_influences.draw_hr_vs_pace_graph
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+from src import incremental_ingest
+
+HEADER = ('Activity ID,Activity Date,Activity Name,Activity Type,Elapsed Time,Distance,Max Heart Rate,Filename,'
+          'Elapsed Time,Moving Time,Distance,Average Heart Rate,Apparent Temperature\n')
+
+
+def write_export(file_path, num_runs):
+    rows = []
+    for activity_id in range(1, num_runs + 1):
+        date = pd.Timestamp('2024-01-01 07:00') + pd.Timedelta(days=3 * activity_id)
+        rows.append(f'{activity_id},"{date:%b %-d, %Y, %-I:%M:%S %p}",Morning Run,Run,1800,5.0,180,,1800,1750,'
+                    f'{5000 + activity_id},150,10\n')
+    file_path.write_text(HEADER + ''.join(rows))
+
+
+def crash(*args):
+    raise OSError('Stopped before the totals were saved')
+
+
+def test_ingest_stopped_before_saving_totals_is_recovered(tmp_path, monkeypatch):
+    export_path = tmp_path / 'activities.csv'
+    store_dir = str(tmp_path / 'store')
+
+    write_export(export_path, 10)
+    incremental_ingest.run(str(export_path), store_dir)
+
+    # The next ingest writes its part, then stops before its totals are saved
+    write_export(export_path, 15)
+    with monkeypatch.context() as patch:
+        patch.setattr(incremental_ingest, 'write_period_totals', crash)
+        with pytest.raises(OSError):
+            incremental_ingest.run(str(export_path), store_dir)
+
+    write_export(export_path, 20)
+    _, period_totals_df = incremental_ingest.run(str(export_path), store_dir)
+
+    assert period_totals_df['Number of Runs'].sum() == 20
+    assert incremental_ingest.load_period_totals(store_dir)['Number of Runs'].sum() == 20
+    assert len(incremental_ingest.load_activities(store_dir, activity_type='Run')) == 20
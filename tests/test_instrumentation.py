@@ -0,0 +1,20 @@
+import numpy as np
+from utils import instrumentation
+
+
+def test_stage_reports_its_own_peak_memory_growth(tmp_path):
+    instrumentation.enable(str(tmp_path / 'trace.json'), write_at_exit=False)
+    try:
+        with instrumentation.stage('large'):
+            # Written to, so the pages are really resident
+            np.ones(200 * 2 ** 20 // 8).sum()
+        with instrumentation.stage('small'):
+            np.ones(1000).sum()
+        large, small = instrumentation._trace['stages']
+    finally:
+        instrumentation.disable()
+
+    assert large['peak_rss_growth_mb'] > 100
+    # The process's peak is still the large stage's, but the small stage didn't raise it
+    assert small['peak_rss_growth_mb'] < 10
+    assert small['process_peak_rss_mb'] >= large['process_peak_rss_mb']
@@ -0,0 +1,66 @@
+import types
+import pandas as pd
+from utils import memoization
+from utils.plotting import ChartJob, get_chart_key
+
+
+def make_module(source):
+    module = types.ModuleType('charts')
+    exec(source, module.__dict__)
+    return module
+
+
+DRAW_SOURCE = '''
+def label(ax):
+    ax.set_xlabel('Pace')
+
+
+def draw(data, output_path):
+    label(data)
+'''
+
+
+def test_called_attribute_changes_hash():
+    x_module = make_module("def draw(ax):\n    ax.set_xlabel('Pace')\n")
+    y_module = make_module("def draw(ax):\n    ax.set_ylabel('Pace')\n")
+
+    assert memoization.hash_value(x_module.draw).hexdigest() != memoization.hash_value(y_module.draw).hexdigest()
+
+
+def test_renaming_attribute_in_helper_invalidates_chart(tmp_path):
+    output_path = tmp_path / 'chart.png'
+    output_path.write_bytes(b'png')
+
+    module = make_module(DRAW_SOURCE)
+    key = get_chart_key(ChartJob(module.draw, [1, 2, 3], str(output_path)))
+    manifest = {output_path.name: key}
+    assert memoization.is_unchanged(manifest, str(output_path), key)
+
+    # Only the helper the drawing function calls through its globals is edited
+    exec(DRAW_SOURCE.replace('set_xlabel', 'set_ylabel').split('def draw')[0], module.__dict__)
+    new_key = get_chart_key(ChartJob(module.draw, [1, 2, 3], str(output_path)))
+
+    assert not memoization.is_unchanged(manifest, str(output_path), new_key)
+
+
+def test_function_hash_is_stable():
+    module = make_module(DRAW_SOURCE)
+    other_module = make_module(DRAW_SOURCE)
+
+    assert memoization.hash_value(module.draw).hexdigest() == memoization.hash_value(other_module.draw).hexdigest()
+
+
+def test_stage_only_runs_again_when_inputs_change(tmp_path):
+    module = make_module("calls = []\n\ndef total(values, scale):\n    calls.append(1)\n    return sum(values) * scale\n")
+    runs = pd.DataFrame({'Distance in Miles': [3.1, 6.2, 13.1]})
+
+    assert memoization.run_stage('total', module.total, {'values': runs['Distance in Miles'], 'scale': 2},
+                                 str(tmp_path)) == memoization.run_stage(
+        'total', module.total, {'values': runs['Distance in Miles'], 'scale': 2}, str(tmp_path))
+    assert len(module.calls) == 1
+
+    # A new run, or a new parameter, changes the key
+    runs.loc[3] = 5.0
+    memoization.run_stage('total', module.total, {'values': runs['Distance in Miles'], 'scale': 2}, str(tmp_path))
+    memoization.run_stage('total', module.total, {'values': runs['Distance in Miles'], 'scale': 3}, str(tmp_path))
+    assert len(module.calls) == 3
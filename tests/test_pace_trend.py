@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from utils import pace_trend
+
+
+def make_history(num_runs, seed=0):
+    rng = np.random.default_rng(seed)
+    days = np.sort(rng.uniform(0, 2000, num_runs))
+    dates = pd.Timestamp('2018-01-01') + pd.to_timedelta(days, unit='D')
+    paces = 9 + 0.5 * np.sin(days / 150) + rng.normal(0, 0.3, num_runs)
+    # Runs with long stops, which the robustifying passes should shrug off
+    paces[rng.choice(num_runs, num_runs // 40, replace=False)] += rng.uniform(2, 6, num_runs // 40)
+
+    return pd.DatetimeIndex(dates), paces
+
+
+def reference_lowess(x, y, bandwidth, iterations):
+    # Cleveland's LOWESS fitted at every run, with tricube weights over a fixed bandwidth and bisquare robustness
+    def fit(robustness_weights):
+        fitted = np.empty(len(x))
+        for i, x_i in enumerate(x):
+            distance = x - x_i
+            weights = np.clip(1 - np.abs(distance / bandwidth) ** 3, 0, None) ** 3 * robustness_weights
+            x_mean = np.average(distance, weights=weights)
+            y_mean = np.average(y, weights=weights)
+            x_var = np.sum(weights * (distance - x_mean) ** 2)
+            slope = np.sum(weights * (distance - x_mean) * (y - y_mean)) / x_var if x_var > 0 else 0
+            fitted[i] = y_mean - slope * x_mean
+        return fitted
+
+    robustness_weights = np.ones(len(x))
+    for _ in range(iterations):
+        residuals = y - fit(robustness_weights)
+        robustness_weights = np.clip(1 - (residuals / (6 * np.median(np.abs(residuals)))) ** 2, 0, None) ** 2
+
+    return fit(robustness_weights)
+
+
+def test_lowess_matches_reference():
+    dates, paces = make_history(800)
+    x = np.asarray(pace_trend.get_day_numbers(dates))
+
+    expected = reference_lowess(x, paces, pace_trend.DEFAULT_BANDWIDTH_DAYS, pace_trend.LOWESS_ITERATIONS)
+    smoothed = pace_trend.lowess(dates, paces)
+
+    # Only fitting once per slot of LOWESS_DELTA_FRACTION * bandwidth and interpolating between them differs
+    np.testing.assert_allclose(smoothed, expected, atol=0.01)
+
+
+def test_updated_trend_equals_full_recompute():
+    dates, paces = make_history(1500, seed=1)
+
+    trend_df = pace_trend.create_pace_trend_df(dates[:1000], paces[:1000])
+    for num_runs in range(1037, 1537, 37):
+        num_runs = min(num_runs, len(dates))
+        trend_df = pace_trend.update_pace_trend_df(trend_df, dates[:num_runs], paces[:num_runs])
+
+        # Not just close: the update computes every value exactly as a full recompute does
+        expected_df = pace_trend.create_pace_trend_df(dates[:num_runs], paces[:num_runs])
+        for column in ['LOWESS', 'P25', 'P50', 'P75']:
+            np.testing.assert_array_equal(trend_df[column], expected_df[column])
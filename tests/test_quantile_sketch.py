@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+from utils import quantile_sketch
+
+QUANTILES = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+
+def test_merged_sketches_match_np_quantile():
+    rng = np.random.default_rng(0)
+    num_values = 20_000
+    # Paces of two groups of runs, easy and fast, spread over 8 athletes' sketches
+    paces = np.concatenate([rng.normal(9.5, 0.6, num_values // 2), rng.lognormal(np.log(7), 0.08, num_values // 2)])
+    values_df = pd.DataFrame({'Athlete': rng.integers(0, 8, num_values), 'Pace': paces})
+
+    sketches = pd.concat([quantile_sketch.create_sketches(athlete_df, ['Athlete'], ['Pace'])
+                          for _, athlete_df in values_df.groupby('Athlete')])
+    quantiles_df = quantile_sketch.get_quantiles(sketches, [], quantiles=QUANTILES)
+
+    assert quantiles_df['Count'].iloc[0] == num_values
+    for quantile in QUANTILES:
+        estimate = quantiles_df[quantile_sketch.get_quantile_column(quantile)].iloc[0]
+        # The estimate's rank is within RANK_ERROR of the quantile asked for
+        assert np.quantile(paces, max(quantile - quantile_sketch.RANK_ERROR, 0)) <= estimate
+        assert estimate <= np.quantile(paces, min(quantile + quantile_sketch.RANK_ERROR, 1))
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import batch
+
+HEADER = ('Activity ID,Activity Date,Activity Name,Activity Type,Elapsed Time,Distance,Max Heart Rate,Filename,'
+          'Elapsed Time,Moving Time,Distance,Average Heart Rate,Apparent Temperature\n')
+
+
+def write_gpx(file_path, latitudes, longitude):
+    points = ''.join(f'<trkpt lat="{latitude:.6f}" lon="{longitude:.6f}"><time>2024-01-01T07:{i // 60:02d}:'
+                     f'{i % 60:02d}Z</time></trkpt>' for i, latitude in enumerate(latitudes))
+    file_path.write_text(f'<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>{points}'
+                         f'</trkseg></trk></gpx>')
+
+
+def test_route_id_option_draws_route_pace_trend(tmp_path):
+    rng = np.random.default_rng(0)
+    (tmp_path / 'activities').mkdir()
+    rows = []
+
+    # Runs 1 to 8 go up and down the same road, and runs 9 to 12 along another one 5 km east of it
+    for activity_id in range(1, 13):
+        longitude = -0.1 if activity_id <= 8 else -0.03
+        latitudes = 51.5 + np.linspace(0, 0.05, 60) + rng.normal(0, 0.00002, 60)
+        write_gpx(tmp_path / 'activities' / f'{activity_id}.gpx', latitudes, longitude)
+
+        date = pd.Timestamp('2024-01-01 07:00') + pd.Timedelta(days=7 * activity_id)
+        elapsed_time = 1800 + rng.uniform(0, 300)
+        heart_rate = rng.uniform(140, 160)
+        rows.append(f'{activity_id},"{date:%b %-d, %Y, %-I:%M:%S %p}",Morning Run,Run,{elapsed_time:.0f},5.56,'
+                    f'{heart_rate + 20:.0f},activities/{activity_id}.gpx,{elapsed_time:.0f},{elapsed_time - 60:.0f},'
+                    f'5560,{heart_rate:.0f},10\n')
+    (tmp_path / 'activities.csv').write_text(HEADER + ''.join(rows))
+
+    running_df, _, chart_jobs = batch.compute_export(str(tmp_path / 'activities.csv'), str(tmp_path / 'out'),
+                                                     {'route_id': '1', 'degree': '1'})
+
+    assert running_df.set_index('Activity ID')['Route ID'].to_dict() == {**{i: 1 for i in range(1, 9)},
+                                                                         **{i: 9 for i in range(9, 13)}}
+    [pace_trend_data] = [job.data for job in chart_jobs if job.output_path.endswith('pace_trend_vs_time.png')]
+    assert pace_trend_data['title'].startswith('Route 1:')
+    assert len(pace_trend_data['pace']) == 8
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from src import training_load
+
+
+def make_running_df(num_runs, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Activity ID': np.arange(1, num_runs + 1),
+        'Activity Date': pd.Timestamp('2024-01-01 07:00') + pd.to_timedelta(np.sort(rng.choice(300, num_runs)),
+                                                                            unit='D'),
+        'Moving Time in Minutes': rng.uniform(20, 90, num_runs),
+        'Average Heart Rate': rng.uniform(130, 170, num_runs),
+        'Max Heart Rate': 190.0,
+    })
+
+
+def test_late_upload_rewrites_changed_days(tmp_path):
+    running_df = make_running_df(200)
+    csv_path = str(tmp_path / 'training_load.csv')
+    state_path = str(tmp_path / 'training_load.json')
+
+    # Two runs are uploaded after the rest: one days before the last run and one too long before it to be recent
+    late = running_df['Activity ID'].isin([120, 190])
+    uploaded = pd.concat([running_df[~late], running_df[late].assign(**{'Activity ID': [201, 202]})])
+
+    training_load.save_training_load(training_load.run(uploaded[uploaded['Activity ID'] <= 200], state_path),
+                                     csv_path)
+    training_load.save_training_load(training_load.run(uploaded, state_path), csv_path)
+
+    expected_df = training_load.compute_training_load(running_df)[0]
+    saved_df = pd.read_csv(csv_path, index_col='Date', parse_dates=['Date'])
+    recent_start = expected_df.index[-training_load.RECENT_DAYS]
+
+    pd.testing.assert_index_equal(saved_df.index, expected_df.index, check_names=False)
+    np.testing.assert_allclose(saved_df.loc[recent_start:], expected_df.loc[recent_start:])
+    # Only the days from the older upload up to the recent days keep the loads they were first given
+    older_day = running_df.loc[running_df['Activity ID'] == 120, 'Activity Date'].dt.normalize().iloc[0]
+    assert older_day < recent_start
+    np.testing.assert_allclose(saved_df.loc[:older_day - pd.Timedelta(days=1)],
+                               expected_df.loc[:older_day - pd.Timedelta(days=1)])
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import inputs
+from src import club_aggregation
+from src import data_cleaning
+from src import incremental_ingest
+from src.mileage_and_time_run_per_week import create_weekly_avg_df
+from utils.calendar_dimension import count_weeks_through
+from utils.running_utils import add_unit_columns, index_by_activity_date
+
+
+def make_running_df(dates):
+    running_df = pd.DataFrame({
+        'Activity ID': np.arange(len(dates)),
+        'Activity Date': pd.to_datetime(dates),
+        'Activity Type': 'Run',
+        'Distance.1': 8000.0,
+        'Elapsed Time': 2700.0,
+        'Moving Time': 2600.0,
+        'Average Heart Rate': 150.0,
+        'Max Heart Rate': 170.0,
+        'Apparent Temperature': 10.0,
+    })
+    data_cleaning.add_calendar_parts(running_df)
+
+    return index_by_activity_date(add_unit_columns(running_df))
+
+
+def test_count_weeks_through_week_zero():
+    # 2024 starts on a Monday, so January 1st to 6th are week 0
+    assert count_weeks_through(2024, 0) == 1
+    assert count_weeks_through(2024, 1) == 2
+    assert count_weeks_through(2023, 52) == 52
+
+
+def test_weekly_averages_with_last_run_before_first_sunday():
+    running_df = make_running_df(['2023-03-01', '2023-06-01', '2023-11-01', '2024-01-04'])
+    assert running_df['Activity Week'].iloc[-1] == 0
+
+    current_year, num_weeks_current_year, num_weeks_typical = inputs.get_yearly_data_defaults(running_df)
+    assert num_weeks_current_year == 1
+
+    weekly_avg_df = create_weekly_avg_df(running_df, num_weeks_current_year=num_weeks_current_year,
+                                         num_weeks_first_year=inputs.get_first_year_weeks_default(running_df, 52),
+                                         num_weeks_typical=num_weeks_typical, current_year=current_year)
+    assert np.isfinite(weekly_avg_df.select_dtypes('number').to_numpy()).all()
+
+    partial = club_aggregation.create_partial_from_running_df(running_df, 'athlete')
+    club_weekly_avg_df = club_aggregation.create_weekly_avg_df(partial)
+    assert np.isfinite(club_weekly_avg_df.select_dtypes('number').to_numpy()).all()
+
+
+def test_period_totals_of_older_stores_are_rebuilt(tmp_path):
+    running_df = make_running_df(['2022-12-31', '2023-01-01', '2023-01-08'])
+    incremental_ingest.append_activities(running_df.reset_index(drop=True), tmp_path)
+    # Totals written with ISO weeks by an older version
+    stale_totals = pd.DataFrame({'Activity Year': [2022, 2023], 'Activity Month': [12, 1], 'Activity Week': [52, 1],
+                                 'Distance in Miles': [1.0, 1.0], 'Elapsed Time': [1.0, 1.0], 'Moving Time': [1.0, 1.0],
+                                 'Number of Runs': [1, 1]})
+    stale_totals.to_parquet(tmp_path / 'period_totals.parquet', index=False)
+
+    period_totals_df = incremental_ingest.load_period_totals(tmp_path)
+
+    assert period_totals_df['Number of Runs'].sum() == 3
+    assert period_totals_df['Activity Week'].tolist() == [52, 1, 2]
+    assert not (tmp_path / 'period_totals.parquet').exists()
+    assert (tmp_path / incremental_ingest.PERIOD_TOTALS_FILE).exists()
@@ -0,0 +1,85 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Which week numbering every chart and total uses as 'Activity Week'. Weeks start on Sunday and are numbered within the
+# calendar year, like strftime('%U'): the days before the year's first Sunday are week 0. Unlike ISO weeks, every week
+# then belongs to the same year as its days, so grouping by Activity Year and Activity Week never mixes New Year's days
+# into the previous year's week 52 or 53.
+ACTIVITY_WEEK = 'Sunday Week'
+
+
+def get_day_numbers(dates) -> np.ndarray:
+    """
+
+    :param dates: dates or datetimes
+    :return: array of the number of days from 1970-01-01 to each date, the key of the calendar table
+    """
+    return pd.DatetimeIndex(dates).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+@lru_cache(maxsize=8)
+def create_calendar_df(first_year: int, last_year: int) -> pd.DataFrame:
+    """
+    Builds the calendar attributes of every day of the given years once, so they cost O(days) however many activities
+    and passes look them up. The table is cached per span of years.
+
+    :param first_year: first year of the calendar
+    :param last_year: last year of the calendar
+    :return: data frame indexed by 'Day Number', as get_day_numbers returns, with the Date, Year, Month, Day of Year,
+    ISO Year, ISO Week, Sunday Week, and the Days in Month and Days in Year of each day
+    """
+    dates = pd.date_range(f'{first_year}-01-01', f'{last_year}-12-31', freq='D')
+    iso_calendar = dates.isocalendar()
+    day_of_year = dates.dayofyear.to_numpy()
+    # Days since the last Sunday, 0 on Sundays
+    days_since_sunday = (dates.dayofweek.to_numpy() + 1) % 7
+
+    calendar_df = pd.DataFrame({
+        'Date': dates,
+        'Year': dates.year.to_numpy().astype('int16'),
+        'Month': dates.month.to_numpy().astype('int8'),
+        'Day of Year': day_of_year.astype('int16'),
+        'ISO Year': iso_calendar['year'].to_numpy().astype('int16'),
+        'ISO Week': iso_calendar['week'].to_numpy().astype('int8'),
+        'Sunday Week': ((day_of_year - 1 - days_since_sunday + 7) // 7).astype('int8'),
+        'Days in Month': dates.days_in_month.to_numpy().astype('int8'),
+        'Days in Year': np.where(dates.is_leap_year, 366, 365).astype('int16'),
+    }, index=pd.Index(get_day_numbers(dates), name='Day Number'))
+
+    return calendar_df
+
+
+def join_calendar(dates, columns) -> pd.DataFrame:
+    """
+    Looks up calendar attributes of each date by its day number. The calendar rows are consecutive days, so the join
+    is an array lookup at the day number's offset from the first day.
+
+    :param dates: datetimes, none missing
+    :param columns: list of columns of create_calendar_df to look up
+    :return: data frame of the columns, one row per date
+    """
+    dates = pd.DatetimeIndex(dates)
+    if not len(dates):
+        # Empty columns of the calendar's dtypes
+        return pd.DataFrame({col: create_calendar_df(1970, 1970)[col].iloc[:0] for col in columns})
+
+    calendar_df = create_calendar_df(int(dates.min().year), int(dates.max().year))
+    positions = get_day_numbers(dates) - calendar_df.index[0]
+
+    return pd.DataFrame({col: calendar_df[col].to_numpy()[positions] for col in columns})
+
+
+def count_weeks_through(year: int, week: int) -> int:
+    """
+    Counts the weeks of a year up to the end of one of its ACTIVITY_WEEK weeks by the days they span, so week 0, the
+    days before the year's first Sunday, is counted for the days it has rather than as a week of its own or not at all.
+
+    :param year: calendar year
+    :param week: ACTIVITY_WEEK number within the year
+    :return: number of seven day weeks from January 1st through the end of the week, rounded and at least 1
+    """
+    calendar_df = create_calendar_df(int(year), int(year))
+    num_days = int((calendar_df[ACTIVITY_WEEK] <= week).sum())
+
+    return max(1, round(num_days / 7))
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+from utils import instrumentation
+
+# Two activities of the same type are taken to be one recorded twice, say on a watch and a phone, when they start within
+# START_TOLERANCE of each other, and their elapsed times and distances are within RELATIVE_TOLERANCE of each other
+START_TOLERANCE = pd.Timedelta(minutes=5)
+RELATIVE_TOLERANCE = 0.05
+# Give or take this much, so short or distance-less activities aren't held to a few seconds or meters
+DURATION_SLACK_SECONDS = 60
+DISTANCE_SLACK_METERS = 100
+
+# Columns find_duplicates needs, named as after data_cleaning.repair_headers
+KEY_COLUMNS = ['Activity ID', 'Activity Date', 'Activity Type', 'Elapsed Time', 'Distance.1']
+
+
+def find_duplicates(activities: pd.DataFrame, protected=None, near_duplicates=True, num_recorded=None) -> np.ndarray:
+    """
+    Finds the activities that are repeats of another one. Activities sharing an Activity ID are exact repeats, from
+    overlapping exports. Near repeats, the same run recorded on two devices, get different IDs, so activities are
+    hashed by their type and start time quantised to START_TOLERANCE, and only activities in the same or the next
+    bucket are compared on their start, elapsed time and distance. The cost grows with the number of activities rather
+    than the number of pairs of them.
+
+    Of each group of repeats the activity kept is a protected one if there is one, then the one with the most values
+    recorded, such as the watch's copy with heart rate over the phone's, then the lowest Activity ID.
+
+    :param activities: data frame with the KEY_COLUMNS, 'Activity Date' parsed
+    :param protected: boolean array of activities that are never marked, such as those already in a store
+    :param near_duplicates: if False, only activities sharing an Activity ID are repeats. Near repeats can only be told
+    apart from teammates' runs of the same group run within one athlete's activities
+    :param num_recorded: array of the number of values recorded for each activity, counted from activities by default.
+    Given when activities only holds the KEY_COLUMNS of wider rows
+    :return: boolean array, True for every activity that repeats one that is kept
+    """
+    num_activities = len(activities)
+    protected = np.zeros(num_activities, dtype=bool) if protected is None else np.asarray(protected, dtype=bool)
+
+    # Preference of each activity as the one kept of its group, lowest first
+    if num_recorded is None:
+        num_recorded = activities.notna().sum(axis=1).to_numpy()
+    activity_ids = activities['Activity ID'].to_numpy()
+    preference = np.empty(num_activities, dtype=np.int64)
+    preference[np.lexsort((activity_ids, -num_recorded, ~protected))] = np.arange(num_activities)
+
+    pairs = [find_repeated_ids(activity_ids)]
+    if near_duplicates:
+        pairs.append(find_near_duplicate_pairs(activities))
+    first, second = np.concatenate(pairs, axis=1)
+    if not len(first):
+        return np.zeros(num_activities, dtype=bool)
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    # Repeats of repeats are all one activity
+    graph = coo_matrix((np.ones(len(first)), (first, second)), shape=(num_activities, num_activities))
+    _, groups = connected_components(graph, directed=False)
+
+    # Keep the most preferred activity of each group
+    order = np.argsort(preference)
+    _, first_of_group = np.unique(groups[order], return_index=True)
+    duplicate = np.ones(num_activities, dtype=bool)
+    duplicate[order[first_of_group]] = False
+
+    return duplicate & ~protected
+
+
+def find_repeated_ids(activity_ids):
+    """
+
+    :param activity_ids: array of Activity IDs
+    :return: array of shape (2, pairs) of the positions of each activity and the first activity with its ID
+    """
+    first_positions = pd.Series(np.arange(len(activity_ids))).groupby(activity_ids).transform('first').to_numpy()
+    repeated = np.flatnonzero(first_positions != np.arange(len(activity_ids)))
+
+    return np.stack([repeated, first_positions[repeated]])
+
+
+def find_near_duplicate_pairs(activities: pd.DataFrame):
+    """
+
+    :param activities: data frame with the KEY_COLUMNS, 'Activity Date' parsed
+    :return: array of shape (2, pairs) of the positions of the pairs of different activities within the tolerances
+    of each other, none if the activities lack any of the KEY_COLUMNS
+    """
+    if any(col not in activities for col in KEY_COLUMNS):
+        return np.empty((2, 0), dtype=np.int64)
+
+    start = (pd.DatetimeIndex(activities['Activity Date']) - pd.Timestamp(0)) / START_TOLERANCE
+    # On a log scale a relative tolerance is a fixed width
+    duration = np.log1p(activities['Elapsed Time'].to_numpy(np.float64) / DURATION_SLACK_SECONDS) / np.log1p(
+        RELATIVE_TOLERANCE)
+    distance = np.log1p(activities['Distance.1'].to_numpy(np.float64) / DISTANCE_SLACK_METERS) / np.log1p(
+        RELATIVE_TOLERANCE)
+
+    keys = pd.DataFrame({
+        'position': np.arange(len(activities)),
+        'type': pd.Series(activities['Activity Type'].to_numpy()).astype('category').cat.codes.to_numpy(),
+        'bucket': np.floor(start),
+    })
+    keys = keys[np.isfinite(np.asarray(start)) & np.isfinite(duration) & np.isfinite(distance)]
+
+    # A pair within START_TOLERANCE is in the same bucket or in neighbouring ones, so comparing every activity with
+    # its own bucket and the next one finds each pair once
+    candidates = pd.concat([
+        keys.merge(keys.assign(bucket=keys['bucket'] + offset), on=['type', 'bucket'], suffixes=('', '_other'))
+        for offset in (0, 1)])
+    first = candidates['position'].to_numpy()
+    second = candidates['position_other'].to_numpy()
+
+    start = np.asarray(start)
+    close = (first != second) & (np.abs(start[first] - start[second]) <= 1) & (
+        np.abs(duration[first] - duration[second]) <= 1) & (np.abs(distance[first] - distance[second]) <= 1)
+
+    return np.stack([first[close], second[close]])
+
+
+def drop_duplicates(activities: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param activities: cleaned data frame, 'Activity Date' parsed
+    :return: activities without the repeats found by find_duplicates
+    """
+    with instrumentation.stage('deduplicate', rows=len(activities)):
+        duplicate = find_duplicates(activities)
+        if duplicate.any():
+            print(f"Dropped {duplicate.sum()} duplicate activities")
+            activities = activities.take(np.flatnonzero(~duplicate))
+
+    return activities
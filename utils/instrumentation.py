@@ -0,0 +1,197 @@
+import atexit
+import cProfile
+import json
+import os
+import re
+import resource
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Opt-in from the environment, so production runs can be traced without changing any code:
+#   STRAVA_TRACE=trace.json python inputs.py
+#   STRAVA_TRACE=trace.json STRAVA_PROFILE_STAGE="unit conversion" python inputs.py
+TRACE_ENV_VAR = 'STRAVA_TRACE'
+PROFILE_STAGE_ENV_VAR = 'STRAVA_PROFILE_STAGE'
+
+# The trace of this process, or None while instrumentation is off
+_trace = None
+_write_at_exit_registered = False
+
+
+def enable(trace_path, profile_stage=None, write_at_exit=True):
+    """
+    Starts recording pipeline stages.
+
+    :param trace_path: JSON file the trace is written to
+    :param profile_stage: name of a stage to run under cProfile; its stats are dumped next to the trace
+    :param write_at_exit: if True, the trace is written when the process exits. Otherwise call write_trace.
+    """
+    global _trace, _write_at_exit_registered
+
+    _trace = new_trace(trace_path, profile_stage)
+
+    if write_at_exit and not _write_at_exit_registered:
+        atexit.register(write_trace)
+        _write_at_exit_registered = True
+
+
+def new_trace(trace_path, profile_stage):
+    return {
+        'run_id': uuid.uuid4().hex,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'argv': sys.argv,
+        'pid': os.getpid(),
+        'trace_path': trace_path,
+        'profile_stage': profile_stage,
+        'stages': [],
+    }
+
+
+def enable_from_environment():
+    """
+    Calls enable when STRAVA_TRACE is set, profiling the stage named by STRAVA_PROFILE_STAGE if that is set too.
+    """
+    if os.environ.get(TRACE_ENV_VAR):
+        enable(os.environ[TRACE_ENV_VAR], profile_stage=os.environ.get(PROFILE_STAGE_ENV_VAR))
+
+
+def is_enabled():
+    return _trace is not None
+
+
+def disable():
+    global _trace
+    _trace = None
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Records the wall time, CPU time, peak memory growth and row count of the code run inside the block. Does nothing
+    but hand back a scratch dictionary while instrumentation is off.
+
+    The operating system only keeps the process's peak RSS since it started, so a stage's own peak can't be told apart
+    from an earlier stage's. Its 'peak_rss_growth_mb' is how far it raised that peak instead: the memory it needed
+    beyond the highest any stage before it reached, 0 for a stage that stayed under it. 'process_peak_rss_mb' is the
+    peak itself once the stage is done.
+
+    with instrumentation.stage('read csv') as record:
+        raw_ugly_data = pd.read_csv(file_path)
+        record['rows'] = len(raw_ugly_data)
+
+    :param name: stage name, such as 'read csv' or 'render: heartrate_vs_pace.png'
+    :param rows: number of rows the stage works on, if known up front
+    """
+    record = {'stage': name, 'rows': rows}
+
+    if _trace is None:
+        yield record
+        return
+
+    profiler = cProfile.Profile() if name == _trace['profile_stage'] else None
+
+    record['started_at'] = time.time()
+    peak_rss_start = get_peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+        record['wall_seconds'] = round(time.perf_counter() - wall_start, 6)
+        record['cpu_seconds'] = round(time.process_time() - cpu_start, 6)
+        peak_rss_end = get_peak_rss_mb()
+        record['peak_rss_growth_mb'] = round(peak_rss_end - peak_rss_start, 1)
+        record['process_peak_rss_mb'] = round(peak_rss_end, 1)
+        record['pid'] = os.getpid()
+
+        if profiler and _trace is not None:
+            record['profile_path'] = get_profile_path(name)
+            profiler.dump_stats(record['profile_path'])
+
+        if _trace is not None:
+            _trace['stages'].append(record)
+
+
+def get_peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / 2 ** 20 if sys.platform == 'darwin' else peak_rss / 2 ** 10
+
+
+def get_profile_path(stage_name):
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', stage_name).strip('_')
+
+    return f"{os.path.splitext(_trace['trace_path'])[0]}.{safe_name}.prof"
+
+
+def get_worker_settings():
+    """
+
+    :return: what a worker process needs to trace its stages for this process, to pass to init_worker, or None while
+    instrumentation is off
+    """
+    return (_trace['trace_path'], _trace['profile_stage']) if _trace is not None else None
+
+
+def init_worker(settings):
+    """
+    Starts an empty trace in a worker process, which is never written itself: the worker sends its records back with
+    drain_records. Forked workers would otherwise start with a copy of the parent's records.
+
+    :param settings: value returned by get_worker_settings in the parent process
+    """
+    global _trace
+
+    _trace = new_trace(*settings) if settings else None
+
+
+def drain_records():
+    """
+    Hands over the stage records collected so far, for worker processes to send back to the process tracing the run.
+
+    :return: list of stage records, empty while instrumentation is off
+    """
+    if _trace is None:
+        return []
+
+    records = _trace['stages']
+    _trace['stages'] = []
+
+    return records
+
+
+def add_records(records):
+    """
+
+    :param records: stage records returned by drain_records in a worker process
+    """
+    if _trace is not None:
+        _trace['stages'].extend(records)
+
+
+def write_trace():
+    """
+    Writes the trace as JSON, with the stages in the order they started.
+
+    :return: the path the trace was written to, or None while instrumentation is off
+    """
+    if _trace is None:
+        return None
+
+    trace = dict(_trace, finished_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                 stages=sorted(_trace['stages'], key=lambda record: record.get('started_at', 0)))
+
+    os.makedirs(os.path.dirname(_trace['trace_path']) or '.', exist_ok=True)
+    with open(_trace['trace_path'], 'w') as f:
+        json.dump(trace, f, indent=2, default=str)
+
+    return _trace['trace_path']
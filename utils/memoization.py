@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import pickle
+import types
+import numpy as np
+import pandas as pd
+from utils import instrumentation
+
+MANIFEST_NAME = '.manifest.json'
+# Tables and fits computed by run_stage are kept in this directory under the output directory, with their own manifest
+STAGE_CACHE_DIR = '.stage_cache'
+# Bump to compute every stage again, such as when the format they are saved in changes
+STAGE_VERSION = 1
+
+
+def hash_value(value, content_hash=None):
+    """
+    Hashes the content of a value, so two values holding the same data get the same key however they were built.
+    Handles the values stages pass around: data frames, series, arrays, dictionaries, lists, tuples, functions and
+    scalars. Functions are hashed by their code and the code of the module-level functions they call.
+
+    :param value: the value to hash
+    :param content_hash: hashlib object to add the value to, a new sha256 by default
+    :return: the hashlib object, call hexdigest() on it for the key
+    """
+    content_hash = content_hash or hashlib.sha256()
+
+    if isinstance(value, pd.DataFrame):
+        content_hash.update(b'DataFrame')
+        hash_value([str(column) for column in value.columns], content_hash)
+        hash_value([str(dtype) for dtype in value.dtypes], content_hash)
+        content_hash.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        content_hash.update(f'Series:{value.name}:{value.dtype}'.encode())
+        content_hash.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        content_hash.update(f'ndarray:{value.dtype}:{value.shape}'.encode())
+        if value.dtype == object:
+            hash_value(value.tolist(), content_hash)
+        else:
+            content_hash.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        content_hash.update(f'dict:{len(value)}'.encode())
+        for key in sorted(value, key=str):
+            hash_value(key, content_hash)
+            hash_value(value[key], content_hash)
+    elif isinstance(value, (list, tuple)):
+        content_hash.update(f'{type(value).__name__}:{len(value)}'.encode())
+        for item in value:
+            hash_value(item, content_hash)
+    elif isinstance(value, types.FunctionType):
+        hash_function(value, content_hash, set())
+    elif isinstance(value, types.CodeType):
+        content_hash.update(value.co_code)
+        # The bytecode refers to attributes, globals and locals by their index in these, so ax.set_xlabel and
+        # ax.set_ylabel only differ here
+        hash_value(value.co_names, content_hash)
+        hash_value(value.co_varnames, content_hash)
+        # Constants include the code of any nested functions
+        hash_value(value.co_consts, content_hash)
+    else:
+        content_hash.update(f'{type(value).__name__}:{value!r}'.encode())
+
+    return content_hash
+
+
+def hash_function(function, content_hash, seen):
+    """
+    Hashes a function's code, and the code of every function it calls through its module's globals, such as a drawing
+    function's helpers, so editing any of them changes the key. Each function is hashed once.
+
+    :param function: the function to hash
+    :param content_hash: hashlib object to add the function to
+    :param seen: set of the functions already hashed
+    """
+    seen.add(function)
+    content_hash.update(f'function:{function.__module__}.{function.__qualname__}'.encode())
+    hash_value(function.__code__, content_hash)
+
+    for name in sorted(get_referenced_names(function.__code__)):
+        referenced = function.__globals__.get(name)
+        if isinstance(referenced, types.FunctionType) and referenced not in seen:
+            content_hash.update(f'global:{name}'.encode())
+            hash_function(referenced, content_hash, seen)
+
+
+def get_referenced_names(code):
+    """
+
+    :param code: code object
+    :return: set of the global and attribute names used by the code and the code of the functions nested in it
+    """
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= get_referenced_names(constant)
+
+    return names
+
+
+def load_manifest(output_dir):
+    """
+
+    :param output_dir: directory the outputs, and their manifest, are saved in
+    :return: dictionary of output file name to the key it was last built from, empty if there is no manifest
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def save_manifest(manifest, output_dir):
+    os.makedirs(output_dir or '.', exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def is_unchanged(manifest, output_path, key):
+    """
+
+    :param manifest: dictionary returned by load_manifest
+    :param output_path: path of the output
+    :param key: key of the inputs the output would be built from now
+    :return: True if the output exists and was last built from the same inputs, so it doesn't need building again
+    """
+    return manifest.get(os.path.basename(output_path)) == key and os.path.exists(output_path)
+
+
+def run_stage(name, function, inputs, cache_dir=None):
+    """
+    Runs one stage of the pipeline, a table or fit that charts are drawn from, only when its inputs have changed. The
+    stage is keyed by a hash of function, which covers its code and the helpers it calls, and of inputs, the slice of
+    runs and the parameters it is computed from. Its result is saved in cache_dir, and the key in cache_dir's manifest,
+    so a later run with the same key loads the result instead. Charts are keyed by the data the stages hand them in
+    turn, so an unchanged stage leaves the charts drawn from it unchanged too.
+
+    :param name: stage name, unique within cache_dir, such as 'weekly averages'
+    :param function: function computing the stage, called with inputs as keyword arguments
+    :param inputs: dictionary of the stage's keyword arguments
+    :param cache_dir: directory the results and their manifest are saved in, or None to always run the stage
+    :return: what function returns
+    """
+    if cache_dir is None:
+        return function(**inputs)
+
+    key = hash_value([f'stage-v{STAGE_VERSION}', function, inputs]).hexdigest()
+    manifest = load_manifest(cache_dir)
+    result_path = os.path.join(cache_dir, f"{name.replace(' ', '_').replace(':', '')}.pkl")
+
+    if is_unchanged(manifest, result_path, key):
+        with instrumentation.stage(f'cached: {name}'):
+            with open(result_path, 'rb') as f:
+                return pickle.load(f)
+
+    result = function(**inputs)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(result_path + '.tmp', 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(result_path + '.tmp', result_path)
+
+    # The manifest is read again in case another stage was saved meanwhile
+    manifest = load_manifest(cache_dir)
+    manifest[os.path.basename(result_path)] = key
+    save_manifest(manifest, cache_dir)
+
+    return result
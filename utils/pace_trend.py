@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+from utils.quantile_sketch import get_quantile_column
+
+# Runs within this many days before a run make up its rolling window
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+# Runs within this many days either side of a run are weighed in its LOWESS fit
+DEFAULT_BANDWIDTH_DAYS = 120
+# Number of reweighting passes that make LOWESS shrug off outliers such as a run with a long stop
+LOWESS_ITERATIONS = 2
+# LOWESS is fitted once per this fraction of the bandwidth and interpolated in between, so many runs close together
+# cost no more than one
+LOWESS_DELTA_FRACTION = 1 / 40
+# Largest number of (run, neighbouring run) pairs weighed at once, to bound LOWESS's memory on long histories
+LOWESS_CHUNK_SIZE = 2_000_000
+
+
+def get_day_numbers(dates):
+    """
+
+    :param dates: sorted dates
+    :return: array of the dates as fractional days since 1970-01-01
+    """
+    return (pd.DatetimeIndex(dates) - pd.Timestamp(0)) / pd.Timedelta(days=1)
+
+
+def rolling_quantiles(dates, values, window_days=DEFAULT_WINDOW_DAYS, quantiles=DEFAULT_QUANTILES) -> pd.DataFrame:
+    """
+    Computes the quantiles of every run's trailing time window, the runs in the window_days up to and including it.
+    pandas keeps each window in a skip list as it slides, so this costs O(n log w) for n runs and w runs per window.
+
+    :param dates: sorted dates of the runs
+    :param values: values of the runs, such as their paces
+    :param window_days: length of the window in days
+    :param quantiles: quantiles between 0 and 1 to compute
+    :return: data frame with one row per run and a column per quantile, named by quantile_sketch.get_quantile_column
+    """
+    rolling = pd.Series(np.asarray(values, dtype=np.float64), index=pd.DatetimeIndex(dates)).rolling(
+        f'{window_days}D', min_periods=1)
+
+    return pd.DataFrame({get_quantile_column(quantile): rolling.quantile(quantile).to_numpy()
+                         for quantile in quantiles})
+
+
+def fit_local_lines(x, y, robustness_weights, x_eval, bandwidth):
+    """
+    Fits a tricube-weighted line through the points within bandwidth of each of x_eval. Every evaluation point only
+    looks at its own window, found by binary search, so the cost grows with the number of points times the points per
+    window rather than with the square of the number of points.
+
+    :param x: sorted array of x values
+    :param y: array of y values
+    :param robustness_weights: array of extra weights of the points, 1 for all to fit plain LOWESS
+    :param x_eval: array of x values to evaluate the fit at
+    :param bandwidth: half width of the windows
+    :return: array of the fitted values at x_eval, NaN where there are no points to fit
+    """
+    lo = np.searchsorted(x, x_eval - bandwidth, side='right')
+    hi = np.searchsorted(x, x_eval + bandwidth, side='left')
+    width = max(int((hi - lo).max(initial=0)), 1)
+    chunk_size = max(LOWESS_CHUNK_SIZE // width, 1)
+    fitted = np.full(len(x_eval), np.nan)
+
+    for start in range(0, len(x_eval), chunk_size):
+        stop = min(start + chunk_size, len(x_eval))
+        # One row per evaluation point holding the indexes of its window, padded to the widest window
+        neighbours = lo[start:stop, None] + np.arange(width)
+        in_window = neighbours < hi[start:stop, None]
+        neighbours = np.minimum(neighbours, len(x) - 1)
+
+        dx = x[neighbours] - x_eval[start:stop, None]
+        weights = np.where(in_window, (1 - np.abs(dx / bandwidth) ** 3) ** 3, 0) * robustness_weights[neighbours]
+        y_window = y[neighbours]
+
+        s0 = weights.sum(axis=1)
+        s1 = (weights * dx).sum(axis=1)
+        s2 = (weights * dx * dx).sum(axis=1)
+        t0 = (weights * y_window).sum(axis=1)
+        t1 = (weights * dx * y_window).sum(axis=1)
+        determinant = s0 * s2 - s1 * s1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Where every run in the window is on the same day there is no line to fit, so take the weighted mean
+            fitted[start:stop] = np.where(determinant > 1e-9 * s0 * s0 * bandwidth * bandwidth,
+                                          (s2 * t0 - s1 * t1) / determinant, t0 / s0)
+
+    return fitted
+
+
+def lowess(dates, values, bandwidth_days=DEFAULT_BANDWIDTH_DAYS, iterations=LOWESS_ITERATIONS):
+    """
+    Smooths values over actual dates with locally weighted linear regression, so gaps between runs are spaced by time
+    rather than by row, and the ends of the history follow the nearby runs instead of a global polynomial's tails.
+    Like statsmodels' delta, the lines are only fitted at the centers of the occupied slots of
+    LOWESS_DELTA_FRACTION * bandwidth_days, and interpolated between them.
+
+    :param dates: sorted dates of the runs
+    :param values: values of the runs, such as their paces, NaN where missing
+    :param bandwidth_days: half width, in days, of the window of runs weighed in each fit
+    :param iterations: number of robustifying passes down-weighting runs far from the trend
+    :return: array of the smoothed value at each run
+    """
+    x = np.asarray(get_day_numbers(dates), dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+
+    present = np.isfinite(y)
+    x_present = x[present]
+    y_present = y[present]
+    if not len(x_present):
+        return np.full(len(x), np.nan)
+
+    # Slots are counted from 1970-01-01, so the same runs always get the same slots
+    delta = bandwidth_days * LOWESS_DELTA_FRACTION
+    x_fit = np.unique(np.round(x_present / delta) * delta)
+    robustness_weights = np.ones(len(x_present))
+
+    for _ in range(iterations):
+        residuals = y_present - np.interp(x_present, x_fit, fit_local_lines(x_present, y_present, robustness_weights,
+                                                                            x_fit, bandwidth_days))
+        scale = 6 * np.median(np.abs(residuals))
+        if not scale > 0:
+            break
+        # Bisquare weights, 0 for runs more than six median absolute residuals off the trend
+        robustness_weights = np.clip(1 - (residuals / scale) ** 2, 0, None) ** 2
+
+    return np.interp(x, x_fit, fit_local_lines(x_present, y_present, robustness_weights, x_fit, bandwidth_days))
+
+
+def create_pace_trend_df(dates, paces, window_days=DEFAULT_WINDOW_DAYS, quantiles=DEFAULT_QUANTILES,
+                         bandwidth_days=DEFAULT_BANDWIDTH_DAYS) -> pd.DataFrame:
+    """
+
+    :param dates: sorted dates of the runs
+    :param paces: paces of the runs
+    :param window_days: length of the rolling quantiles' trailing window in days
+    :param quantiles: quantiles of the rolling window to compute
+    :param bandwidth_days: half width, in days, of the LOWESS window
+    :return: data frame with one row per run of its 'Activity Date', 'Pace', rolling quantiles and 'LOWESS'
+    """
+    trend_df = pd.DataFrame({'Activity Date': pd.DatetimeIndex(dates), 'Pace': np.asarray(paces, dtype=np.float64)})
+    quantiles_df = rolling_quantiles(dates, paces, window_days, quantiles)
+    for column in quantiles_df:
+        trend_df[column] = quantiles_df[column].to_numpy()
+    trend_df['LOWESS'] = lowess(dates, paces, bandwidth_days)
+
+    return trend_df
+
+
+def update_pace_trend_df(trend_df: pd.DataFrame, dates, paces, window_days=DEFAULT_WINDOW_DAYS,
+                         quantiles=DEFAULT_QUANTILES, bandwidth_days=DEFAULT_BANDWIDTH_DAYS) -> pd.DataFrame:
+    """
+    Extends a trend computed by create_pace_trend_df to runs added after it, giving exactly the trend a full recompute
+    would. A run's rolling quantiles only depend on the window_days before it, so only the new runs' are computed,
+    from a short tail of the history. LOWESS is smoothed over every run again: its robustness weights are scaled by the
+    median residual of the whole history, which the new runs shift, so any fit however old can change with them. The
+    trend is computed from scratch instead if the runs it covers have changed.
+
+    :param trend_df: data frame returned by create_pace_trend_df or update_pace_trend_df, or None
+    :param dates: sorted dates of all the runs, the runs trend_df covers followed by the new ones
+    :param paces: paces of all the runs
+    :param window_days: length of the rolling quantiles' trailing window in days, as trend_df was computed with
+    :param quantiles: quantiles of the rolling window, as trend_df was computed with
+    :param bandwidth_days: half width, in days, of the LOWESS window, as trend_df was computed with
+    :return: data frame like create_pace_trend_df's of all the runs
+    """
+    dates = pd.DatetimeIndex(dates)
+    paces = np.asarray(paces, dtype=np.float64)
+    num_done = 0 if trend_df is None else len(trend_df)
+
+    if not num_done or num_done > len(dates) or not (
+            trend_df['Activity Date'].to_numpy() == dates[:num_done].to_numpy()).all() or not np.array_equal(
+            trend_df['Pace'].to_numpy(), paces[:num_done], equal_nan=True):
+        return create_pace_trend_df(dates, paces, window_days, quantiles, bandwidth_days)
+    if num_done == len(dates):
+        return trend_df
+
+    x = np.asarray(get_day_numbers(dates), dtype=np.float64)
+    first_new_day = x[num_done]
+
+    # The new runs' trailing windows start at most window_days before the first new run
+    quantile_start = np.searchsorted(x, first_new_day - window_days)
+    quantiles_df = rolling_quantiles(dates[quantile_start:], paces[quantile_start:], window_days, quantiles)
+
+    new_df = pd.DataFrame({'Activity Date': dates[num_done:], 'Pace': paces[num_done:]})
+    for column in quantiles_df:
+        new_df[column] = quantiles_df[column].to_numpy()[num_done - quantile_start:]
+
+    trend_df = pd.concat([trend_df, new_df], ignore_index=True)
+    trend_df['LOWESS'] = lowess(dates, paces, bandwidth_days)
+
+    return trend_df
@@ -0,0 +1,208 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils import instrumentation
+from utils import memoization
+
+# Bump when a change to the charts isn't visible in their drawing functions' code, such as a new matplotlib style, so
+# every chart is redrawn once
+CHART_VERSION = 1
+
+# A chart to render: draw(data, output_path) builds the figure from data and saves it to output_path
+ChartJob = namedtuple('ChartJob', ['draw', 'data', 'output_path'])
+
+
+def use_offscreen_backend():
+    """
+    Switches matplotlib to the non-interactive Agg backend, so charts are only ever written to files. matplotlib is only
+    imported here, once charts are actually rendered, so the stats-only paths never pay for loading it.
+    """
+    import matplotlib
+
+    matplotlib.use('Agg', force=True)
+
+
+def save_and_close(fig, output_path):
+    """
+
+    :param fig: matplotlib figure to save
+    :param output_path: file path the figure is saved to
+    :return: output_path
+    """
+    import matplotlib.pyplot as plt
+
+    fig.savefig(output_path)
+    plt.close(fig)
+
+    return output_path
+
+
+def create_density_grid(x, y, bins=(60, 40), percentiles=(0.5, 99.5)):
+    """
+    Bins points into a 2D grid in one vectorized pass, so a chart of them can be drawn as a single image whatever the
+    number of points. The grid spans the given percentiles of each axis, so a few wild values (GPS glitches, sensor
+    dropouts) don't squash everything else into a corner; points outside it are left out.
+
+    :param x: array of x values, NaN where missing
+    :param y: array of y values, NaN where missing
+    :param bins: number of bins along x and along y
+    :param percentiles: lower and upper percentiles of each axis the grid spans
+    :return: dictionary with 'counts', an array of shape (y bins, x bins) of the points per cell, 'extent', the
+    (x min, x max, y min, y max) the grid spans, 'x_centers', the centers of the x bins, and 'mean_y' and 'count_x',
+    the mean y and the number of points per x bin (NaN and 0 for empty bins)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_x_bins, n_y_bins = bins
+
+    present = np.isfinite(x) & np.isfinite(y)
+    x = x[present]
+    y = y[present]
+    if not len(x):
+        raise ValueError("There are no points with both values to bin.")
+
+    x_range = np.percentile(x, percentiles)
+    y_range = np.percentile(y, percentiles)
+    # Widen flat axes so every point falls into a bin
+    x_range = x_range if x_range[1] > x_range[0] else x_range + [-0.5, 0.5]
+    y_range = y_range if y_range[1] > y_range[0] else y_range + [-0.5, 0.5]
+
+    x_bin = np.floor((x - x_range[0]) / (x_range[1] - x_range[0]) * n_x_bins).astype(np.int64)
+    y_bin = np.floor((y - y_range[0]) / (y_range[1] - y_range[0]) * n_y_bins).astype(np.int64)
+    # Points exactly on the upper edge belong in the last bin
+    x_bin[x == x_range[1]] = n_x_bins - 1
+    y_bin[y == y_range[1]] = n_y_bins - 1
+
+    inside = (x_bin >= 0) & (x_bin < n_x_bins) & (y_bin >= 0) & (y_bin < n_y_bins)
+    x_bin = x_bin[inside]
+    y_bin = y_bin[inside]
+
+    counts = np.bincount(y_bin * n_x_bins + x_bin, minlength=n_x_bins * n_y_bins).reshape(n_y_bins, n_x_bins)
+    count_x = np.bincount(x_bin, minlength=n_x_bins)
+    sum_y = np.bincount(x_bin, weights=y[inside], minlength=n_x_bins)
+
+    x_edges = np.linspace(x_range[0], x_range[1], n_x_bins + 1)
+
+    return {
+        'counts': counts,
+        'extent': (x_range[0], x_range[1], y_range[0], y_range[1]),
+        'x_centers': (x_edges[:-1] + x_edges[1:]) / 2,
+        'mean_y': np.divide(sum_y, count_x, out=np.full(n_x_bins, np.nan), where=count_x > 0),
+        'count_x': count_x,
+    }
+
+
+def draw_density_grid(ax, density_grid, cmap='viridis'):
+    """
+    Draws a grid returned by create_density_grid on ax as one image, with empty cells left blank, and the mean y per x
+    bin on top of it.
+
+    :param ax: matplotlib axes to draw on
+    :param density_grid: dictionary returned by create_density_grid
+    :param cmap: name of the colormap of the counts
+    :return: the image, for adding a colorbar
+    """
+    image = ax.imshow(np.ma.masked_equal(density_grid['counts'], 0), origin='lower', aspect='auto',
+                      extent=density_grid['extent'], cmap=cmap, interpolation='nearest')
+    ax.plot(density_grid['x_centers'], density_grid['mean_y'], color='white', marker='.', linestyle='none',
+            markeredgecolor='black', label='Binned mean')
+
+    return image
+
+
+def render_chart(chart_job: ChartJob):
+    """
+
+    :param chart_job: the chart to render
+    :return: the path the chart was saved to
+    """
+    with instrumentation.stage(f'render: {os.path.basename(chart_job.output_path)}'):
+        os.makedirs(os.path.dirname(chart_job.output_path) or '.', exist_ok=True)
+        chart_job.draw(chart_job.data, chart_job.output_path)
+
+    return chart_job.output_path
+
+
+def init_render_worker(instrumentation_settings):
+    use_offscreen_backend()
+    instrumentation.init_worker(instrumentation_settings)
+
+
+def render_chart_in_worker(chart_job: ChartJob):
+    """
+
+    :param chart_job: the chart to render
+    :return: tuple of the path the chart was saved to and the instrumentation records of rendering it
+    """
+    output_path = render_chart(chart_job)
+
+    return output_path, instrumentation.drain_records()
+
+
+def get_chart_key(chart_job: ChartJob):
+    """
+
+    :param chart_job: the chart to render
+    :return: hex digest of the chart's drawing function, data and CHART_VERSION, the same for the same chart
+    """
+    content_hash = memoization.hash_value(f'chart-v{CHART_VERSION}')
+
+    return memoization.hash_value([chart_job.draw, chart_job.data], content_hash).hexdigest()
+
+
+def render_charts(chart_jobs, max_workers=None, force=False):
+    """
+    Renders independent charts off-screen. Each chart's figure is closed as soon as it has been saved.
+
+    Every chart is keyed by a hash of its drawing function and data, which hold the slice of runs and every parameter
+    it was built from, and the keys are kept in a manifest in each output directory. A chart whose file is still
+    there and whose key hasn't changed since it was last saved isn't drawn again.
+
+    :param chart_jobs: list of ChartJob
+    :param max_workers: number of worker processes to render in, one per CPU by default. With 1 the charts are rendered
+    one after the other in this process, which is what callers that are already running in a worker pool want.
+    :param force: if True, draw every chart even if it is unchanged
+    :return: list of the paths the charts were saved to, in the order of chart_jobs
+    """
+    with instrumentation.stage('chart keys', rows=len(chart_jobs)):
+        chart_keys = [get_chart_key(chart_job) for chart_job in chart_jobs]
+        output_dirs = {os.path.dirname(chart_job.output_path) for chart_job in chart_jobs}
+        manifests = {output_dir: memoization.load_manifest(output_dir) for output_dir in output_dirs}
+        changed_jobs = [chart_job for chart_job, chart_key in zip(chart_jobs, chart_keys)
+                        if force or not memoization.is_unchanged(manifests[os.path.dirname(chart_job.output_path)],
+                                                                 chart_job.output_path, chart_key)]
+
+    render_changed_charts(changed_jobs, max_workers)
+
+    # Only record the charts once they have been saved, so a failed run draws them again next time
+    for chart_job, chart_key in zip(chart_jobs, chart_keys):
+        manifests[os.path.dirname(chart_job.output_path)][os.path.basename(chart_job.output_path)] = chart_key
+    for output_dir, manifest in manifests.items():
+        memoization.save_manifest(manifest, output_dir)
+
+    return [chart_job.output_path for chart_job in chart_jobs]
+
+
+def render_changed_charts(chart_jobs, max_workers=None):
+    """
+
+    :param chart_jobs: list of ChartJob to draw
+    :param max_workers: number of worker processes to render in, see render_charts
+    """
+    if not chart_jobs:
+        return
+
+    if max_workers == 1 or len(chart_jobs) <= 1:
+        use_offscreen_backend()
+        for chart_job in chart_jobs:
+            render_chart(chart_job)
+        return
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(chart_jobs))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_render_worker,
+                             initargs=(instrumentation.get_worker_settings(),)) as executor:
+        results = list(executor.map(render_chart_in_worker, chart_jobs))
+
+    for _, records in results:
+        instrumentation.add_records(records)
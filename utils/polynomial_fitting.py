@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def fit_polynomials(x, y, degrees, n_folds=5, max_workers=None, seed=0):
+    """
+    Fits polynomials of every candidate degree to every target at once.
+
+    The design matrix is built once up to the highest degree and QR-factorized once. The factorization of the first
+    degree + 1 columns is the leading block of that same factorization, so every degree and every target is solved by
+    back substitution against it. Cross-validation factorizes each fold's training rows once in the same way, and the
+    folds are evaluated on a thread pool (the linear algebra releases the GIL).
+
+    :param x: array of shape (n,)
+    :param y: array of shape (n,) or (n, number of targets)
+    :param degrees: list of candidate polynomial degrees
+    :param n_folds: number of cross-validation folds, or None to skip cross-validation
+    :param max_workers: number of threads the folds are evaluated on, one per fold by default
+    :param seed: seed of the random fold assignment
+    :return: dictionary of degree to a dictionary with 'coefficients', an array of shape (number of targets,
+    degree + 1) in np.polyval order, and 'r_squared' and 'cv_rmse', arrays of shape (number of targets,)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    y_2d = y.reshape(len(y), -1)
+    max_degree = max(degrees)
+
+    if len(x) <= max_degree:
+        raise ValueError(f"Fitting a degree {max_degree} polynomial needs more than {max_degree} points, "
+                         f"got {len(x)}.")
+
+    # Scale x onto [-1, 1] so the powers of x stay well conditioned
+    domain = [x.min(), x.max()] if x.max() > x.min() else [x.min() - 1, x.min() + 1]
+    vandermonde = np.polynomial.polynomial.polyvander(scale_to_window(x, domain), max_degree)
+
+    scaled_coefficients = solve_all_degrees(vandermonde, y_2d, degrees)
+    cv_rmse = cross_validate(vandermonde, y_2d, degrees, n_folds, max_workers, seed)
+    sst = ((y_2d - y_2d.mean(axis=0)) ** 2).sum(axis=0)
+
+    fits = {}
+    for degree in degrees:
+        predicted = vandermonde[:, :degree + 1] @ scaled_coefficients[degree]
+        sse = ((y_2d - predicted) ** 2).sum(axis=0)
+
+        fits[degree] = {
+            'coefficients': np.array([to_polyval_order(target_coefficients, domain)
+                                      for target_coefficients in scaled_coefficients[degree].T]),
+            'r_squared': 1 - sse / sst,
+            'cv_rmse': cv_rmse[degree],
+        }
+
+    return fits
+
+
+def select_degree(fits, target_index=0):
+    """
+
+    :param fits: dictionary returned by fit_polynomials
+    :param target_index: which target to pick the degree for
+    :return: the degree with the lowest cross-validated error, or the highest R^2 without cross-validation
+    """
+    cv_rmse = {degree: fit['cv_rmse'][target_index] for degree, fit in fits.items()}
+    if not all(np.isnan(error) for error in cv_rmse.values()):
+        return min(cv_rmse, key=lambda degree: np.nan_to_num(cv_rmse[degree], nan=np.inf))
+
+    return max(fits, key=lambda degree: fits[degree]['r_squared'][target_index])
+
+
+def clip_degrees(degrees, num_points, n_folds=5):
+    """
+    Drops the candidate degrees that too few points can fit. A degree needs more points than it has coefficients less
+    one, in every cross-validation training fold too, so if some degrees can be cross-validated only those are kept,
+    and otherwise every degree the whole set of points can fit is kept and picked by R^2.
+
+    :param degrees: list of candidate polynomial degrees
+    :param num_points: number of points the polynomials are fitted to
+    :param n_folds: number of cross-validation folds fit_polynomials is called with, or None
+    :return: list of the degrees fit_polynomials can fit, in the order given
+    """
+    cv_degrees = []
+    if n_folds and n_folds >= 2:
+        smallest_training_fold = num_points - int(np.ceil(num_points / n_folds))
+        cv_degrees = [degree for degree in degrees if degree < smallest_training_fold]
+
+    degrees = cv_degrees or [degree for degree in degrees if degree < num_points]
+    if not degrees:
+        raise ValueError(f"Fitting a polynomial needs more than one point, got {num_points}.")
+
+    return degrees
+
+
+def scale_to_window(x, domain):
+    return (2 * x - domain[0] - domain[1]) / (domain[1] - domain[0])
+
+
+def to_polyval_order(scaled_coefficients, domain):
+    # Undo the scaling of x and flip from increasing powers to np.polyval's decreasing powers
+    polynomial = np.polynomial.Polynomial(scaled_coefficients, domain=domain, window=[-1, 1]).convert()
+    coefficients = np.zeros(len(scaled_coefficients))
+    coefficients[:len(polynomial.coef)] = polynomial.coef
+
+    return coefficients[::-1]
+
+
+def solve_all_degrees(vandermonde, y_2d, degrees):
+    """
+
+    :param vandermonde: design matrix with columns of increasing powers, up to the highest degree
+    :param y_2d: array of shape (n, number of targets)
+    :param degrees: list of polynomial degrees
+    :return: dictionary of degree to least-squares coefficients of shape (degree + 1, number of targets), in increasing
+    powers
+    """
+    from scipy.linalg import solve_triangular
+
+    q, r = np.linalg.qr(vandermonde)
+    qty = q.T @ y_2d
+
+    return {degree: solve_triangular(r[:degree + 1, :degree + 1], qty[:degree + 1]) for degree in degrees}
+
+
+def cross_validate(vandermonde, y_2d, degrees, n_folds, max_workers, seed):
+    """
+
+    :return: dictionary of degree to the root mean squared out-of-fold error per target, NaN when cross-validation is
+    skipped or some training fold is too small for the highest degree
+    """
+    n = len(y_2d)
+    skipped = {degree: np.full(y_2d.shape[1], np.nan) for degree in degrees}
+    if not n_folds or n_folds < 2 or n - int(np.ceil(n / n_folds)) <= max(degrees):
+        return skipped
+
+    fold_of_row = np.random.default_rng(seed).permutation(n) % n_folds
+
+    def evaluate_fold(fold):
+        train = fold_of_row != fold
+        test = ~train
+        coefficients = solve_all_degrees(vandermonde[train], y_2d[train], degrees)
+
+        return {degree: ((y_2d[test] - vandermonde[test, :degree + 1] @ coefficients[degree]) ** 2).sum(axis=0)
+                for degree in degrees}
+
+    with ThreadPoolExecutor(max_workers=max_workers or n_folds) as executor:
+        fold_sse = list(executor.map(evaluate_fold, range(n_folds)))
+
+    return {degree: np.sqrt(sum(sse[degree] for sse in fold_sse) / n) for degree in degrees}
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+# Sketches are t-digests kept as tidy data frames: one row per centroid, holding the key columns, the 'Metric' it
+# summarises, and the centroid's 'Mean' and 'Weight' (number of values). Each sketch keeps at most about
+# COMPRESSION / 2 centroids whatever the number of values, small ones at the tails where quantiles need them and big
+# ones in the middle. Sketches of the same key merge by pooling their centroids and compressing again.
+COMPRESSION = 200
+# The scale function below is flattest at the median, where one unit covers pi / COMPRESSION of the values, so no
+# centroid spans more than that and the rank of an estimated quantile is within this of the quantile asked for
+RANK_ERROR = np.pi / COMPRESSION
+
+CENTROID_COLUMNS = ['Metric', 'Mean', 'Weight']
+
+
+def get_quantile_column(quantile):
+    """
+
+    :param quantile: quantile between 0 and 1, such as 0.5
+    :return: name of the column holding it, such as 'P50'
+    """
+    return f'P{round(quantile * 100):g}'
+
+
+def create_sketches(dataframe: pd.DataFrame, keys, value_columns) -> pd.DataFrame:
+    """
+
+    :param dataframe: data frame of one row per value, such as running_df
+    :param keys: list of columns to keep a sketch per, such as ['Athlete', 'Activity Year']
+    :param value_columns: list of columns to sketch, each becoming a Metric
+    :return: data frame of the centroids of a sketch per key and value column, missing values left out
+    """
+    values = dataframe[list(keys) + list(value_columns)].melt(id_vars=list(keys), value_vars=list(value_columns),
+                                                              var_name='Metric', value_name='Mean')
+    values = values.dropna(subset=['Mean'])
+    values['Mean'] = values['Mean'].astype(np.float64)
+    values['Weight'] = 1.0
+
+    return compress_sketches(values, keys)
+
+
+def compress_sketches(centroids: pd.DataFrame, keys) -> pd.DataFrame:
+    """
+    Compresses the centroids of every key and metric in one vectorized pass. Centroids are sorted by mean within
+    their key and each one is assigned by the quantile at its middle to a unit of the t-digest scale function
+    k(q) = COMPRESSION / (2 pi) * arcsin(2q - 1), which is steep near q = 0 and q = 1. The centroids falling in the same
+    unit are pooled into one.
+
+    :param centroids: data frame of centroids, such as several sketches concatenated
+    :param keys: list of columns to keep a sketch per. Key columns of centroids left out are merged over
+    :return: data frame of the compressed centroids of a sketch per key and metric
+    """
+    keys = list(keys) + ['Metric']
+    if centroids.empty:
+        return pd.DataFrame(columns=keys + CENTROID_COLUMNS[1:])
+
+    centroids = centroids.sort_values(keys + ['Mean'], kind='stable', ignore_index=True)
+    groups = centroids.groupby(keys, sort=False, dropna=False)
+
+    weight = centroids['Weight'].to_numpy()
+    cumulative_weight = groups['Weight'].cumsum().to_numpy()
+    total_weight = groups['Weight'].transform('sum').to_numpy()
+    middle_quantile = (cumulative_weight - weight / 2) / total_weight
+    unit = np.floor(COMPRESSION / (2 * np.pi) * np.arcsin(2 * middle_quantile - 1))
+
+    centroids = centroids.assign(Unit=unit, Moment=centroids['Mean'] * weight)
+    compressed = centroids.groupby(keys + ['Unit'], sort=True, dropna=False)[['Moment', 'Weight']].sum().reset_index()
+    compressed['Mean'] = compressed['Moment'] / compressed['Weight']
+
+    return compressed[keys + CENTROID_COLUMNS[1:]]
+
+
+def get_quantiles(sketches: pd.DataFrame, keys, quantiles=(0.1, 0.5, 0.9)) -> pd.DataFrame:
+    """
+    Estimates quantiles by interpolating between the centroids' means, placed at the middle of their cumulative
+    weight. Sketches are first merged over the key columns left out of keys, such as every athlete or every year.
+
+    :param sketches: data frame of centroids, as create_sketches returns
+    :param keys: list of columns to answer the quantiles per
+    :param quantiles: quantiles between 0 and 1
+    :return: data frame with one row per key and metric, holding the 'Count' of values and a column per quantile named
+    like 'P50'
+    """
+    sketches = compress_sketches(sketches, keys)
+    keys = list(keys) + ['Metric']
+    if sketches.empty:
+        return pd.DataFrame(columns=keys + ['Count'] + [get_quantile_column(quantile) for quantile in quantiles])
+
+    # The compressed sketches lie end to end, each sorted by mean, so one interpolation over all of them answers every
+    # key once each target is placed within its own sketch
+    weight = sketches['Weight'].to_numpy()
+    cumulative_weight = np.cumsum(weight)
+    centers = cumulative_weight - weight / 2
+    means = sketches['Mean'].to_numpy()
+
+    ends = np.cumsum(sketches.groupby(keys, sort=False, dropna=False).size().to_numpy())
+    starts = np.concatenate([[0], ends[:-1]]).astype(np.int64)
+    start_weight = cumulative_weight[starts] - weight[starts]
+    total_weight = cumulative_weight[ends - 1] - start_weight
+
+    quantiles_df = sketches.loc[starts, keys].reset_index(drop=True)
+    quantiles_df['Count'] = total_weight
+
+    for quantile in quantiles:
+        # Targets before the first centroid's middle or after the last one's are that centroid's mean
+        targets = np.clip(start_weight + quantile * total_weight, centers[starts], centers[ends - 1])
+        quantiles_df[get_quantile_column(quantile)] = np.interp(targets, centers, means)
+
+    return quantiles_df
@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-import inputs
+from utils import instrumentation
 
 
 def create_running_df(cleaned_df: pd.DataFrame) -> pd.DataFrame:
@@ -13,7 +13,9 @@ def create_running_df(cleaned_df: pd.DataFrame) -> pd.DataFrame:
 
     if 'Run' in unique_activities:
         print(f"Your activities included: {unique_activities}")
-        running_df = cleaned_df[cleaned_df['Activity Type'] == 'Run'].copy()
+        with instrumentation.stage('running filter', rows=len(cleaned_df)):
+            # take already returns new rows, so there is no need for a further copy before adding columns to them
+            running_df = cleaned_df.take(np.flatnonzero(cleaned_df['Activity Type'] == 'Run'))
     else:
         raise ValueError(f"No running activities recorded. Try again. Activities recorded include: "
                          f"{unique_activities}")
@@ -36,11 +38,84 @@ def distance_m_to_mi(dataframe: pd.DataFrame, distance_m_col_name='Distance.1',
 
     """
 
-    for index, row in dataframe[distance_m_col_name].items():
-        if row is np.nan:
-            pass
-        else:
-            row_mi = row * m_to_mi_conversion
-            dataframe.loc[index, 'Distance in Miles'] = row_mi
+    # NaN distances stay NaN
+    dataframe['Distance in Miles'] = dataframe[distance_m_col_name] * m_to_mi_conversion
 
-    return dataframe
\ No newline at end of file
+    return dataframe
+
+
+def add_unit_columns(dataframe: pd.DataFrame, distance_m_col_name='Distance.1', m_to_mi_conversion=1/1610):
+    """
+    Derives every unit column used by the analyses in one vectorized pass. Missing inputs propagate as NaN, and so do
+    paces for activities without a positive distance, rather than dividing by zero.
+
+    dataframe: dataframe containing the distance in meters, 'Moving Time' and 'Elapsed Time' in seconds and
+    'Apparent Temperature' in Celsius
+    distance_m_col_name: string referring to the name of the column with distance in meters
+    m_to_mi_conversion: float constant referring to the conversion factor from meters to miles
+    returns dataframe with new columns 'Distance in Miles', 'Distance in Kilometers', 'Pace in Mins per Mile',
+    'Pace in Mins per Kilometer', 'Moving Time in Minutes', 'Moving Time in Hours', 'Elapsed Time in Minutes',
+    'Elapsed Time in Hours' and 'Apparent Temperature (Fahrenheit)'
+    """
+
+    with instrumentation.stage('unit conversion', rows=len(dataframe)):
+        distance_m = dataframe[distance_m_col_name].where(dataframe[distance_m_col_name] > 0)
+        moving_time_in_minutes = dataframe['Moving Time'] / 60
+        elapsed_time_in_minutes = dataframe['Elapsed Time'] / 60
+
+        unit_columns = pd.DataFrame({
+            'Distance in Miles': dataframe[distance_m_col_name] * m_to_mi_conversion,
+            'Distance in Kilometers': dataframe[distance_m_col_name] / 1000,
+            'Pace in Mins per Mile': moving_time_in_minutes / (distance_m * m_to_mi_conversion),
+            'Pace in Mins per Kilometer': moving_time_in_minutes / (distance_m / 1000),
+            'Moving Time in Minutes': moving_time_in_minutes,
+            'Moving Time in Hours': moving_time_in_minutes / 60,
+            'Elapsed Time in Minutes': elapsed_time_in_minutes,
+            'Elapsed Time in Hours': elapsed_time_in_minutes / 60,
+            'Apparent Temperature (Fahrenheit)': (dataframe['Apparent Temperature'] * 9 / 5) + 32,
+        }, index=dataframe.index)
+
+        # Assign all columns at once so the frame is only reallocated one time
+        dataframe[unit_columns.columns] = unit_columns
+
+    return dataframe
+
+
+def index_by_activity_date(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    dataframe: dataframe containing an 'Activity Date' datetime column
+    returns the same rows sorted by 'Activity Date' and indexed by it, keeping the column too, so date windows can be
+    sliced with select_date_range
+    """
+
+    dataframe = dataframe.set_index(pd.DatetimeIndex(dataframe['Activity Date'], name=None))
+
+    return dataframe.sort_index(kind='stable')
+
+
+def select_date_range(dataframe: pd.DataFrame, start_date=None, end_date=None, inclusive='neither') -> pd.DataFrame:
+    """
+    Finds the window by binary search on the sorted index, so it costs O(log n) plus the rows returned, and returns
+    a slice of dataframe rather than a filtered copy.
+
+    dataframe: dataframe returned by index_by_activity_date, or any subset of its rows in the same order
+    start_date: first date of the window, such as '01-01-2019', or None for no lower bound
+    end_date: last date of the window, such as '05-01-2023', or None for no upper bound
+    inclusive: which of the bounds are part of the window, one of 'neither' (the default), 'left', 'right' or 'both'
+    returns the rows of dataframe whose 'Activity Date' is within the window
+    """
+
+    index = dataframe.index
+    if not isinstance(index, pd.DatetimeIndex) or not index.is_monotonic_increasing:
+        raise ValueError("Date ranges can only be selected from a dataframe sorted and indexed by 'Activity Date'. "
+                         "Use index_by_activity_date first.")
+
+    start = 0
+    if start_date is not None:
+        start = index.searchsorted(pd.Timestamp(start_date), side='left' if inclusive in ('left', 'both') else 'right')
+
+    stop = len(index)
+    if end_date is not None:
+        stop = index.searchsorted(pd.Timestamp(end_date), side='right' if inclusive in ('right', 'both') else 'left')
+
+    return dataframe.iloc[start:stop]